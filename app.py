@@ -1,18 +1,20 @@
 import os
-import platform
 import datetime
 import json
 import requests
 import base64
 import time # <-- Diperlukan untuk jeda
-from requests.auth import HTTPDigestAuth
+import itertools
 from flask import (Flask, render_template, request, redirect, url_for, 
-                   flash, jsonify, Response, g)
+                   flash, jsonify, Response, g, stream_with_context)
 from flask_login import (LoginManager, UserMixin, login_user, logout_user,
                          login_required, current_user)
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
 import database as db
+import isapi_client
+import hikvision_api
+import isapi_async
 import ai_service
 from dotenv import load_dotenv
 load_dotenv()
@@ -88,6 +90,8 @@ def settings():
         'whatsapp_api_url': db.get_setting('whatsapp_api_url', default='http://10.1.105.164:60001'),
         'api_fail_enabled': db.get_setting('api_fail_enabled', default='false'),
         'api_fail_max_retry': db.get_setting('api_fail_max_retry', default='5'),
+        'wa_coalesce_seconds': db.get_setting('wa_coalesce_seconds', default='30'),
+        'wa_rate_per_minute': db.get_setting('wa_rate_per_minute', default='6'),
         
         # Pengaturan Worker
         'ping_max_fail': db.get_setting('ping_max_fail', default='5'),
@@ -98,12 +102,26 @@ def settings():
         # 8 Pengaturan Baru
         'poll_interval': db.get_setting('poll_interval', default='2'),
         'event_sleep_delay': db.get_setting('event_sleep_delay', default='1'),
+        'governor_max_rate': db.get_setting('governor_max_rate', default='20'),
+        'governor_latency_target': db.get_setting('governor_latency_target', default='2'),
         'realtime_tolerance': db.get_setting('realtime_tolerance', default='120'),
         'request_timeout': db.get_setting('request_timeout', default='30'),
         'api_queue_limit': db.get_setting('api_queue_limit', default='5'),
+        'api_lease_seconds': db.get_setting('api_lease_seconds', default='120'),
+        'api_retry_base_seconds': db.get_setting('api_retry_base_seconds', default='10'),
+        'api_retry_max_seconds': db.get_setting('api_retry_max_seconds', default='600'),
+        'lane_weight_realtime': db.get_setting('lane_weight_realtime', default='4'),
+        'lane_weight_catchup': db.get_setting('lane_weight_catchup', default='1'),
+        'api_concurrency_min': db.get_setting('api_concurrency_min', default='1'),
+        'api_concurrency_max': db.get_setting('api_concurrency_max', default='20'),
+        'api_latency_target_ms': db.get_setting('api_latency_target_ms', default='1000'),
+        'dead_letter_replay_batch': db.get_setting('dead_letter_replay_batch', default='100'),
+        'dead_letter_replay_interval': db.get_setting('dead_letter_replay_interval', default='10'),
         'event_batch_max': db.get_setting('event_batch_max', default='100'),
         'sync_download_retries': db.get_setting('sync_download_retries', default='5'),
         'worker_download_retries': db.get_setting('worker_download_retries', default='2'),
+        'catchup_parallel_windows': db.get_setting('catchup_parallel_windows', default='3'),
+        'push_gap_repair_interval': db.get_setting('push_gap_repair_interval', default='300'),
     }
     # Kirim SEMUA pengaturan sebagai satu variabel 'settings'
     return render_template('settings.html', settings=settings_data)
@@ -163,6 +181,8 @@ def save_notification_settings():
     # Ambil data baru
     api_fail_enabled = 'true' if request.form.get('api_fail_enabled') else 'false'
     api_fail_max_retry = request.form.get('api_fail_max_retry', '5')
+    wa_coalesce_seconds = request.form.get('wa_coalesce_seconds', '30')
+    wa_rate_per_minute = request.form.get('wa_rate_per_minute', '6')
 
     all_valid = True
     
@@ -191,6 +211,8 @@ def save_notification_settings():
         # Simpan data baru
         db.update_setting('api_fail_enabled', api_fail_enabled)
         db.update_setting('api_fail_max_retry', api_fail_max_retry)
+        db.update_setting('wa_coalesce_seconds', wa_coalesce_seconds)
+        db.update_setting('wa_rate_per_minute', wa_rate_per_minute)
 
         flash('Pengaturan notifikasi berhasil disimpan.', 'success')
     
@@ -210,6 +232,8 @@ def save_sync_settings():
         # Simpan 2 data baru
         db.update_setting('event_sleep_delay', str(float(request.form.get('event_sleep_delay', 1))))
         db.update_setting('realtime_tolerance', str(int(request.form.get('realtime_tolerance', 120))))
+        db.update_setting('governor_max_rate', str(float(request.form.get('governor_max_rate', 20))))
+        db.update_setting('governor_latency_target', str(float(request.form.get('governor_latency_target', 2))))
 
         flash('Pengaturan sinkronisasi berhasil disimpan.', 'success')
     except ValueError:
@@ -228,9 +252,21 @@ def save_advanced_settings():
         db.update_setting('poll_interval', str(int(request.form.get('poll_interval', 2))))
         db.update_setting('request_timeout', str(int(request.form.get('request_timeout', 30))))
         db.update_setting('api_queue_limit', str(int(request.form.get('api_queue_limit', 5))))
+        db.update_setting('api_lease_seconds', str(int(request.form.get('api_lease_seconds', 120))))
+        db.update_setting('api_retry_base_seconds', str(int(request.form.get('api_retry_base_seconds', 10))))
+        db.update_setting('api_retry_max_seconds', str(int(request.form.get('api_retry_max_seconds', 600))))
+        db.update_setting('lane_weight_realtime', str(int(request.form.get('lane_weight_realtime', 4))))
+        db.update_setting('lane_weight_catchup', str(int(request.form.get('lane_weight_catchup', 1))))
+        db.update_setting('api_concurrency_min', str(int(request.form.get('api_concurrency_min', 1))))
+        db.update_setting('api_concurrency_max', str(int(request.form.get('api_concurrency_max', 20))))
+        db.update_setting('api_latency_target_ms', str(int(request.form.get('api_latency_target_ms', 1000))))
+        db.update_setting('dead_letter_replay_batch', str(int(request.form.get('dead_letter_replay_batch', 100))))
+        db.update_setting('dead_letter_replay_interval', str(int(request.form.get('dead_letter_replay_interval', 10))))
         db.update_setting('event_batch_max', str(int(request.form.get('event_batch_max', 100))))
         db.update_setting('sync_download_retries', str(int(request.form.get('sync_download_retries', 5))))
         db.update_setting('worker_download_retries', str(int(request.form.get('worker_download_retries', 2))))
+        db.update_setting('catchup_parallel_windows', str(int(request.form.get('catchup_parallel_windows', 3))))
+        db.update_setting('push_gap_repair_interval', str(int(request.form.get('push_gap_repair_interval', 300))))
 
         flash('Pengaturan lanjutan berhasil disimpan.', 'success')
     except ValueError:
@@ -257,8 +293,12 @@ def index():
     # Data Grafik 2: Jam Sibuk (BARU)
     busy_data = db.get_hourly_analytics()
     
+    # Antrean API per jalur prioritas
+    queue_stats = db.get_api_queue_stats(int(db.get_setting('api_fail_max_retry', default='5')))
+    
     return render_template('dashboard.html',
                            stats=stats,
+                           queue_stats=queue_stats,
                            recent_events=recent_events,
                            devices_status=devices_status,
                            chart_data=chart_data,
@@ -316,10 +356,16 @@ def add_device():
 @login_required
 def update_device():
     ip, name, location, target_api, username, password = (request.form.get(key) for key in ['ip', 'name', 'location', 'targetApi', 'username', 'password'])
+    page_size = request.form.get('eventPageSize', '').strip()
     if not ip or not name or not username:
         flash('IP, Nama, dan Username wajib diisi.', 'danger')
+    elif page_size and (not page_size.isdigit() or int(page_size) < 1):
+        flash('Ukuran halaman event harus berupa angka positif.', 'danger')
     else:
-        if db.update_device(ip, name, location, target_api, username, password):
+        updated = db.update_device(ip, name, location, target_api, username, password)
+        updated = db.update_device_event_page_size(ip, int(page_size) if page_size else None) or updated
+        updated = db.update_device_push_enabled(ip, bool(request.form.get('pushEnabled'))) or updated
+        if updated:
             flash('Perangkat berhasil diperbarui.', 'success')
         else:
             flash('Gagal memperbarui perangkat atau tidak ada perubahan data.', 'warning')
@@ -330,6 +376,7 @@ def update_device():
 def delete_device():
     ip = request.form.get('ip')
     if db.delete_device(ip):
+        isapi_client.drop_client(ip)
         flash('Perangkat berhasil dihapus.', 'success')
     else:
         flash('Gagal menghapus perangkat. IP tidak ditemukan.', 'danger')
@@ -356,10 +403,9 @@ def api_get_event(event_id):
     return jsonify({'error': 'Event not found'}), 404
 
 def ping_device(ip):
-    param = "-n 1 -w 1000" if platform.system().lower() == "windows" else "-c 1 -W 1"
-    cmd = f"ping {param} {ip}"
-    redirect_out = " > NUL 2>&1" if platform.system().lower()=="windows" else " > /dev/null 2>&1"
-    return os.system(cmd + redirect_out) == 0
+    # Probe yang sama dengan worker_service (DEVICE_PING_METHOD), agar dashboard & worker tidak berbeda pendapat
+    entry = isapi_async.run_batch('ping', [{'ip': ip, 'name': ip}]).get(ip) or {}
+    return bool(entry.get('ok') and entry['result'].get('reachable'))
 
 @app.route('/api/ping/<string:ip>')
 @login_required
@@ -374,6 +420,54 @@ def api_devices_status():
     devices_status = db.get_devices_status()
     return jsonify(devices_status)
 
+@app.route('/dead-letters')
+@login_required
+def dead_letters():
+    target_api = request.args.get('target') or None
+    return render_template('dead_letters.html',
+                           dead_letters=db.get_dead_letters(target_api),
+                           summary=db.get_dead_letter_summary(),
+                           selected_target=target_api)
+
+@app.route('/api/dead-letters')
+@login_required
+def api_get_dead_letters():
+    """Daftar dead-letter yang belum dikirim ulang (?target=<url> untuk satu target)."""
+    return jsonify(db.get_dead_letters(request.args.get('target') or None))
+
+@app.route('/api/dead-letters/replay', methods=['POST'])
+@login_required
+def api_replay_dead_letters():
+    """
+    Mengantrekan ulang dead-letter secara bertahap. Body JSON (semua opsional):
+    {"ids": [id dead_letter_events], "targetApi": url, "batchSize": n, "intervalSeconds": n}.
+    Tanpa ids/targetApi = semua dead-letter. Default batch & jeda dari pengaturan dead_letter_replay_*.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = [int(i) for i in data.get('ids') or []]
+        batch_size = int(data.get('batchSize') or db.get_setting('dead_letter_replay_batch', default='100'))
+        interval_seconds = int(data.get('intervalSeconds') or db.get_setting('dead_letter_replay_interval', default='10'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ids, batchSize dan intervalSeconds harus berupa angka.'}), 400
+    if batch_size < 1 or interval_seconds < 0:
+        return jsonify({'error': 'batchSize minimal 1 dan intervalSeconds tidak boleh negatif.'}), 400
+
+    replayed, skipped = db.replay_dead_letters(ids or None, data.get('targetApi') or None, batch_size, interval_seconds)
+    batches = -(-replayed // batch_size)
+    message = (f'{replayed} event diantrekan ulang dalam {batches} batch '
+               f'(selesai dijadwalkan dalam ~{max(batches - 1, 0) * interval_seconds} detik).')
+    if skipped:
+        message += f' {len(skipped)} dead-letter dilewati (event sumber hilang atau tidak lagi berstatus dead).'
+    return jsonify({'success': True, 'replayed': replayed, 'skipped': skipped, 'message': message})
+
+@app.route('/api/queue/stats')
+@login_required
+def api_queue_stats():
+    """Kedalaman & umur antrean API per jalur prioritas (realtime / catch-up)."""
+    max_retry = int(db.get_setting('api_fail_max_retry', default='5'))
+    return jsonify(db.get_api_queue_stats(max_retry))
+
 # --- API MANAJEMEN PENGGUNA (api_update_user_info DIROMBAK) ---
 @app.route('/api/devices/<string:ip>/users')
 @login_required
@@ -381,38 +475,44 @@ def api_get_device_users(ip):
     device = db.get_device_by_ip(ip)
     if not device or not device.get('username') or not device.get('password'):
         return jsonify({'error': 'Kredensial perangkat tidak ditemukan.'}), 404
-    url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Search?format=json"
-    auth = HTTPDigestAuth(device['username'], device['password'])
-    all_users = []
-    search_id = "random_search_id_" + str(datetime.datetime.now().timestamp())
-    position = 0
-    max_results = 30
+
+    # Halaman pertama diambil lebih dulu agar error perangkat masih bisa dibalas dengan status HTTP yang benar
+    pages = hikvision_api.iter_user_pages(device)
     try:
-        while True:
-            payload = {"UserInfoSearchCond": {"searchID": search_id, "searchResultPosition": position, "maxResults": max_results}}
-            response = requests.post(url, json=payload, auth=auth, timeout=15)
-            if response.status_code != 200:
-                data = response.json()
-                return jsonify({'error': f"Error dari perangkat: {data.get('errorMsg', 'Unknown')}"}), 502
-            data = response.json().get('UserInfoSearch', {})
-            users_batch = data.get('UserInfo', [])
-            if users_batch:
-                all_users.extend(users_batch)
-            matches = data.get('numOfMatches', 0)
-            total_matches = data.get('totalMatches', 0)
-            position += matches
-            if not users_batch or position >= total_matches:
-                break
-        if all_users:
-            employee_ids = [int(u['employeeNo']) for u in all_users if u.get('employeeNo', '').isdigit()]
-            device_name = device.get('name') 
-            attendance_data = db.get_earliest_attendance_by_date(employee_ids, datetime.date.today().strftime('%Y-%m-%d'), device_name)
-            for user in all_users:
-                emp_id = int(user.get('employeeNo')) if user.get('employeeNo','').isdigit() else None
-                user['attendance_time'] = attendance_data.get(emp_id)
-        return jsonify(all_users)
-    except Exception as e:
-        return jsonify({'error': f"Gagal terhubung atau memproses: {e}"}), 500
+        first_page = next(pages, [])
+    except hikvision_api.UserSearchError as e:
+        return jsonify({'error': f"Error dari perangkat: {e}"}), 502
+
+    device_name = device.get('name')
+    today = datetime.date.today().strftime('%Y-%m-%d')
+
+    def with_attendance(users_batch):
+        # Jam hadir dicari per halaman, bukan untuk seluruh roster sekaligus
+        employee_ids = [int(u['employeeNo']) for u in users_batch if str(u.get('employeeNo', '')).isdigit()]
+        attendance_data = db.get_earliest_attendance_by_date(employee_ids, today, device_name)
+        for user in users_batch:
+            emp_id = int(user['employeeNo']) if str(user.get('employeeNo', '')).isdigit() else None
+            user['attendance_time'] = attendance_data.get(emp_id)
+        return users_batch
+
+    def generate():
+        # Array JSON dialirkan per halaman: roster ribuan wajah tidak ditampung utuh di memori.
+        # Status 200 sudah terkirim, jadi error di tengah jalan ditandai dengan objek terakhir
+        # {"error": ..., "incomplete": true} agar klien tahu daftarnya tidak lengkap.
+        yield '['
+        first = True
+        try:
+            for users_batch in itertools.chain([first_page], pages):
+                for user in with_attendance(users_batch):
+                    yield ('' if first else ',') + json.dumps(user, default=str)
+                    first = False
+        except Exception as e:
+            app.logger.error("Error streaming users from %s: %s", ip, e)
+            message = f"Error dari perangkat: {e}" if isinstance(e, hikvision_api.UserSearchError) else f"Error: {e}"
+            yield ('' if first else ',') + json.dumps({'error': message, 'incomplete': True})
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 # --- FUNGSI UPDATE USER (LOGIKA KONDISIONAL BARU) ---
 @app.route('/api/devices/<string:ip>/users/<string:employee_no>/update', methods=['POST'])
@@ -421,7 +521,7 @@ def api_update_user_info(ip, employee_no):
     device = db.get_device_by_ip(ip)
     if not device: return jsonify({'error': 'Perangkat tidak ditemukan'}), 404
     
-    auth = HTTPDigestAuth(device['username'], device['password'])
+    client = isapi_client.get_client(device)
     data = request.form
     name = data.get('name')
     gender = data.get('gender')
@@ -446,10 +546,10 @@ def api_update_user_info(ip, employee_no):
         # --- ALUR A: HAPUS TOTAL DAN BUAT ULANG (karena ada foto baru) ---
         
         # 1. HAPUS PENGGUNA (UserInfo/Delete)
-        delete_user_url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Delete?format=json"
+        delete_user_url = "/ISAPI/AccessControl/UserInfo/Delete?format=json"
         delete_user_payload = {"UserInfoDelCond": {"employeeNoList": [{"employeeNo": employee_no}]}}
         try:
-            delete_res = requests.put(delete_user_url, json=delete_user_payload, auth=auth, timeout=10)
+            delete_res = client.put(delete_user_url, json=delete_user_payload, timeout=10)
             if delete_res.status_code not in [200, 204]:
                 delete_res_data = delete_res.json() if delete_res.content else {'statusString': delete_res.text}
                 return jsonify({'error': f"Gagal menghapus pengguna lama (sebelum upload baru): {delete_res_data.get('statusString') or 'Error tidak diketahui'}"}), 502
@@ -468,9 +568,9 @@ def api_update_user_info(ip, employee_no):
                 "doorRight": "1", "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}]
             }
         }
-        user_url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Record?format=json"
+        user_url = "/ISAPI/AccessControl/UserInfo/Record?format=json"
         try:
-            user_res = requests.post(user_url, json=user_payload, auth=auth, timeout=10)
+            user_res = client.post(user_url, json=user_payload, timeout=10)
             if user_res.status_code not in [200, 204]:
                 user_res_data = user_res.json() if user_res.content else {'statusString': user_res.text}
                 return jsonify({'error': f"Gagal membuat ulang data pengguna: {user_res_data.get('statusString') or 'Error tidak diketahui'}"}), 502
@@ -480,14 +580,14 @@ def api_update_user_info(ip, employee_no):
         # 3. UPLOAD FOTO BARU (FDLib/FaceDataRecord)
         photo_file = request.files['photo']
         photo_data = photo_file.read()
-        photo_url = f"http://{device['ip']}/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
+        photo_url = "/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
         json_payload = {"faceLibType": "blackFD", "FDID": "1", "employeeNo": employee_no, "FPID": employee_no}
         files = {
             'FaceDataRecord': (None, json.dumps(json_payload), 'application/json'), 
             'FaceImage': (photo_file.filename, photo_data, photo_file.mimetype)
         }
         try:
-            photo_res = requests.post(photo_url, files=files, auth=auth, timeout=20)
+            photo_res = client.post(photo_url, files=files, timeout=20)
             if photo_res.status_code not in [200, 204]:
                 return jsonify({'success': True, 'warning': 'Pengguna diperbarui, tapi unggah foto baru gagal.'})
         except Exception as e:
@@ -506,10 +606,10 @@ def api_update_user_info(ip, employee_no):
                 "Valid": {"enable": True, "beginTime": formatted_start_time, "endTime": formatted_end_time}
             }
         }
-        user_url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Modify?format=json"
+        user_url = "/ISAPI/AccessControl/UserInfo/Modify?format=json"
         
         try:
-            user_res = requests.put(user_url, json=user_payload, auth=auth, timeout=10) 
+            user_res = client.put(user_url, json=user_payload, timeout=10) 
             if user_res.status_code not in [200, 204]:
                 user_res_data = user_res.json() if user_res.content else {'statusString': user_res.text}
                 return jsonify({'error': f"Gagal update data pengguna: {user_res_data.get('statusString') or 'Error tidak diketahui'}"}), 502
@@ -536,7 +636,7 @@ def api_add_user(ip):
     if not all([employee_no, name, start_time_str, end_time_str]):
         return jsonify({'error': 'Semua field teks wajib diisi.'}), 400
 
-    auth = HTTPDigestAuth(device['username'], device['password'])
+    client = isapi_client.get_client(device)
     
     try:
         formatted_start_time = start_time_str + ":00"
@@ -552,10 +652,10 @@ def api_add_user(ip):
             "doorRight": "1", "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}]
         }
     }
-    user_url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Record?format=json"
+    user_url = "/ISAPI/AccessControl/UserInfo/Record?format=json"
     
     try:
-        user_res = requests.post(user_url, json=user_payload, auth=auth, timeout=10)
+        user_res = client.post(user_url, json=user_payload, timeout=10)
         if user_res.status_code not in [200, 204]:
             user_res_data = user_res.json() if user_res.content else {'statusString': user_res.text}
             return jsonify({'error': f"Gagal membuat pengguna: {user_res_data.get('statusString') or 'Error tidak diketahui'}"}), 502
@@ -566,7 +666,7 @@ def api_add_user(ip):
         photo_file = request.files['photo']
         photo_data = photo_file.read()
         
-        photo_url = f"http://{device['ip']}/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
+        photo_url = "/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
         json_payload = {"faceLibType": "blackFD", "FDID": "1", "employeeNo": employee_no, "FPID": employee_no}
         
         # --- PERBAIKAN BUG MIME TYPE ---
@@ -579,7 +679,7 @@ def api_add_user(ip):
         
         try:
             # Menambah user baru menggunakan POST
-            photo_res = requests.post(photo_url, files=files, auth=auth, timeout=20)
+            photo_res = client.post(photo_url, files=files, timeout=20)
             if photo_res.status_code not in [200, 204]:
                 return jsonify({'success': True, 'warning': 'Pengguna dibuat, tapi unggah foto gagal.'})
         except Exception:
@@ -592,11 +692,11 @@ def api_add_user(ip):
 def api_delete_user(ip, employee_no):
     device = db.get_device_by_ip(ip)
     if not device: return jsonify({'error': 'Perangkat tidak ditemukan'}), 404
-    url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Delete?format=json"
-    auth = HTTPDigestAuth(device['username'], device['password'])
+    url = "/ISAPI/AccessControl/UserInfo/Delete?format=json"
+    client = isapi_client.get_client(device)
     payload = {"UserInfoDelCond": {"employeeNoList": [{"employeeNo": employee_no}]}}
     try:
-        response = requests.put(url, json=payload, auth=auth, timeout=10)
+        response = client.put(url, json=payload, timeout=10)
         if response.status_code in [200, 204]:
             return jsonify({'success': True})
         response_data = response.json() if response.content else {'errorMsg': response.text}
@@ -611,7 +711,7 @@ def api_bulk_update_expiry(ip):
     device = db.get_device_by_ip(ip)
     if not device: return jsonify({'error': 'Perangkat tidak ditemukan'}), 404
 
-    auth = HTTPDigestAuth(device['username'], device['password'])
+    client = isapi_client.get_client(device)
     req_data = request.json
     
     users_list = req_data.get('users', [])
@@ -632,7 +732,7 @@ def api_bulk_update_expiry(ip):
     errors = []
 
     # URL untuk Modify UserInfo
-    url = f"http://{device['ip']}/ISAPI/AccessControl/UserInfo/Modify?format=json"
+    url = "/ISAPI/AccessControl/UserInfo/Modify?format=json"
 
     # Loop setiap user dan kirim request ke perangkat
     for user in users_list:
@@ -655,7 +755,7 @@ def api_bulk_update_expiry(ip):
 
         try:
             # Menggunakan PUT untuk update
-            res = requests.put(url, json=payload, auth=auth, timeout=5)
+            res = client.put(url, json=payload, timeout=5)
             if res.status_code in [200, 204]:
                 # Cek status string dari body response jika ada
                 if res.content:
@@ -718,7 +818,7 @@ def api_ask_ai():
     )
     
 # --- PENGGANTI FUNGSI api_hris_create_user (Logika Update) ---
-# (Pastikan 'datetime', 'base64', 'json', 'requests', 'HTTPDigestAuth', 'jsonify', 'time' sudah diimpor di atas)
+# (Pastikan 'datetime', 'base64', 'json', 'requests', 'isapi_client', 'jsonify', 'time' sudah diimpor di atas)
 
 @app.route('/create', methods=['POST'])
 def api_hris_create_user():
@@ -743,7 +843,8 @@ def api_hris_create_user():
         start_time_php = data.get('validStart') # Format: Y-m-d H:i:s
         end_time_php = data.get('validEnd')     # Format: Y-m-d H:i:s
 
-        # Validasi data penting
+        # Validasi data penting (satu perangkat, kredensial dari pemanggil; banyak perangkat lewat
+        # /api/batch/upsert_user yang memerlukan login)
         if not all([employee_no, name, device_ip, device_user, device_pass, start_time_php, end_time_php]):
             return jsonify({'error': 'Data tidak lengkap (id, name, ip, user, pass, waktu wajib diisi)'}), 400
 
@@ -757,15 +858,15 @@ def api_hris_create_user():
             return jsonify({'error': 'Format waktu salah. Harap gunakan Y-m-d H:i:s'}), 400
 
         # 3. Siapkan koneksi ke perangkat
-        auth = HTTPDigestAuth(device_user, device_pass)
+        client = isapi_client.get_client({'ip': device_ip, 'username': device_user, 'password': device_pass})
         
         # 4. (MODIFIKASI) HAPUS USER LAMA (Abaikan jika gagal)
         # Ini adalah langkah 'brute force' untuk memastikan data lama terhapus
         try:
-            delete_user_url = f"http://{device_ip}/ISAPI/AccessControl/UserInfo/Delete?format=json"
+            delete_user_url = "/ISAPI/AccessControl/UserInfo/Delete?format=json"
             delete_user_payload = {"UserInfoDelCond": {"employeeNoList": [{"employeeNo": employee_no}]}}
             # Kirim perintah hapus. Kita tidak peduli hasilnya sukses atau gagal.
-            requests.put(delete_user_url, json=delete_user_payload, auth=auth, timeout=10)
+            client.put(delete_user_url, json=delete_user_payload, timeout=10)
             # Beri jeda 1 detik agar perangkat selesai memproses penghapusan
             time.sleep(1) 
         except Exception:
@@ -781,9 +882,9 @@ def api_hris_create_user():
                 "doorRight": "1", "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}]
             }
         }
-        user_url = f"http://{device_ip}/ISAPI/AccessControl/UserInfo/Record?format=json"
+        user_url = "/ISAPI/AccessControl/UserInfo/Record?format=json"
         
-        user_res = requests.post(user_url, json=user_payload, auth=auth, timeout=10)
+        user_res = client.post(user_url, json=user_payload, timeout=10)
         
         if user_res.status_code not in [200, 204]:
             try:
@@ -799,13 +900,13 @@ def api_hris_create_user():
         if photo_base64:
             try:
                 photo_data = base64.b64decode(photo_base64)
-                photo_url = f"http://{device_ip}/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
+                photo_url = "/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json"
                 json_payload = {"faceLibType": "blackFD", "FDID": "1", "employeeNo": employee_no, "FPID": employee_no}
                 files = {
                     'FaceDataRecord': (None, json.dumps(json_payload), 'application/json'), 
                     'FaceImage': ('photo_from_hris.jpg', photo_data, 'image/jpeg')
                 }
-                photo_res = requests.post(photo_url, files=files, auth=auth, timeout=20)
+                photo_res = client.post(photo_url, files=files, timeout=20)
                 if photo_res.status_code not in [200, 204]:
                     return jsonify({'success': True, 'message': 'Data teks pengguna diperbarui, tapi unggah foto baru gagal.'})
             
@@ -823,6 +924,71 @@ def api_hris_create_user():
         return jsonify({'error': f'Terjadi error internal di server Python: {e}'}), 500
 
 # --- AKHIR FUNGSI api_hris_create_user ---
+
+# --- API BATCH (Satu operasi ke banyak perangkat sekaligus, lewat engine ISAPI async) ---
+# Operasi yang boleh dipanggil beserta params yang diizinkan (params lain, mis. timeout, ditolak)
+BATCH_OPERATIONS = {
+    'ping': (),
+    'status': (),
+    'users': ('include_users',),
+    'delete_user': ('employee_no',),
+    'upsert_user': ('employee_no', 'name', 'begin_time', 'end_time', 'photo'),
+}
+BATCH_REQUIRED_PARAMS = {
+    'delete_user': ('employee_no',),
+    'upsert_user': ('employee_no', 'name', 'begin_time', 'end_time'),
+}
+
+@app.route('/api/batch/<string:operation>', methods=['POST'])
+@login_required
+def api_batch(operation):
+    """
+    Body JSON: {"ips": "all" | ["10.0.0.1", ...] | "10.0.0.1,10.0.0.2", "params": {...}}
+    Contoh params: users -> {"include_users": true}, delete_user -> {"employee_no": "123"},
+    upsert_user -> {"employee_no", "name", "begin_time", "end_time" (YYYY-MM-DDTHH:MM:SS), "photo" (base64, opsional)}.
+    Hanya perangkat dengan kredensial tersimpan di DB yang diproses.
+    """
+    if operation not in BATCH_OPERATIONS:
+        return jsonify({'error': f"Operasi tidak dikenal. Pilihan: {', '.join(BATCH_OPERATIONS)}"}), 404
+
+    req_data = request.get_json(silent=True) or {}
+    ips = req_data.get('ips', 'all')
+    if ips == 'all':
+        devices = db.get_all_devices()
+    else:
+        if isinstance(ips, str):
+            ips = [ip.strip() for ip in ips.split(',') if ip.strip()]
+        devices = [d for d in (db.get_device_by_ip(ip) for ip in ips) if d]
+    devices = [d for d in devices if d.get('username') and d.get('password')]
+    if not devices:
+        return jsonify({'error': 'Tidak ada perangkat dengan kredensial lengkap.'}), 404
+
+    params = req_data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params harus berupa objek JSON.'}), 400
+    unknown = sorted(set(params) - set(BATCH_OPERATIONS[operation]))
+    if unknown:
+        allowed = ', '.join(BATCH_OPERATIONS[operation]) or '-'
+        return jsonify({'error': f"Params tidak diizinkan untuk {operation}: {', '.join(unknown)}. Pilihan: {allowed}"}), 400
+    missing = [name for name in BATCH_REQUIRED_PARAMS.get(operation, ()) if not params.get(name)]
+    if missing:
+        return jsonify({'error': f"params wajib diisi: {', '.join(missing)}."}), 400
+    if operation == 'upsert_user':
+        try:
+            params['photo'] = base64.b64decode(params['photo']) if params.get('photo') else None
+        except (base64.binascii.Error, TypeError):
+            return jsonify({'error': 'params.photo bukan base64 yang valid.'}), 400
+        params['photo_name'] = 'photo_from_hris.jpg'
+    results = isapi_async.run_batch(operation, devices, **params)
+
+    if operation == 'ping':
+        for ip, entry in results.items():
+            reachable = entry['ok'] and entry['result'].get('reachable')
+            db.update_device_ping_status(ip, 'online' if reachable else 'offline')
+
+    success_count = sum(1 for r in results.values() if r['ok'])
+    return jsonify({'operation': operation, 'total': len(results), 'success': success_count,
+                    'results': list(results.values())})
 # --- TAMBAHAN API EKSTERNAL MANAJEMEN PERANGKAT (Tanpa API Key) ---
 
 @app.route('/api/devices', methods=['GET'])
@@ -889,11 +1055,66 @@ def api_ext_delete_device(ip):
     success = db.delete_device(ip)
     
     if success:
+        isapi_client.drop_client(ip)
         return jsonify({'success': True, 'message': 'Perangkat berhasil dihapus.'}), 200
     else:
         return jsonify({'success': False, 'message': 'Perangkat tidak ditemukan.'}), 404
 
 # --- AKHIR TAMBAHAN API MANAJEMEN PERANGKAT ---
+
+# --- API KONFIGURASI TARGET API (Mode batch per URL targetApi) ---
+
+@app.route('/api/targets', methods=['GET'])
+def api_ext_get_targets():
+    """
+    [READ] Daftar target API yang dikonfigurasi (URL lain memakai mode satu event per request),
+    termasuk `concurrency`: jumlah request bersamaan terkini hasil kontrol adaptif worker.
+    """
+    try:
+        return jsonify(list(db.get_all_api_targets().values())), 200
+    except Exception as e:
+        return jsonify({'error': f'Gagal mengambil data: {e}'}), 500
+
+@app.route('/api/targets', methods=['POST'])
+def api_ext_save_target():
+    """
+    [CREATE/UPDATE] Mengatur mode pengiriman satu target API.
+    Body: {"url", "batchSize" (>1 = mode batch), "batchMaxWaitSeconds" (batas tunggu batch penuh),
+           "format" ('json' = gambar base64, 'multipart' = gambar sebagai file)}.
+    """
+    data = request.json
+    if not data:
+        return jsonify({'error': 'Request body harus berupa JSON.'}), 400
+
+    url = (data.get('url') or '').strip()
+    if not url:
+        return jsonify({'error': 'Field url wajib diisi.'}), 400
+    try:
+        batch_size = int(data.get('batchSize', 1))
+        batch_max_wait = int(data.get('batchMaxWaitSeconds', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'batchSize dan batchMaxWaitSeconds harus berupa angka.'}), 400
+    if batch_size < 1 or batch_max_wait < 0:
+        return jsonify({'error': 'batchSize minimal 1 dan batchMaxWaitSeconds tidak boleh negatif.'}), 400
+    delivery_format = data.get('format', 'json')
+    if delivery_format not in ('json', 'multipart'):
+        return jsonify({'error': "format harus 'json' atau 'multipart'."}), 400
+
+    if db.save_api_target(url, batch_size, batch_max_wait, delivery_format):
+        return jsonify({'success': True, 'message': 'Target API berhasil disimpan.'}), 200
+    return jsonify({'success': False, 'message': 'Gagal menyimpan target API.'}), 500
+
+@app.route('/api/targets', methods=['DELETE'])
+def api_ext_delete_target():
+    """ [DELETE] Menghapus konfigurasi target (kembali ke mode satu event per request). Query: ?url=... """
+    url = request.args.get('url', '').strip()
+    if not url:
+        return jsonify({'error': 'Parameter url wajib diisi.'}), 400
+    if db.delete_api_target(url):
+        return jsonify({'success': True, 'message': 'Target API berhasil dihapus.'}), 200
+    return jsonify({'success': False, 'message': 'Target API tidak ditemukan.'}), 404
+
+# --- AKHIR API KONFIGURASI TARGET API ---
 # --- ENTRY POINT ---
 if __name__ == '__main__':
     db.init_db() # Pastikan DB diinisialisasi
@@ -0,0 +1,380 @@
+import os
+import time
+import json
+import uuid
+import random
+import bisect
+import hashlib
+import datetime
+import argparse
+import threading
+import itertools
+from flask import Flask, request, jsonify, Response
+from werkzeug.serving import make_server
+
+from config import TIMEZONE
+
+# ==========================================
+# SIMULATOR PERANGKAT ISAPI (Device Farm untuk Benchmark)
+# ==========================================
+# Meniru endpoint Hikvision yang dipakai sync_service, worker_service, dan app.py:
+#   POST /ISAPI/AccessControl/AcsEvent              (paginasi searchResultPosition/totalMatches)
+#   GET  /ISAPI/System/deviceInfo, AcsEvent/capabilities, httpHosts/capabilities (deteksi kemampuan)
+#   GET  /LOCALS/pic/<serial>.jpeg                  (pictureURL event)
+#   POST /ISAPI/AccessControl/UserInfo/Search|Record, PUT Modify|Delete
+#   POST /ISAPI/Intelligent/FDLib/FaceDataRecord, PUT FDModify, POST FDSearch
+# Semua endpoint dilindungi Digest Auth (MD5, qop=auth) seperti perangkat asli.
+# Setiap perangkat berjalan di port sendiri; IP perangkat di DB ditulis "127.0.0.1:<port>".
+
+# --- PROFIL BEBAN ---
+# latency_ms/jitter_ms : waktu respons tiap request
+# error_rate           : peluang request dibalas 503 (perangkat sibuk)
+# rate                 : rata-rata event per detik (kedatangan acak/eksponensial)
+# burst_every/size     : setiap N detik muncul sekian event sekaligus (jam masuk/pulang)
+# max_page_size        : batas maxResults AcsEvent/UserInfo (firmware umumnya 30)
+# face_ratio           : porsi event Face Recognized (sisanya event pintu)
+PROFILES = {
+    'normal': {'latency_ms': 30, 'jitter_ms': 20, 'error_rate': 0.0, 'rate': 1.0,
+               'burst_every': 0, 'burst_size': 0, 'max_page_size': 30, 'face_ratio': 0.9, 'picture_kb': 40},
+    'slow':   {'latency_ms': 400, 'jitter_ms': 300, 'error_rate': 0.0, 'rate': 0.5,
+               'burst_every': 0, 'burst_size': 0, 'max_page_size': 30, 'face_ratio': 0.9, 'picture_kb': 80},
+    'flaky':  {'latency_ms': 80, 'jitter_ms': 60, 'error_rate': 0.05, 'rate': 1.0,
+               'burst_every': 0, 'burst_size': 0, 'max_page_size': 30, 'face_ratio': 0.9, 'picture_kb': 40},
+    'burst':  {'latency_ms': 30, 'jitter_ms': 20, 'error_rate': 0.0, 'rate': 0.2,
+               'burst_every': 30, 'burst_size': 200, 'max_page_size': 30, 'face_ratio': 0.95, 'picture_kb': 40},
+}
+
+# Nomor karyawan unik lintas perangkat, agar target API bisa mencocokkan event ke waktu lahirnya
+EMPLOYEE_COUNTER = itertools.count(100000)
+# employeeNo (str) -> waktu (monotonic) event dibuat di simulator; dibaca runner untuk latensi end-to-end
+EVENT_BORN = {}
+EVENT_BORN_LOCK = threading.Lock()
+
+def local_iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE
+
+def parse_search_time(value):
+    """startTime/endTime dari AcsEventCond, dengan atau tanpa zona waktu."""
+    return datetime.datetime.strptime(str(value)[:19], "%Y-%m-%dT%H:%M:%S")
+
+# --- DIGEST AUTH (SISI SERVER) ---
+class DigestAuthenticator:
+    """Verifikasi Digest Auth RFC 2617 (MD5, qop=auth) dengan daftar nonce yang pernah diterbitkan."""
+    def __init__(self, username, password, realm="DS-K1T Simulator"):
+        self.username = username
+        self.password = password
+        self.realm = realm
+        self.nonces = {}
+        self.lock = threading.Lock()
+
+    def challenge(self, stale=False):
+        nonce = uuid.uuid4().hex
+        with self.lock:
+            if len(self.nonces) > 1000:
+                self.nonces.clear()
+            self.nonces[nonce] = time.time()
+        header = f'Digest realm="{self.realm}", qop="auth", nonce="{nonce}", algorithm="MD5"'
+        if stale:
+            header += ', stale="TRUE"'
+        return Response("Unauthorized", status=401, headers={'WWW-Authenticate': header})
+
+    def verify(self, req):
+        auth = req.authorization
+        if not auth or auth.type != 'digest':
+            return False, False
+        params = auth.parameters
+        with self.lock:
+            known_nonce = params.get('nonce') in self.nonces
+        if params.get('username') != self.username or not known_nonce:
+            return False, not known_nonce
+
+        md5 = lambda s: hashlib.md5(s.encode()).hexdigest()
+        ha1 = md5(f"{self.username}:{self.realm}:{self.password}")
+        ha2 = md5(f"{req.method}:{params.get('uri')}")
+        if params.get('qop'):
+            expected = md5(f"{ha1}:{params.get('nonce')}:{params.get('nc')}:{params.get('cnonce')}:{params.get('qop')}:{ha2}")
+        else:
+            expected = md5(f"{ha1}:{params.get('nonce')}:{ha2}")
+        return expected == params.get('response'), False
+
+# --- PERANGKAT SIMULASI ---
+class SimulatedDevice:
+    def __init__(self, port, username='admin', password='bench12345', profile='normal', host='127.0.0.1',
+                 users=50, backlog_events=0, backlog_hours=6, **overrides):
+        self.host = host
+        self.port = port
+        self.ip = f"{host}:{port}"
+        self.profile = dict(PROFILES[profile], **{k: v for k, v in overrides.items() if v is not None})
+        self.auth = DigestAuthenticator(username, password)
+        self.username, self.password = username, password
+
+        self.lock = threading.Lock()
+        self.events, self.event_times = [], []
+        self.serial = itertools.count(1)
+        self.users = {}
+        self.faces = {}
+        self.picture = b'\xff\xd8\xff\xe0' + os.urandom(max(int(self.profile['picture_kb']) * 1024 - 4, 0))
+
+        self.stats = {'requests': 0, 'challenges': 0, 'injected_errors': 0, 'endpoints': {}}
+        self.generated = {'backlog': 0, 'live': 0, 'face_live': 0}
+
+        for _ in range(users):
+            emp = str(next(EMPLOYEE_COUNTER))
+            self.users[emp] = {"employeeNo": emp, "name": f"Bench {emp}", "userType": "normal",
+                               "Valid": {"enable": True, "beginTime": "2020-01-01T00:00:00", "endTime": "2037-12-31T23:59:59"}}
+        self.seed_backlog(backlog_events, backlog_hours)
+
+        self.stop_event = threading.Event()
+        self.server = make_server(host, port, self.create_app(), threaded=True)
+        self.threads = []
+
+    # --- Pembuatan event ---
+    def add_event(self, dt, live=True):
+        face = random.random() < float(self.profile['face_ratio'])
+        serial = next(self.serial)
+        event = {"major": 5, "minor": 75 if face else 38, "time": local_iso(dt), "serialNo": serial,
+                 "cardReaderNo": 1, "doorNo": 1, "currentVerifyMode": "face"}
+        if face:
+            emp = next(EMPLOYEE_COUNTER)
+            event.update({"name": f"Bench {emp}", "employeeNoString": str(emp),
+                          "pictureURL": f"http://{self.ip}/LOCALS/pic/{serial}.jpeg"})
+            if live:
+                with EVENT_BORN_LOCK:
+                    EVENT_BORN[str(emp)] = time.monotonic()
+        with self.lock:
+            # Urutan waktu dijaga agar pencarian rentang cukup dengan bisect
+            self.events.append(event)
+            self.event_times.append(dt)
+            self.generated['live' if live else 'backlog'] += 1
+            if live and face:
+                self.generated['face_live'] += 1
+
+    def seed_backlog(self, count, hours):
+        if count <= 0:
+            return
+        start = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(hours=hours)
+        step = hours * 3600.0 / count
+        for i in range(count):
+            self.add_event(start + datetime.timedelta(seconds=int(i * step)), live=False)
+
+    def generate_loop(self):
+        rate = float(self.profile['rate'])
+        burst_every = float(self.profile['burst_every'])
+        next_burst = time.monotonic() + burst_every if burst_every else None
+        while not self.stop_event.is_set():
+            wait = random.expovariate(rate) if rate > 0 else 1.0
+            if next_burst is not None:
+                wait = min(wait, max(next_burst - time.monotonic(), 0))
+            if self.stop_event.wait(wait):
+                return
+            now = datetime.datetime.now().replace(microsecond=0)
+            if next_burst is not None and time.monotonic() >= next_burst:
+                for _ in range(int(self.profile['burst_size'])):
+                    self.add_event(now)
+                next_burst += burst_every
+            elif rate > 0:
+                self.add_event(now)
+
+    # --- Aplikasi HTTP ---
+    def create_app(self):
+        app = Flask(f"sim-{self.port}")
+
+        @app.before_request
+        def _gate():
+            with self.lock:
+                self.stats['requests'] += 1
+                endpoint = request.path
+                if endpoint.startswith('/LOCALS/pic/'):
+                    endpoint = '/LOCALS/pic'
+                self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+            ok, stale = self.auth.verify(request)
+            if not ok:
+                with self.lock:
+                    self.stats['challenges'] += 1
+                return self.auth.challenge(stale=stale)
+
+            delay = (float(self.profile['latency_ms']) + random.uniform(0, float(self.profile['jitter_ms']))) / 1000.0
+            if delay > 0:
+                time.sleep(delay)
+            if random.random() < float(self.profile['error_rate']):
+                with self.lock:
+                    self.stats['injected_errors'] += 1
+                return jsonify({"statusCode": 7, "statusString": "Service Unavailable", "subStatusCode": "deviceBusy"}), 503
+
+        @app.route('/ISAPI/AccessControl/AcsEvent', methods=['POST'])
+        def acs_event():
+            cond = (request.get_json(silent=True) or {}).get('AcsEventCond', {})
+            try:
+                start, end = parse_search_time(cond['startTime']), parse_search_time(cond['endTime'])
+            except (KeyError, ValueError):
+                return jsonify({"statusCode": 6, "statusString": "Invalid Content", "subStatusCode": "badParameters"}), 400
+            position = int(cond.get('searchResultPosition', 0) or 0)
+            max_results = min(int(cond.get('maxResults', 30) or 30), int(self.profile['max_page_size']))
+
+            with self.lock:
+                lo = bisect.bisect_left(self.event_times, start)
+                hi = bisect.bisect_right(self.event_times, end)
+                total = max(hi - lo, 0)
+                page = self.events[lo + position:min(lo + position + max_results, hi)]
+
+            status = "MORE" if position + len(page) < total else "OK"
+            return jsonify({"AcsEvent": {"searchID": cond.get('searchID'), "responseStatusStrg": status,
+                                         "numOfMatches": len(page), "totalMatches": total, "InfoList": page}})
+
+        @app.route('/ISAPI/System/deviceInfo', methods=['GET'])
+        def device_info():
+            xml = (f'<?xml version="1.0" encoding="UTF-8"?><DeviceInfo><deviceName>SIM-{self.port}</deviceName>'
+                   f'<model>DS-K1T-SIM</model><firmwareVersion>V3.2.0 build 230101</firmwareVersion></DeviceInfo>')
+            return Response(xml, mimetype='application/xml')
+
+        @app.route('/ISAPI/AccessControl/AcsEvent/capabilities', methods=['GET'])
+        def acs_event_capabilities():
+            return jsonify({"AcsEvent": {"AcsEventCond": {
+                "searchID": {"@min": 1, "@max": 32},
+                "maxResults": {"@min": 1, "@max": int(self.profile['max_page_size'])},
+                "picEnable": {"@opt": [True, False]},
+            }}})
+
+        @app.route('/ISAPI/Event/notification/httpHosts/capabilities', methods=['GET'])
+        def http_hosts_capabilities():
+            return Response('<HttpHostNotificationCap><hostNumber>1</hostNumber></HttpHostNotificationCap>',
+                            mimetype='application/xml')
+
+        @app.route('/LOCALS/pic/<path:name>', methods=['GET'])
+        def picture(name):
+            return Response(self.picture, mimetype='image/jpeg')
+
+        @app.route('/ISAPI/AccessControl/UserInfo/Search', methods=['POST'])
+        def user_search():
+            cond = (request.get_json(silent=True) or {}).get('UserInfoSearchCond', {})
+            position = int(cond.get('searchResultPosition', 0) or 0)
+            max_results = min(int(cond.get('maxResults', 30) or 30), int(self.profile['max_page_size']))
+            with self.lock:
+                users = list(self.users.values())
+            page = users[position:position + max_results]
+            status = "MORE" if position + len(page) < len(users) else "OK"
+            return jsonify({"UserInfoSearch": {"searchID": cond.get('searchID'), "responseStatusStrg": status,
+                                               "numOfMatches": len(page), "totalMatches": len(users), "UserInfo": page}})
+
+        @app.route('/ISAPI/AccessControl/UserInfo/Record', methods=['POST'])
+        @app.route('/ISAPI/AccessControl/UserInfo/Modify', methods=['PUT'])
+        def user_write():
+            info = (request.get_json(silent=True) or {}).get('UserInfo', {})
+            emp = str(info.get('employeeNo') or '')
+            if not emp:
+                return jsonify({"statusCode": 6, "statusString": "Invalid Content", "subStatusCode": "badParameters"}), 400
+            with self.lock:
+                exists = emp in self.users
+                if request.path.endswith('/Record') and exists:
+                    return jsonify({"statusCode": 6, "statusString": "Invalid Content", "subStatusCode": "userAlreadyExist"}), 400
+                if request.path.endswith('/Modify') and not exists:
+                    return jsonify({"statusCode": 6, "statusString": "Invalid Content", "subStatusCode": "employeeNoNotExist"}), 400
+                self.users[emp] = dict(self.users.get(emp, {}), **info)
+            return jsonify({"statusCode": 1, "statusString": "OK", "subStatusCode": "ok"})
+
+        @app.route('/ISAPI/AccessControl/UserInfo/Delete', methods=['PUT'])
+        def user_delete():
+            cond = (request.get_json(silent=True) or {}).get('UserInfoDelCond', {})
+            with self.lock:
+                for item in cond.get('employeeNoList', []):
+                    emp = str(item.get('employeeNo'))
+                    self.users.pop(emp, None)
+                    self.faces.pop(emp, None)
+            return jsonify({"statusCode": 1, "statusString": "OK", "subStatusCode": "ok"})
+
+        @app.route('/ISAPI/Intelligent/FDLib/FaceDataRecord', methods=['POST'])
+        @app.route('/ISAPI/Intelligent/FDLib/FDModify', methods=['PUT'])
+        def face_write():
+            try:
+                meta = json.loads(request.form.get('FaceDataRecord') or request.form.get('FaceDataModify') or '{}')
+            except ValueError:
+                meta = {}
+            image = next(iter(request.files.values()), None)
+            emp = str(meta.get('FPID') or meta.get('employeeNo') or '')
+            if not emp or image is None:
+                return jsonify({"statusCode": 6, "statusString": "Invalid Content", "subStatusCode": "badParameters"}), 400
+            with self.lock:
+                self.faces[emp] = len(image.read())
+            return jsonify({"statusCode": 1, "statusString": "OK", "subStatusCode": "ok"})
+
+        @app.route('/ISAPI/Intelligent/FDLib/FDSearch', methods=['POST'])
+        def face_search():
+            cond = request.get_json(silent=True) or {}
+            position = int(cond.get('searchResultPosition', 0) or 0)
+            max_results = min(int(cond.get('maxResults', 30) or 30), int(self.profile['max_page_size']))
+            with self.lock:
+                faces = [{"FPID": emp, "faceURL": f"http://{self.ip}/LOCALS/pic/face_{emp}.jpeg"} for emp in self.faces]
+            page = faces[position:position + max_results]
+            status = "MORE" if position + len(page) < len(faces) else "OK"
+            return jsonify({"statusCode": 1, "statusString": "OK", "responseStatusStrg": status,
+                            "numOfMatches": len(page), "totalMatches": len(faces), "MatchList": page})
+
+        return app
+
+    # --- Siklus hidup ---
+    def start(self):
+        self.threads = [threading.Thread(target=self.server.serve_forever, name=f"sim-http-{self.port}", daemon=True),
+                        threading.Thread(target=self.generate_loop, name=f"sim-gen-{self.port}", daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def stop_generating(self):
+        self.stop_event.set()
+
+    def shutdown(self):
+        self.stop_event.set()
+        self.server.shutdown()
+
+def start_farm(count, base_port, profile='normal', **kwargs):
+    """Menjalankan `count` perangkat simulasi di port berurutan mulai `base_port`."""
+    devices = []
+    for i in range(count):
+        device = SimulatedDevice(base_port + i, profile=profile, **kwargs)
+        device.start()
+        devices.append(device)
+    return devices
+
+def farm_stats(devices):
+    """Menjumlahkan statistik HTTP dan event dari seluruh perangkat simulasi."""
+    total = {'requests': 0, 'challenges': 0, 'injected_errors': 0, 'endpoints': {},
+             'backlog': 0, 'live': 0, 'face_live': 0}
+    for device in devices:
+        with device.lock:
+            for key in ('requests', 'challenges', 'injected_errors'):
+                total[key] += device.stats[key]
+            for endpoint, n in device.stats['endpoints'].items():
+                total['endpoints'][endpoint] = total['endpoints'].get(endpoint, 0) + n
+            for key, n in device.generated.items():
+                total[key] += n
+    return total
+
+# --- ENTRY POINT (jalankan farm saja, mis. untuk uji manual lewat app.py) ---
+def main():
+    parser = argparse.ArgumentParser(description="Simulator perangkat Hikvision ISAPI untuk benchmark.")
+    parser.add_argument('--devices', type=int, default=5)
+    parser.add_argument('--base-port', type=int, default=9100)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='normal')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='bench12345')
+    parser.add_argument('--backlog-events', type=int, default=0)
+    parser.add_argument('--backlog-hours', type=float, default=6)
+    args = parser.parse_args()
+
+    devices = start_farm(args.devices, args.base_port, args.profile, username=args.username, password=args.password,
+                         backlog_events=args.backlog_events, backlog_hours=args.backlog_hours)
+    print(f"{len(devices)} perangkat simulasi ({args.profile}) aktif: "
+          f"127.0.0.1:{args.base_port} s/d 127.0.0.1:{args.base_port + args.devices - 1} "
+          f"(user '{args.username}', password '{args.password}'). Ctrl+C untuk berhenti.")
+    try:
+        while True:
+            time.sleep(10)
+            stats = farm_stats(devices)
+            print(f"event live={stats['live']} backlog={stats['backlog']} request={stats['requests']} "
+                  f"challenge={stats['challenges']} error={stats['injected_errors']}")
+    except KeyboardInterrupt:
+        for device in devices:
+            device.shutdown()
+
+if __name__ == "__main__":
+    main()
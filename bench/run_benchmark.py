@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import mysql.connector
+
+import config
+
+# ==========================================
+# RUNNER BENCHMARK END-TO-END
+# ==========================================
+# Menjalankan N perangkat simulasi -> sync_service -> worker_service -> target API tiruan
+# di satu proses, lalu melaporkan throughput, persentil latensi end-to-end, serta jumlah
+# koneksi/query DB dan request HTTP. Jalankan dari root repo:
+#   python -m bench.run_benchmark --devices 20 --profile burst --duration 120
+# Database benchmark terpisah dari produksi (default: <DB_NAME>_bench) dan harus sudah bisa
+# dibuat oleh DB_USER di config.py.
+
+def parse_args():
+    from bench.device_simulator import PROFILES
+    parser = argparse.ArgumentParser(description="Benchmark ingest sync_service + worker_service dengan perangkat simulasi.")
+    parser.add_argument('--devices', type=int, default=10, help="Jumlah perangkat simulasi")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='normal')
+    parser.add_argument('--duration', type=float, default=60, help="Lama pembuatan event live (detik)")
+    parser.add_argument('--drain', type=float, default=120, help="Batas tunggu pengiriman sisa antrean setelah event berhenti (detik)")
+    parser.add_argument('--base-port', type=int, default=9100)
+    parser.add_argument('--target-port', type=int, default=9099)
+    parser.add_argument('--rate', type=float, help="Override event/detik per perangkat")
+    parser.add_argument('--latency-ms', type=float, help="Override latensi perangkat")
+    parser.add_argument('--error-rate', type=float, help="Override peluang error 503 perangkat")
+    parser.add_argument('--backlog-events', type=int, default=0, help="Event lama per perangkat (menguji catch-up)")
+    parser.add_argument('--backlog-hours', type=float, default=6)
+    parser.add_argument('--target-latency-ms', type=float, default=0)
+    parser.add_argument('--target-error-rate', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=1, help="Kirim ke target dalam batch (>1 = mode batch)")
+    parser.add_argument('--batch-wait', type=int, default=2, help="Batas tunggu batch penuh (detik)")
+    parser.add_argument('--format', choices=['json', 'multipart'], default='json', help="Format pengiriman ke target")
+    parser.add_argument('--setting', action='append', default=[], metavar='KEY=VALUE',
+                        help="Pengaturan tabel settings untuk run ini, mis. --setting worker_api_interval=1")
+    parser.add_argument('--db-name', default=f"{config.DB_NAME}_bench")
+    parser.add_argument('--reset', action='store_true', help="Hapus dan buat ulang database benchmark sebelum mulai")
+    parser.add_argument('--workdir', default='bench_run', help="Direktori kerja (gambar & log service)")
+    parser.add_argument('--json', dest='json_path', help="Simpan hasil juga sebagai file JSON")
+    return parser.parse_args()
+
+def prepare_database(db_name, reset):
+    if db_name == config.DB_NAME:
+        sys.exit(f"Menolak memakai database produksi '{db_name}' untuk benchmark. Gunakan --db-name lain.")
+    conn = mysql.connector.connect(host=config.DB_HOST, user=config.DB_USER, password=config.DB_PASS, autocommit=True)
+    c = conn.cursor()
+    if reset:
+        c.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
+    c.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}`")
+    c.close()
+    conn.close()
+
+def count_mysql_questions():
+    """Jumlah statement yang diterima server MySQL (global; anggap server khusus benchmark)."""
+    conn = mysql.connector.connect(host=config.DB_HOST, user=config.DB_USER, password=config.DB_PASS)
+    c = conn.cursor()
+    try:
+        c.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+        row = c.fetchone()
+        return int(row[1]) if row else 0
+    finally:
+        c.close()
+        conn.close()
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+def main():
+    args = parse_args()
+
+    # Konfigurasi harus diubah SEBELUM database/sync_service/worker_service diimpor (from config import ...)
+    prepare_database(args.db_name, args.reset)
+    config.DB_NAME = args.db_name
+    # Perangkat simulasi berupa 127.0.0.1:<port>: status online dicek lewat port ISAPI-nya
+    config.DEVICE_PING_METHOD = "tcp"
+    import database as db
+    import sync_service
+    import worker_service
+    from bench.device_simulator import start_farm, farm_stats, EVENT_BORN, EVENT_BORN_LOCK
+    from bench.target_api import TargetApi
+
+    # Gambar (static/images) dan log service ditulis relatif terhadap direktori kerja
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+
+    # --- Instrumentasi: hitung koneksi DB yang dibuka oleh service ---
+    db_calls = {'connections': 0}
+    db_calls_lock = threading.Lock()
+    original_get_db = db.get_db
+    def counted_get_db():
+        with db_calls_lock:
+            db_calls['connections'] += 1
+        return original_get_db()
+    db.get_db = counted_get_db
+
+    db.init_db()
+    for item in args.setting:
+        key, _, value = item.partition('=')
+        if not key or not _:
+            sys.exit(f"Format --setting salah: '{item}' (harus KEY=VALUE)")
+        db.update_setting(key.strip(), value.strip())
+
+    target = TargetApi(args.target_port, latency_ms=args.target_latency_ms, error_rate=args.target_error_rate)
+    target.start()
+    if args.batch_size > 1 or args.format != 'json':
+        db.save_api_target(target.url, args.batch_size, args.batch_wait, args.format)
+    else:
+        db.delete_api_target(target.url)
+
+    username, password = 'admin', 'bench12345'
+    farm = start_farm(args.devices, args.base_port, args.profile, username=username, password=password,
+                      backlog_events=args.backlog_events, backlog_hours=args.backlog_hours,
+                      rate=args.rate, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    for i, device in enumerate(farm):
+        if not db.get_device_by_ip(device.ip):
+            db.add_device(device.ip, f"BENCH-{i + 1:03d}", "Benchmark", target.url, username, password)
+
+    print(f"Benchmark: {args.devices} perangkat ({args.profile}), {args.duration:.0f}s event live, DB '{args.db_name}'.")
+    questions_before = count_mysql_questions()
+    with db_calls_lock:
+        db_calls['connections'] = 0
+    started = time.monotonic()
+
+    threading.Thread(target=sync_service.main_sync, name="bench-sync", daemon=True).start()
+    threading.Thread(target=worker_service.main_worker, name="bench-worker", daemon=True).start()
+
+    time.sleep(args.duration)
+    for device in farm:
+        device.stop_generating()
+    generation_ended = time.monotonic()
+
+    # --- Tunggu sisa antrean terkirim (semua event wajah live diterima target) ---
+    with EVENT_BORN_LOCK:
+        expected = set(EVENT_BORN)
+    deadline = generation_ended + args.drain
+    while time.monotonic() < deadline:
+        with target.lock:
+            if expected.issubset(target.received):
+                break
+        time.sleep(1)
+    finished = time.monotonic()
+
+    questions = count_mysql_questions() - questions_before
+    with db_calls_lock:
+        connections = db_calls['connections']
+
+    # --- Hitung hasil ---
+    with target.lock:
+        received = dict(target.received)
+        target_stats = dict(target.stats)
+    with EVENT_BORN_LOCK:
+        born = dict(EVENT_BORN)
+    latencies = [received[emp] - born[emp] for emp in born if emp in received]
+    last_delivery = max(received.values()) if received else finished
+    elapsed = max(last_delivery - started, 1e-9)
+    sim = farm_stats(farm)
+
+    conn = original_get_db()
+    c = conn.cursor()
+    c.execute("SELECT apiStatus, COUNT(*) FROM events GROUP BY apiStatus")
+    rows_by_status = {status: n for status, n in c.fetchall()}
+    c.close()
+    conn.close()
+
+    result = {
+        'devices': args.devices,
+        'profile': args.profile,
+        'duration_s': args.duration,
+        'events_generated': {'live': sim['live'], 'face_live': sim['face_live'], 'backlog': sim['backlog']},
+        'rows_by_status': rows_by_status,
+        'delivered': len(received),
+        'delivered_live': len(latencies),
+        'missing_live': len(born) - len(latencies),
+        'throughput_eps': round(len(received) / elapsed, 2),
+        'latency_s': {name: (round(percentile(latencies, pct), 3) if latencies else None)
+                      for name, pct in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))},
+        'db': {'connections': connections, 'questions': questions},
+        'http_device': {'requests': sim['requests'], 'digest_challenges': sim['challenges'],
+                        'injected_errors': sim['injected_errors'], 'by_endpoint': sim['endpoints']},
+        'http_target': target_stats,
+        'wall_time_s': round(finished - started, 1),
+    }
+
+    print("\n=== HASIL BENCHMARK ===")
+    print(f"Event live dibuat     : {sim['live']} ({sim['face_live']} wajah), backlog: {sim['backlog']}")
+    print(f"Baris events per status: {rows_by_status}")
+    print(f"Terkirim ke target    : {len(received)} (live {len(latencies)}, belum sampai {result['missing_live']})")
+    print(f"Throughput pengiriman : {result['throughput_eps']} event/detik")
+    lat = result['latency_s']
+    print(f"Latensi end-to-end (s): p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+    print(f"DB                    : {connections} koneksi, {questions} query (Questions)")
+    print(f"HTTP perangkat        : {sim['requests']} request, {sim['challenges']} challenge digest, "
+          f"{sim['injected_errors']} error buatan")
+    for endpoint, n in sorted(sim['endpoints'].items()):
+        print(f"  {endpoint:<45} {n}")
+    print(f"HTTP target           : {target_stats['requests']} request ({target_stats['batches']} batch, "
+          f"{target_stats['events']} event), {target_stats['duplicates']} duplikat, "
+          f"{target_stats['injected_errors']} error buatan")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Hasil disimpan di {os.path.abspath(args.json_path)}")
+
+    for device in farm:
+        device.shutdown()
+    target.shutdown()
+
+if __name__ == "__main__":
+    main()
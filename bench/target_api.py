@@ -0,0 +1,88 @@
+import json
+import time
+import random
+import threading
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+# ==========================================
+# TARGET API TIRUAN (pengganti targetApi/HRIS saat benchmark)
+# ==========================================
+# Menerima payload worker_service ({"device", "authId", "date", "picture"}) dan mencatat waktu
+# terima per authId. Karena simulator membuat employeeNo unik per event, authId cukup untuk
+# mencocokkan event ke waktu lahirnya (EVENT_BORN) dan menghitung latensi end-to-end.
+# Mode batch ({"events": [...]}) juga diterima dan dijawab dengan hasil per event; aktifkan di
+# runner dengan --batch-size agar URL target didaftarkan di tabel api_targets. Format multipart
+# (--format multipart) diterima dalam kedua mode; gambar dihitung dari bagian file "picture*".
+
+class TargetApi:
+    def __init__(self, port, host='127.0.0.1', latency_ms=0, error_rate=0.0):
+        self.host, self.port = host, port
+        self.url = f"http://{host}:{port}/attendance"
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        # authId -> waktu (monotonic) pertama kali diterima
+        self.received = {}
+        self.stats = {'requests': 0, 'batches': 0, 'events': 0, 'duplicates': 0, 'injected_errors': 0,
+                      'with_picture': 0, 'bytes': 0}
+        self.server = make_server(host, port, self.create_app(), threaded=True)
+        self.thread = None
+
+    def create_app(self):
+        app = Flask(f"target-{self.port}")
+
+        @app.route('/attendance', methods=['POST'])
+        def attendance():
+            arrived = time.monotonic()
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['bytes'] += request.content_length or 0
+
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000.0)
+            if random.random() < self.error_rate:
+                with self.lock:
+                    self.stats['injected_errors'] += 1
+                return jsonify({'error': 'Injected failure'}), 503
+
+            if request.mimetype == 'multipart/form-data':
+                payload = request.form.to_dict()
+                if 'events' in payload:
+                    payload['events'] = json.loads(payload['events'])
+                    for item in payload['events']:
+                        item['picture'] = f"picture_{item.get('eventId')}" in request.files
+                else:
+                    payload['picture'] = 'picture' in request.files
+            else:
+                payload = request.get_json(silent=True) or {}
+            if 'events' in payload:
+                with self.lock:
+                    self.stats['batches'] += 1
+                for item in payload['events']:
+                    self.record(item, arrived)
+                return jsonify({'results': [{'eventId': item.get('eventId'), 'ok': True} for item in payload['events']]}), 200
+            self.record(payload, arrived)
+            return jsonify({'status': 'ok'}), 200
+
+        return app
+
+    def record(self, payload, arrived):
+        # JSON membawa authId sebagai angka, multipart sebagai teks: kunci selalu str agar cocok dengan EVENT_BORN
+        auth_id = payload.get('authId')
+        auth_id = None if auth_id is None else str(auth_id)
+        with self.lock:
+            self.stats['events'] += 1
+            if auth_id in self.received:
+                self.stats['duplicates'] += 1
+            else:
+                self.received[auth_id] = arrived
+            if payload.get('picture'):
+                self.stats['with_picture'] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f"target-{self.port}", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.server.shutdown()
@@ -8,6 +8,58 @@ DB_NAME = "web_master"
 # Pengaturan Global
 TIMEZONE = "+07:00"
 IMG_DIR = "static/images"
+SETTINGS_REFRESH_SECONDS = 5 # Batas jeda perubahan pengaturan (halaman /settings) sampai ke semua service
+
+# Pengaturan Klien ISAPI (isapi_client.py, semua koneksi ke perangkat)
+REQUEST_TIMEOUT = 30 # Timeout baca default (detik) jika pemanggil tidak menentukan
+ISAPI_CONNECT_TIMEOUT = 5 # Timeout membuka koneksi TCP ke perangkat
+ISAPI_MAX_CONNECTIONS_PER_DEVICE = 4 # Batas koneksi bersamaan per perangkat (request lain menunggu)
+ISAPI_POOL_TIMEOUT = 30 # Maks. menunggu koneksi bebas ke perangkat (detik) sebelum request dianggap gagal
+ISAPI_RETRIES = 2 # Ulangi error koneksi/timeout/502-504 (default, bisa diubah per pemanggilan)
+ISAPI_RETRY_BACKOFF = 1 # Jeda awal antar retry (detik), berlipat dua setiap percobaan
+USER_SEARCH_PAGE_SIZE = 30 # maxResults per halaman UserInfo/Search (perangkat boleh membalas lebih sedikit)
+
+# Pengaturan Klien Target API (target_client.py, pengiriman event oleh worker_service)
+API_TARGET_CONNECT_TIMEOUT = 5 # Timeout membuka koneksi TCP ke targetApi
+API_TARGET_MAX_CONNECTIONS = 50 # Koneksi keep-alive per targetApi (>= api_concurrency_max)
+API_BREAKER_FAILURES = 5 # Kegagalan berturut-turut sebelum breaker target OPEN (event ditunda)
+API_BREAKER_RESET_SECONDS = 30 # Lama breaker OPEN sebelum satu request probe dikirim
+API_DELIVERY_MAX_THREADS = 64 # Batas thread pengiriman worker (satu pool untuk semua target)
+API_PAYLOAD_CACHE_BYTES = 32 * 1024 * 1024 # Batas cache gambar base64 (mode JSON) yang dipakai ulang saat retry
+
+# Pengaturan Engine ISAPI Async (isapi_async.py, operasi batch ke banyak perangkat)
+ASYNC_ISAPI_GLOBAL_LIMIT = 200 # Maks. request bersamaan ke semua perangkat
+ASYNC_ISAPI_PER_DEVICE_LIMIT = 2 # Maks. request bersamaan ke satu perangkat
+ASYNC_ISAPI_TIMEOUT = 15 # Batas waktu (detik) per request / per perangkat dalam satu batch
+# Cek keterjangkauan perangkat (status online/offline di worker, notifikasi WA, dan tombol ping dashboard):
+# "icmp" = ping ICMP ke host perangkat (default); "tcp" = koneksi TCP ke port ISAPI perangkat
+# (port dari kolom ip "host:port", default 80) untuk jaringan yang memblokir ICMP.
+DEVICE_PING_METHOD = "icmp"
+DEVICE_PING_TIMEOUT = 1 # Batas waktu (detik) satu probe
+
+# Pengaturan Scheduler sync_service
+DEVICE_REFRESH_SECONDS = 15 # Interval cek perangkat baru/dihapus di DB (tanpa restart)
+
+# Pengaturan Pipeline Unduh Gambar (sync_service)
+IMAGE_QUEUE_MAX = 500 # Batas antrean job unduh gambar di memori
+IMAGE_SWEEP_SECONDS = 30 # Interval pengambilan ulang baris 'image_pending' dari DB
+
+# Pengaturan Wakeup Worker (UDP lokal: sync/push memberi sinyal saat ada event siap kirim)
+WORKER_WAKEUP_LISTEN = ("127.0.0.1", 8091) # Alamat yang didengarkan worker_service
+WORKER_WAKEUP_ADDRS = [("127.0.0.1", 8091)] # Tujuan sinyal dari sync/push (tambahkan node worker lain di sini)
+# Wakeup pipeline gambar sync_service: push_service memberi sinyal saat menyimpan event tanpa gambar terlampir
+SYNC_IMAGE_WAKEUP_LISTEN = ("127.0.0.1", 8092) # Alamat yang didengarkan sync_service
+SYNC_IMAGE_WAKEUP_ADDRS = [("127.0.0.1", 8092)] # Tujuan sinyal dari push_service
+
+# Pengaturan Push Service (penerima event dari perangkat / HTTP Listening)
+PUSH_LISTEN_HOST = "0.0.0.0"
+PUSH_LISTEN_PORT = 8090
+# Autentikasi event push (minimal salah satu wajib diisi, jika tidak push service menolak berjalan):
+# - PUSH_SHARED_SECRET: token yang dikonfigurasi di perangkat, dikirim sebagai segmen terakhir URL
+#   (mis. http://server:8090/push/<token>), header X-Push-Token, atau password HTTP Basic.
+# - PUSH_ALLOWED_NETWORKS: daftar IP/CIDR sumber yang boleh mengirim push (mis. ["10.0.5.0/24"]).
+PUSH_SHARED_SECRET = ""
+PUSH_ALLOWED_NETWORKS = []
 
 # Pengaturan Direktori Log
 EVENT_LOG_DIR = "event_logs"       # Untuk log bersih (event yang diproses)
@@ -16,6 +68,14 @@ SERVICE_LOG_DIR = "service_logs" # Untuk semua event mentah yang diterima
 # Pengaturan Catch-up (Masih digunakan oleh sync_service.py)
 CATCH_UP_CHUNK_MINUTES = 10
 BIG_CATCHUP_THRESHOLD_SECONDS = 3600 # 1 jam
+# Ukuran jendela adaptif: kecil di jam sibuk, besar di malam hari (berdasarkan kepadatan event historis)
+CATCH_UP_MIN_CHUNK_MINUTES = 2
+CATCH_UP_MAX_CHUNK_MINUTES = 360 # 6 jam
+CATCH_UP_DENSITY_DAYS = 7 # Rentang histori untuk menghitung kepadatan event per jam
+
+# Deteksi kemampuan perangkat yang gagal tidak diulang setiap poll: jeda backoff naik 2x per kegagalan
+CAPABILITY_PROBE_BACKOFF_SECONDS = 30
+CAPABILITY_PROBE_BACKOFF_MAX_SECONDS = 900 # 15 menit
 
 # --- PEMETAAN EVENT HIKVISION (LENGKAP) ---
 EVENT_MAP = {
@@ -1,7 +1,9 @@
 import mysql.connector
-from config import DB_HOST, DB_USER, DB_PASS, DB_NAME
+from config import DB_HOST, DB_USER, DB_PASS, DB_NAME, SETTINGS_REFRESH_SECONDS
 from datetime import datetime, date, timedelta
 import os
+import time
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 
 def get_db():
@@ -30,6 +32,28 @@ def init_db():
     try:
         c.execute("ALTER TABLE events ADD COLUMN apiRetryCount INT DEFAULT 0")
     except mysql.connector.Error: pass 
+    try:
+        # Lease antrean API: baris diklaim satu worker sampai leaseUntil (lewat = bisa diklaim ulang)
+        c.execute("ALTER TABLE events ADD COLUMN leaseOwner VARCHAR(100) NULL, ADD COLUMN leaseUntil DATETIME NULL")
+    except mysql.connector.Error: pass
+    try:
+        c.execute("ALTER TABLE events ADD INDEX idx_api_queue (apiStatus, id)")
+    except mysql.connector.Error: pass
+    try:
+        # Jadwal retry (backoff): baris 'failed' baru boleh diklaim lagi setelah nextAttemptAt
+        c.execute("ALTER TABLE events ADD COLUMN nextAttemptAt DATETIME NULL")
+    except mysql.connector.Error: pass
+    try:
+        c.execute("ALTER TABLE events ADD INDEX idx_api_due (apiStatus, nextAttemptAt, id)")
+    except mysql.connector.Error: pass
+    try:
+        # Jalur prioritas antrean API (realtime / catch-up) diklaim terpisah
+        c.execute("ALTER TABLE events ADD INDEX idx_api_lane (apiStatus, syncType, nextAttemptAt, id)")
+    except mysql.connector.Error: pass
+    try:
+        # Penanda event yang ditahan menunggu batch penuh (boleh diambil lebih awal untuk melengkapi batch)
+        c.execute("ALTER TABLE events ADD COLUMN batchWaiting TINYINT(1) NOT NULL DEFAULT 0")
+    except mysql.connector.Error: pass
 
     # Tabel Devices
     c.execute("""
@@ -46,6 +70,108 @@ def init_db():
         )
     """)
     
+    # Tabel Cursor Sync (checkpoint per perangkat untuk sync_service)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS device_cursors (
+            ip VARCHAR(50) PRIMARY KEY,
+            lastSerialNo BIGINT DEFAULT 0,
+            lastEventTime DATETIME NULL,
+            searchStartTime DATETIME NULL,
+            searchPosition INT DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    try:
+        # Nomor seri perangkat terakhir yang dikenal (deteksi penggantian perangkat -> serialNo mulai ulang)
+        c.execute("ALTER TABLE device_cursors ADD COLUMN deviceSerial VARCHAR(100) NULL")
+    except mysql.connector.Error: pass
+
+    # Tabel Profil Kemampuan Perangkat (hasil deteksi sekali, dipakai ulang oleh sync_service)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS device_capabilities (
+            ip VARCHAR(50) PRIMARY KEY,
+            timeFormat VARCHAR(10) NULL,
+            maxPageSize INT NULL,
+            supportsPush BOOLEAN NULL,
+            supportsPicture BOOLEAN NULL,
+            firmware VARCHAR(100) NULL,
+            probedAt DATETIME NULL
+        )
+    """)
+    
+    # Tabel Dead-letter: event yang gagal permanen (apiStatus='dead') beserta alasannya, untuk dikirim ulang
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS dead_letter_events (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            sourceEventId BIGINT NOT NULL,
+            eventId BIGINT NULL,
+            deviceName VARCHAR(255),
+            employeeId INT NULL,
+            name VARCHAR(255),
+            date VARCHAR(10),
+            time VARCHAR(8),
+            syncType VARCHAR(20),
+            targetApi VARCHAR(255),
+            retryCount INT DEFAULT 0,
+            reason VARCHAR(500),
+            failedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            replayedAt DATETIME NULL,
+            UNIQUE(sourceEventId),
+            INDEX idx_dead_letter_open (replayedAt, targetApi, id)
+        )
+    """)
+    # Migrasi: kolom eventId lama berisi events.id -> diganti nama sourceEventId; eventId kini serialNo perangkat
+    try:
+        c.execute("ALTER TABLE dead_letter_events CHANGE COLUMN eventId sourceEventId BIGINT NOT NULL")
+    except mysql.connector.Error: pass
+    try:
+        c.execute("ALTER TABLE dead_letter_events RENAME INDEX eventId TO sourceEventId")
+    except mysql.connector.Error: pass
+    try:
+        c.execute("ALTER TABLE dead_letter_events ADD COLUMN eventId BIGINT NULL AFTER sourceEventId")
+    except mysql.connector.Error: pass
+    try:
+        c.execute("""
+            UPDATE dead_letter_events dl JOIN events e ON e.id = dl.sourceEventId
+            SET dl.eventId = e.eventId WHERE dl.eventId IS NULL
+        """)
+    except mysql.connector.Error: pass
+    
+    # Tabel Antrean Notifikasi WhatsApp (satu baris per penerima per peringatan; digabung saat dikirim)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS notification_queue (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            recipient VARCHAR(30) NOT NULL,
+            groupKey VARCHAR(255) NOT NULL,
+            groupTitle VARCHAR(500) NULL,
+            summary VARCHAR(500) NULL,
+            message TEXT NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            attempts INT DEFAULT 0,
+            nextAttemptAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sentAt DATETIME NULL,
+            INDEX idx_notification_due (status, nextAttemptAt)
+        )
+    """)
+    
+    # Tabel Target API (opsi pengiriman per URL targetApi; URL tanpa baris = mode satu event per request)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS api_targets (
+            url VARCHAR(255) PRIMARY KEY,
+            batchSize INT NOT NULL DEFAULT 1,
+            batchMaxWaitSeconds INT NOT NULL DEFAULT 0
+        )
+    """)
+    try:
+        # Format pengiriman: 'json' (gambar base64) atau 'multipart' (gambar sebagai file)
+        c.execute("ALTER TABLE api_targets ADD COLUMN format VARCHAR(10) NOT NULL DEFAULT 'json'")
+    except mysql.connector.Error: pass
+    try:
+        # Konkurensi pengiriman terakhir hasil kontrol adaptif worker (informasi & nilai awal saat restart)
+        c.execute("ALTER TABLE api_targets ADD COLUMN concurrency INT NULL")
+    except mysql.connector.Error: pass
+    
     # Tabel Users
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -63,6 +189,11 @@ def init_db():
         )
     """)
 
+    try:
+        # Penanda perubahan untuk cache pengaturan (presisi mikrodetik)
+        c.execute("ALTER TABLE settings ADD COLUMN updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)")
+    except mysql.connector.Error: pass
+
     # Data Default User
     c.execute("SELECT COUNT(*) FROM users")
     if c.fetchone()[0] == 0:
@@ -83,12 +214,30 @@ def init_db():
         ('worker_api_interval', '15'),
         ('poll_interval', '2'),
         ('event_sleep_delay', '1'),
+        ('governor_max_rate', '20'),
+        ('governor_latency_target', '2'),
         ('realtime_tolerance', '120'),
         ('request_timeout', '30'),
         ('api_queue_limit', '5'),
+        ('api_lease_seconds', '120'),
+        ('api_retry_base_seconds', '10'),
+        ('api_retry_max_seconds', '600'),
+        ('lane_weight_realtime', '4'),
+        ('lane_weight_catchup', '1'),
+        ('api_concurrency_min', '1'),
+        ('api_concurrency_max', '20'),
+        ('api_latency_target_ms', '1000'),
+        ('dead_letter_replay_batch', '100'),
+        ('dead_letter_replay_interval', '10'),
+        ('wa_coalesce_seconds', '30'),
+        ('wa_rate_per_minute', '6'),
         ('event_batch_max', '100'),
         ('sync_download_retries', '5'),
-        ('worker_download_retries', '2')
+        ('catchup_parallel_windows', '3'),
+        ('push_gap_repair_interval', '300'),
+        ('worker_download_retries', '2'),
+        ('image_fetch_workers', '4'),
+        ('image_fetch_per_device', '2')
     ]
     
     for key, val in default_settings:
@@ -102,22 +251,83 @@ def init_db():
     try:
         c.execute("ALTER TABLE devices ADD COLUMN is_active BOOLEAN DEFAULT TRUE")
     except mysql.connector.Error: pass
+    try:
+        # Ukuran halaman AcsEvent per perangkat (NULL = pakai event_batch_max)
+        c.execute("ALTER TABLE devices ADD COLUMN eventPageSize INT NULL")
+    except mysql.connector.Error: pass
+    try:
+        # Mode push: event dikirim perangkat ke push_service, polling hanya untuk menambal celah
+        c.execute("ALTER TABLE devices ADD COLUMN pushEnabled BOOLEAN DEFAULT FALSE")
+        c.execute("ALTER TABLE devices ADD COLUMN lastPush DATETIME NULL")
+    except mysql.connector.Error: pass
     
     c.close()
     conn.close()
 
 # --- FUNGSI PENGATURAN ---
+# Semua pengaturan disimpan di cache dalam proses dan dimuat dengan satu query.
+# Perubahan dideteksi lewat (COUNT, MAX(updated_at)) paling sering tiap SETTINGS_REFRESH_SECONDS,
+# sehingga loop yang sering membaca pengaturan tidak lagi membuka koneksi DB per pembacaan.
+SETTINGS_CACHE = {}
+SETTINGS_LOCK = threading.Lock()
+SETTINGS_STATE = {'version': None, 'checked_at': 0.0}
+# Single-flight: hanya satu thread yang memuat ulang cache pada satu waktu
+SETTINGS_REFRESH_LOCK = threading.Lock()
+
+def settings_refresh_due(force):
+    with SETTINGS_LOCK:
+        loaded = SETTINGS_STATE['version'] is not None
+        return force or not loaded or time.monotonic() - SETTINGS_STATE['checked_at'] >= SETTINGS_REFRESH_SECONDS
+
+def refresh_settings_cache(force=False):
+    if not settings_refresh_due(force):
+        return
+    # Cache dingin: thread lain menunggu hasil muat pertama. Cache sudah terisi: mereka langsung
+    # memakai nilai lama selagi satu thread memuat ulang.
+    with SETTINGS_LOCK:
+        loaded = SETTINGS_STATE['version'] is not None
+    if not SETTINGS_REFRESH_LOCK.acquire(blocking=not loaded):
+        return
+    try:
+        with SETTINGS_LOCK:
+            loaded = SETTINGS_STATE['version'] is not None
+            if loaded and not force and time.monotonic() - SETTINGS_STATE['checked_at'] < SETTINGS_REFRESH_SECONDS:
+                return # Sudah dimuat thread lain selama menunggu
+            SETTINGS_STATE['checked_at'] = time.monotonic()
+
+        conn = get_db()
+        c = conn.cursor()
+        try:
+            c.execute("SELECT COUNT(*), MAX(updated_at) FROM settings")
+            version = tuple(c.fetchone())
+            if version != SETTINGS_STATE['version']:
+                c.execute("SELECT setting_key, setting_value FROM settings")
+                values = dict(c.fetchall())
+                with SETTINGS_LOCK:
+                    SETTINGS_CACHE.clear()
+                    SETTINGS_CACHE.update(values)
+                    SETTINGS_STATE['version'] = version
+        finally:
+            c.close()
+            conn.close()
+    except mysql.connector.Error as e:
+        if not loaded:
+            raise
+        # DB sedang bermasalah: tetap pakai nilai cache terakhir
+        print(f"Error refreshing settings cache: {e}")
+    finally:
+        SETTINGS_REFRESH_LOCK.release()
 
 def get_setting(key, default=None):
-    conn = get_db()
-    c = conn.cursor(dictionary=True)
-    c.execute("SELECT setting_value FROM settings WHERE setting_key = %s", (key,))
-    result = c.fetchone()
-    c.close()
-    conn.close()
-    if result:
-        return result['setting_value']
-    return default
+    refresh_settings_cache()
+    with SETTINGS_LOCK:
+        return SETTINGS_CACHE.get(key, default)
+
+def get_settings_version():
+    """Versi cache pengaturan; berubah hanya jika isi tabel settings berubah (untuk konfigurasi turunan)."""
+    refresh_settings_cache()
+    with SETTINGS_LOCK:
+        return SETTINGS_STATE['version']
 
 def update_setting(key, value):
     conn = get_db()
@@ -125,7 +335,10 @@ def update_setting(key, value):
     try:
         c.execute("UPDATE settings SET setting_value = %s WHERE setting_key = %s", (value, key))
         if c.rowcount == 0:
-            c.execute("INSERT INTO settings (setting_key, setting_value) VALUES (%s, %s)", (key, value))
+            c.execute("INSERT IGNORE INTO settings (setting_key, setting_value) VALUES (%s, %s)", (key, value))
+        # Proses ini langsung melihat nilai baru; proses lain dalam <= SETTINGS_REFRESH_SECONDS
+        with SETTINGS_LOCK:
+            SETTINGS_STATE['checked_at'] = 0.0
         return True
     except Exception as e:
         print(f"Error updating setting: {e}")
@@ -240,11 +453,39 @@ def update_device(original_ip, name, location, target_api, username, password):
     conn.close()
     return affected > 0
 
+def update_device_event_page_size(ip, page_size):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("UPDATE devices SET eventPageSize=%s WHERE ip=%s", (page_size, ip))
+    affected = c.rowcount
+    c.close()
+    conn.close()
+    return affected > 0
+
+def update_device_push_enabled(ip, enabled):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("UPDATE devices SET pushEnabled=%s WHERE ip=%s", (enabled, ip))
+    affected = c.rowcount
+    c.close()
+    conn.close()
+    return affected > 0
+
+def update_device_last_push(ip):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("UPDATE devices SET lastPush=NOW() WHERE ip=%s", (ip,))
+    c.close()
+    conn.close()
+
 def delete_device(ip):
     conn = get_db()
     c = conn.cursor()
     c.execute("DELETE FROM devices WHERE ip=%s", (ip,))
     affected = c.rowcount
+    # Cursor ikut dihapus agar IP yang didaftarkan ulang mulai dari awal
+    c.execute("DELETE FROM device_cursors WHERE ip=%s", (ip,))
+    c.execute("DELETE FROM device_capabilities WHERE ip=%s", (ip,))
     c.close()
     conn.close()
     return affected > 0
@@ -271,37 +512,694 @@ def get_devices_status():
         result.append(row)
     return result
 
-# --- FUNGSI WORKER ---
+def get_existing_event_ids(device_name, event_ids):
+    """Mengembalikan set eventId (serialNo) yang sudah tersimpan untuk perangkat ini."""
+    if not event_ids or not device_name: return set()
+    conn = get_db()
+    c = conn.cursor()
+    format_strings = ','.join(['%s'] * len(event_ids))
+    c.execute(f"SELECT eventId FROM events WHERE deviceName = %s AND eventId IN ({format_strings})",
+              tuple([device_name] + list(event_ids)))
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return {row[0] for row in rows}
+
+EVENT_INSERT_COLUMNS = ['deviceName', 'eventId', 'employeeId', 'name', 'date', 'time', 'eventDesc',
+                        'pictureURL', 'localImagePath', 'syncType', 'apiStatus']
+
+def insert_events_batch(device_name, rows):
+    """
+    Menyimpan banyak event satu perangkat sekaligus: satu koneksi, satu transaksi,
+    satu INSERT IGNORE multi-baris. `rows` adalah list dict dengan kunci EVENT_INSERT_COLUMNS.
+    Mengembalikan (dict eventId -> id baris baru, list eventId yang duplikat).
+    Baris "baru" ditentukan setelah INSERT dari satu snapshot konsisten (REPEATABLE READ): snapshot hanya
+    memuat baris yang sudah ada saat transaksi dimulai + baris sisipan transaksi ini, sehingga event yang
+    disisipkan proses lain (push & poll bersamaan) di antara SELECT dan INSERT tidak ikut dihitung baru.
+    """
+    if not rows: return {}, []
+    # Buang duplikat di dalam batch itu sendiri
+    unique_rows = list({row['eventId']: row for row in rows}.values())
+    event_ids = [row['eventId'] for row in unique_rows]
+    id_placeholders = ','.join(['%s'] * len(event_ids))
 
-def get_pending_api_events(limit, max_retries):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ')
+        c.execute(f"SELECT eventId FROM events WHERE deviceName = %s AND eventId IN ({id_placeholders})",
+                  tuple([device_name] + event_ids))
+        existing = {row[0] for row in c.fetchall()}
+        new_rows = [row for row in unique_rows if row['eventId'] not in existing]
+
+        inserted = {}
+        if new_rows:
+            # apiRetryCount selalu dimulai dari 0
+            row_placeholder = "(" + ", ".join(['%s'] * len(EVENT_INSERT_COLUMNS)) + ", 0)"
+            sql = (f"INSERT IGNORE INTO events ({', '.join(EVENT_INSERT_COLUMNS)}, apiRetryCount) VALUES "
+                   + ", ".join([row_placeholder] * len(new_rows)))
+            values = [row[col] for row in new_rows for col in EVENT_INSERT_COLUMNS]
+            c.execute(sql, tuple(values))
+
+            # Baris yang diabaikan INSERT IGNORE karena sudah disisipkan proses lain setelah snapshot
+            # tidak terlihat di snapshot ini, jadi hanya sisipan transaksi ini yang terbaca
+            new_ids = [row['eventId'] for row in new_rows]
+            c.execute(f"SELECT id, eventId FROM events WHERE deviceName = %s AND eventId IN ({','.join(['%s'] * len(new_ids))})",
+                      tuple([device_name] + new_ids))
+            inserted = {row[1]: row[0] for row in c.fetchall()}
+        conn.commit()
+        return inserted, [event_id for event_id in event_ids if event_id not in inserted]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+        conn.close()
+
+def get_image_pending_events(limit):
+    """Event yang barisnya sudah tersimpan tapi gambarnya belum diunduh (apiStatus 'image_pending')."""
     conn = get_db()
     c = conn.cursor(dictionary=True)
-    query = """
-        SELECT e.*, d.targetApi, d.username as deviceUsername, d.password as devicePassword,
-               d.location as location 
+    c.execute("""
+        SELECT e.id, e.eventId, e.name, e.date, e.time, e.pictureURL, e.deviceName,
+               d.ip, d.username as deviceUsername, d.password as devicePassword
         FROM events e
         JOIN devices d ON e.deviceName = d.name
-        WHERE (e.apiStatus = 'pending' OR e.apiStatus = 'failed')
-          AND e.apiRetryCount < %s
-          AND d.targetApi IS NOT NULL 
-          AND d.targetApi != ''
-        ORDER BY e.id ASC 
+        WHERE e.apiStatus = 'image_pending'
+        ORDER BY e.id ASC
         LIMIT %s
-    """
-    c.execute(query, (max_retries, limit))
-    events = c.fetchall()
+    """, (limit,))
+    rows = c.fetchall()
     c.close()
     conn.close()
-    return events
+    return rows
+
+def update_event_image(event_id, local_image_path, status):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("UPDATE events SET localImagePath=%s, apiStatus=%s WHERE id=%s AND apiStatus='image_pending'",
+                  (local_image_path, status, event_id))
+    except Exception as e:
+        print(f"Error updating event image: {e}")
+    finally:
+        c.close()
+        conn.close()
+
+# --- FUNGSI CURSOR SYNC ---
+
+def get_all_device_cursors():
+    """Mengambil checkpoint sync semua perangkat, di-key berdasarkan IP."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    c.execute("SELECT ip, lastSerialNo, lastEventTime, searchStartTime, searchPosition, deviceSerial FROM device_cursors")
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return {row['ip']: row for row in rows}
 
-def update_event_api_status(event_id, status, retry_count):
+def save_device_cursor(ip, last_serial_no, last_event_time, search_start_time, search_position):
     conn = get_db()
     c = conn.cursor()
     try:
-        c.execute("UPDATE events SET apiStatus=%s, apiRetryCount=%s WHERE id=%s", 
-                  (status, retry_count, event_id))
+        c.execute("""
+            INSERT INTO device_cursors (ip, lastSerialNo, lastEventTime, searchStartTime, searchPosition)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                lastSerialNo = VALUES(lastSerialNo),
+                lastEventTime = VALUES(lastEventTime),
+                searchStartTime = VALUES(searchStartTime),
+                searchPosition = VALUES(searchPosition)
+        """, (ip, last_serial_no, last_event_time, search_start_time, search_position))
+        return True
+    except Exception as e:
+        print(f"Error saving device cursor: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def save_device_serial(ip, device_serial):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO device_cursors (ip, deviceSerial) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE deviceSerial = VALUES(deviceSerial)
+        """, (ip, device_serial))
+        return True
+    except Exception as e:
+        print(f"Error saving device serial: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+# --- FUNGSI PROFIL KEMAMPUAN PERANGKAT ---
+
+def get_all_device_capabilities():
+    """Mengambil profil kemampuan semua perangkat, di-key berdasarkan IP."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    c.execute("SELECT ip, timeFormat, maxPageSize, supportsPush, supportsPicture, firmware, probedAt FROM device_capabilities")
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return {row['ip']: row for row in rows}
+
+def save_device_capabilities(ip, time_format, max_page_size, supports_push, supports_picture, firmware):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO device_capabilities (ip, timeFormat, maxPageSize, supportsPush, supportsPicture, firmware, probedAt)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                timeFormat = VALUES(timeFormat),
+                maxPageSize = VALUES(maxPageSize),
+                supportsPush = VALUES(supportsPush),
+                supportsPicture = VALUES(supportsPicture),
+                firmware = VALUES(firmware),
+                probedAt = VALUES(probedAt)
+        """, (ip, time_format, max_page_size, supports_push, supports_picture, firmware))
+        return True
+    except Exception as e:
+        print(f"Error saving device capabilities: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def delete_device_capabilities(ip):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM device_capabilities WHERE ip=%s", (ip,))
+    except Exception as e:
+        print(f"Error deleting device capabilities: {e}")
+    finally:
+        c.close()
+        conn.close()
+
+# --- FUNGSI TARGET API ---
+
+def get_all_api_targets():
+    """Mengambil konfigurasi semua target API, di-key berdasarkan URL."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    c.execute("SELECT url, batchSize, batchMaxWaitSeconds, format, concurrency FROM api_targets ORDER BY url")
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return {row['url']: row for row in rows}
+
+def save_api_target(url, batch_size, batch_max_wait_seconds, delivery_format='json'):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO api_targets (url, batchSize, batchMaxWaitSeconds, format)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                batchSize = VALUES(batchSize),
+                batchMaxWaitSeconds = VALUES(batchMaxWaitSeconds),
+                format = VALUES(format)
+        """, (url, batch_size, batch_max_wait_seconds, delivery_format))
+        return True
+    except Exception as e:
+        print(f"Error saving API target: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def save_api_target_concurrency(url, concurrency):
+    """Menyimpan konkurensi terkini target (baris dibuat dengan opsi default jika target belum dikonfigurasi)."""
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO api_targets (url, concurrency) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE concurrency = VALUES(concurrency)
+        """, (url, concurrency))
+        return True
+    except Exception as e:
+        print(f"Error saving API target concurrency: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def delete_api_target(url):
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM api_targets WHERE url=%s", (url,))
+        return c.rowcount > 0
+    except Exception as e:
+        print(f"Error deleting API target: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def get_device_hourly_density(device_name, days):
+    """Rata-rata jumlah event per jam (indeks 0-23) untuk satu perangkat selama `days` hari terakhir."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    density = [0.0] * 24
+    try:
+        c.execute("""
+            SELECT SUBSTRING(time, 1, 2) as hour_str, COUNT(*) as total
+            FROM events
+            WHERE deviceName = %s
+              AND STR_TO_DATE(date, '%Y-%m-%d') >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
+            GROUP BY hour_str
+        """, (device_name, days))
+        for row in c.fetchall():
+            try:
+                h = int(row['hour_str'])
+                if 0 <= h < 24:
+                    density[h] = row['total'] / days
+            except (ValueError, TypeError):
+                pass
+    except Exception as e:
+        print(f"Error hourly density: {e}")
+    finally:
+        c.close()
+        conn.close()
+    return density
+
+# --- FUNGSI WORKER ---
+
+def claim_api_events(owner, limit, max_retries, lease_seconds, target_api=None, include_waiting=False, sync_type=None):
+    """
+    Mengklaim event antrean API untuk satu worker (SELECT ... FOR UPDATE SKIP LOCKED + lease).
+    Baris yang sedang diklaim worker lain dilewati; lease yang kedaluwarsa (worker mati) bisa diklaim ulang.
+    Hanya baris yang sudah jatuh tempo (nextAttemptAt kosong/lewat) yang diambil.
+    `target_api` membatasi klaim ke satu URL target; `include_waiting` ikut mengambil event yang sedang
+    ditahan menunggu batch penuh (batchWaiting=1) walau nextAttemptAt belum lewat; event yang ditunda
+    karena backoff, breaker, atau replay tetap menunggu jadwalnya. `sync_type` membatasi
+    klaim ke satu jalur prioritas ('realtime' / 'catch-up').
+    Mengembalikan baris lengkap event yang berhasil diklaim.
+    """
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        conditions = []
+        params = [max_retries]
+        if target_api:
+            conditions.append("AND d.targetApi = %s")
+            params.append(target_api)
+        if sync_type:
+            conditions.append("AND e.syncType = %s")
+            params.append(sync_type)
+        params.append(limit)
+        waiting_clause = "OR e.batchWaiting = 1" if include_waiting else ""
+        c.execute(f"""
+            SELECT e.id
+            FROM events e
+            JOIN devices d ON e.deviceName = d.name
+            WHERE e.apiStatus IN ('pending', 'failed')
+              AND e.apiRetryCount < %s
+              AND (e.nextAttemptAt IS NULL OR e.nextAttemptAt <= NOW() {waiting_clause})
+              AND (e.leaseUntil IS NULL OR e.leaseUntil < NOW())
+              AND d.targetApi IS NOT NULL 
+              AND d.targetApi != ''
+              {' '.join(conditions)}
+            ORDER BY e.id ASC 
+            LIMIT %s
+            FOR UPDATE OF e SKIP LOCKED
+        """, tuple(params))
+        ids = [row['id'] for row in c.fetchall()]
+        if not ids:
+            conn.commit()
+            return []
+        placeholders = ','.join(['%s'] * len(ids))
+        c.execute(f"UPDATE events SET leaseOwner = %s, leaseUntil = NOW() + INTERVAL %s SECOND, batchWaiting = 0 WHERE id IN ({placeholders})",
+                  tuple([owner, lease_seconds] + ids))
+        conn.commit()
+
+        c.execute(f"""
+            SELECT e.*, d.targetApi, d.ip as deviceIp, d.username as deviceUsername, d.password as devicePassword,
+                   d.location as location 
+            FROM events e
+            JOIN devices d ON e.deviceName = d.name
+            WHERE e.id IN ({placeholders})
+            ORDER BY e.id ASC
+        """, tuple(ids))
+        return c.fetchall()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+        conn.close()
+
+def update_event_api_status(event_id, status, retry_count, lease_owner, retry_delay=None):
+    """
+    Menyelesaikan event yang diklaim: status baru + lease dilepas. Hanya berlaku jika lease masih
+    milik `lease_owner`; False berarti lease sudah kedaluwarsa dan diambil worker lain.
+    `retry_delay` (detik) menjadwalkan percobaan berikutnya (nextAttemptAt); None = tanpa jadwal.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE events SET apiStatus=%s, apiRetryCount=%s, leaseOwner=NULL, leaseUntil=NULL,
+                nextAttemptAt = IF(%s IS NULL, NULL, NOW() + INTERVAL %s SECOND)
+            WHERE id=%s AND leaseOwner=%s
+        """, (status, retry_count, retry_delay, retry_delay, event_id, lease_owner))
+        return c.rowcount > 0
     except Exception as e:
         print(f"Error updating event API status: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+# --- FUNGSI ANTREAN NOTIFIKASI ---
+
+def enqueue_notifications(recipients, group_key, message, group_title=None, summary=None):
+    """
+    Menyimpan satu peringatan untuk setiap penerima. Peringatan dengan `group_key` yang sama
+    (mis. 'offline|Gedung A') digabung notifier menjadi satu pesan memakai `group_title` & `summary`.
+    """
+    if not recipients:
+        return 0
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.executemany("""
+            INSERT INTO notification_queue (recipient, groupKey, groupTitle, summary, message)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(r, group_key[:255], (group_title or '')[:500] or None, (summary or '')[:500] or None, message)
+              for r in recipients])
+        return c.rowcount
+    except Exception as e:
+        print(f"Error enqueueing notifications: {e}")
+        return 0
+    finally:
+        c.close()
+        conn.close()
+
+def get_due_notifications(coalesce_seconds, single_prefix='single:'):
+    """
+    Notifikasi siap kirim, per (penerima, groupKey): grup baru dikirim setelah item tertuanya menunggu
+    `coalesce_seconds` (jendela penggabungan); groupKey berawalan `single_prefix` langsung dikirim.
+    Retry yang dijadwalkan mengikuti nextAttemptAt.
+    """
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    c.execute("""
+        SELECT q.* FROM notification_queue q
+        JOIN (
+            SELECT recipient, groupKey FROM notification_queue
+            WHERE status = 'pending' AND nextAttemptAt <= NOW()
+            GROUP BY recipient, groupKey
+            HAVING MIN(created_at) <= NOW() - INTERVAL %s SECOND OR groupKey LIKE %s
+        ) due ON q.recipient = due.recipient AND q.groupKey = due.groupKey
+        WHERE q.status = 'pending' AND q.nextAttemptAt <= NOW()
+        ORDER BY q.id ASC
+    """, (coalesce_seconds, single_prefix + '%'))
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return rows
+
+def finish_notifications(ids, sent, retry_delay=None, max_attempts=5):
+    """Menandai notifikasi terkirim, atau menjadwalkan ulang (attempts+1); melewati max_attempts = 'failed'."""
+    if not ids:
+        return
+    conn = get_db()
+    c = conn.cursor()
+    placeholders = ','.join(['%s'] * len(ids))
+    try:
+        if sent:
+            c.execute(f"UPDATE notification_queue SET status='sent', sentAt=NOW() WHERE id IN ({placeholders})", tuple(ids))
+        else:
+            c.execute(f"""
+                UPDATE notification_queue
+                SET attempts = attempts + 1,
+                    status = IF(attempts >= %s, 'failed', 'pending'),
+                    nextAttemptAt = NOW() + INTERVAL %s SECOND
+                WHERE id IN ({placeholders})
+            """, tuple([max_attempts, retry_delay or 0] + list(ids)))
+    except Exception as e:
+        print(f"Error updating notification status: {e}")
+    finally:
+        c.close()
+        conn.close()
+
+def cleanup_notification_queue(days_to_keep):
+    """Menghapus riwayat notifikasi terkirim/gagal yang lebih lama dari `days_to_keep` hari."""
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            DELETE FROM notification_queue
+            WHERE status IN ('sent', 'failed') AND created_at < NOW() - INTERVAL %s DAY
+        """, (days_to_keep,))
+        return c.rowcount
+    except Exception as e:
+        print(f"Error cleaning notification queue: {e}")
+        return 0
+    finally:
+        c.close()
+        conn.close()
+
+# --- FUNGSI DEAD-LETTER ---
+
+DEAD_LETTER_COPY_SQL = """
+    INSERT INTO dead_letter_events (sourceEventId, eventId, deviceName, employeeId, name, date, time, syncType, targetApi, retryCount, reason)
+    SELECT e.id, e.eventId, e.deviceName, e.employeeId, e.name, e.date, e.time, e.syncType, d.targetApi, e.apiRetryCount, %s
+    FROM events e LEFT JOIN devices d ON e.deviceName = d.name
+    WHERE {where}
+    ON DUPLICATE KEY UPDATE
+        targetApi = VALUES(targetApi), retryCount = VALUES(retryCount), reason = VALUES(reason),
+        failedAt = NOW(), replayedAt = NULL
+"""
+
+def dead_letter_api_event(event_id, lease_owner, retry_count, reason):
+    """
+    Gagal permanen: event ditandai 'dead' (keluar dari antrean) dan disalin ke dead_letter_events
+    bersama alasannya, dalam satu transaksi. Hanya jika lease masih milik `lease_owner`.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        conn.start_transaction()
+        c.execute("""
+            UPDATE events SET apiStatus='dead', apiRetryCount=%s, leaseOwner=NULL, leaseUntil=NULL, nextAttemptAt=NULL
+            WHERE id=%s AND leaseOwner=%s
+        """, (retry_count, event_id, lease_owner))
+        if c.rowcount == 0:
+            conn.rollback()
+            return False
+        c.execute(DEAD_LETTER_COPY_SQL.format(where="e.id = %s"), ((reason or '')[:500], event_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error moving event to dead-letter: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def dead_letter_exhausted_events(max_retries, reason):
+    """Memindahkan event 'failed' lama yang sudah mencapai batas retry (data sebelum ada dead-letter)."""
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        conn.start_transaction()
+        where = "e.apiStatus = 'failed' AND e.apiRetryCount >= %s AND (e.leaseUntil IS NULL OR e.leaseUntil < NOW())"
+        c.execute(DEAD_LETTER_COPY_SQL.format(where=where), (reason, max_retries))
+        c.execute(f"UPDATE events e SET e.apiStatus='dead', e.nextAttemptAt=NULL WHERE {where}", (max_retries,))
+        moved = c.rowcount
+        conn.commit()
+        return moved
+    except Exception as e:
+        conn.rollback()
+        print(f"Error moving exhausted events to dead-letter: {e}")
+        return 0
+    finally:
+        c.close()
+        conn.close()
+
+def get_dead_letters(target_api=None, limit=1000):
+    """Dead-letter yang belum dikirim ulang (terbaru dulu), beserta lokasi perangkat."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    query = """
+        SELECT dl.id, dl.sourceEventId, dl.eventId, dl.deviceName, d.location, dl.employeeId, dl.name, dl.date, dl.time,
+               dl.syncType, dl.targetApi, dl.retryCount, dl.reason, dl.failedAt
+        FROM dead_letter_events dl LEFT JOIN devices d ON dl.deviceName = d.name
+        WHERE dl.replayedAt IS NULL
+    """
+    values = []
+    if target_api:
+        query += " AND dl.targetApi = %s"
+        values.append(target_api)
+    query += " ORDER BY dl.id DESC LIMIT %s"
+    values.append(limit)
+    c.execute(query, tuple(values))
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return rows
+
+def get_dead_letter_summary():
+    """Jumlah dead-letter yang belum dikirim ulang per targetApi."""
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    c.execute("""
+        SELECT targetApi, COUNT(*) as total, MIN(failedAt) as oldest
+        FROM dead_letter_events WHERE replayedAt IS NULL
+        GROUP BY targetApi ORDER BY total DESC
+    """)
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return rows
+
+def replay_dead_letters(ids=None, target_api=None, batch_size=100, interval_seconds=10):
+    """
+    Mengantrekan ulang dead-letter (semua, per target, atau `ids` dead_letter_events tertentu).
+    Event kembali 'pending' dengan retry 0, dijadwalkan bertahap: batch ke-n jatuh tempo
+    n * interval_seconds detik dari sekarang (nextAttemptAt), agar target yang baru pulih tidak dibanjiri.
+    Hanya dead-letter yang event-nya benar-benar diantrekan ulang yang ditandai replayedAt.
+    Mengembalikan (jumlah event yang diantrekan ulang, [{'id', 'reason'}] dead-letter yang dilewati).
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        query = "SELECT id, sourceEventId FROM dead_letter_events WHERE replayedAt IS NULL"
+        values = []
+        if ids:
+            query += f" AND id IN ({','.join(['%s'] * len(ids))})"
+            values.extend(ids)
+        if target_api:
+            query += " AND targetApi = %s"
+            values.append(target_api)
+        c.execute(query + " ORDER BY id ASC", tuple(values))
+        rows = c.fetchall()
+
+        batch_size = max(1, batch_size)
+        replayed = 0
+        skipped = []
+        batch_no = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            source_ids = [row[1] for row in batch]
+            conn.start_transaction()
+            # Kunci event sumber agar yang diantrekan ulang sama persis dengan yang ditandai replayedAt
+            c.execute(f"SELECT id, apiStatus FROM events WHERE id IN ({','.join(['%s'] * len(source_ids))}) FOR UPDATE",
+                      tuple(source_ids))
+            statuses = dict(c.fetchall())
+            dead_source_ids = [source_id for source_id in source_ids if statuses.get(source_id) == 'dead']
+            if dead_source_ids:
+                c.execute(f"""
+                    UPDATE events SET apiStatus='pending', apiRetryCount=0, leaseOwner=NULL, leaseUntil=NULL,
+                        nextAttemptAt = NOW() + INTERVAL %s SECOND
+                    WHERE apiStatus='dead' AND id IN ({','.join(['%s'] * len(dead_source_ids))})
+                """, tuple([batch_no * interval_seconds] + dead_source_ids))
+                replayed += c.rowcount
+                batch_no += 1
+
+            dead_ids = []
+            for dead_id, source_id in batch:
+                if statuses.get(source_id) == 'dead':
+                    dead_ids.append(dead_id)
+                elif source_id not in statuses:
+                    skipped.append({'id': dead_id, 'reason': 'Event sumber sudah tidak ada'})
+                else:
+                    skipped.append({'id': dead_id, 'reason': f"Event sumber berstatus {statuses[source_id]}, bukan dead"})
+            if dead_ids:
+                c.execute(f"UPDATE dead_letter_events SET replayedAt=NOW() WHERE id IN ({','.join(['%s'] * len(dead_ids))})",
+                          tuple(dead_ids))
+            conn.commit()
+        return replayed, skipped
+    except Exception as e:
+        conn.rollback()
+        print(f"Error replaying dead-letter events: {e}")
+        return 0, []
+    finally:
+        c.close()
+        conn.close()
+
+def park_api_event(event_id, lease_owner, delay_seconds, batch_waiting=False):
+    """
+    Menunda event yang diklaim tanpa mencobanya (target sedang down/breaker OPEN): lease dilepas,
+    status & apiRetryCount tidak berubah, event baru jatuh tempo lagi setelah `delay_seconds`.
+    `batch_waiting` menandai event yang ditahan menunggu batch penuh (lihat include_waiting pada klaim).
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE events SET leaseOwner=NULL, leaseUntil=NULL, nextAttemptAt = NOW() + INTERVAL %s SECOND,
+                batchWaiting=%s
+            WHERE id=%s AND leaseOwner=%s
+        """, (delay_seconds, 1 if batch_waiting else 0, event_id, lease_owner))
+        return c.rowcount > 0
+    except Exception as e:
+        print(f"Error parking API event: {e}")
+        return False
+    finally:
+        c.close()
+        conn.close()
+
+def get_api_queue_stats(max_retries):
+    """
+    Statistik antrean API per jalur (syncType): jumlah event menunggu kirim, yang sudah jatuh tempo,
+    dan umur event tertua (detik). Jalur yang kosong tetap dilaporkan dengan nilai 0.
+    """
+    stats = {lane: {'depth': 0, 'due': 0, 'oldest_age_seconds': 0} for lane in ('realtime', 'catch-up')}
+    conn = get_db()
+    c = conn.cursor(dictionary=True)
+    try:
+        c.execute("""
+            SELECT syncType,
+                COUNT(*) as depth,
+                SUM(CASE WHEN nextAttemptAt IS NULL OR nextAttemptAt <= NOW() THEN 1 ELSE 0 END) as due,
+                TIMESTAMPDIFF(SECOND, MIN(created_at), NOW()) as oldest_age_seconds
+            FROM events
+            WHERE apiStatus IN ('pending', 'failed') AND apiRetryCount < %s
+            GROUP BY syncType
+        """, (max_retries,))
+        for row in c.fetchall():
+            stats[row['syncType'] or 'realtime'] = {
+                'depth': int(row['depth'] or 0),
+                'due': int(row['due'] or 0),
+                'oldest_age_seconds': int(row['oldest_age_seconds'] or 0)
+            }
+    except Exception as e:
+        print(f"Error getting API queue stats: {e}")
+    finally:
+        c.close()
+        conn.close()
+    return stats
+
+def get_next_api_attempt_delay(max_retries):
+    """
+    Detik sampai event antrean API terdekat jatuh tempo (0 jika sudah ada yang siap), atau None jika
+    tidak ada event terjadwal. Dipakai worker untuk bangun tepat saat retry berikutnya.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT GREATEST(TIMESTAMPDIFF(SECOND, NOW(), MIN(nextAttemptAt)), 0)
+            FROM events
+            WHERE apiStatus IN ('pending', 'failed') AND apiRetryCount < %s AND nextAttemptAt IS NOT NULL
+        """, (max_retries,))
+        row = c.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+    except Exception as e:
+        print(f"Error getting next API attempt: {e}")
+        return None
     finally:
         c.close()
         conn.close()
@@ -448,6 +1346,7 @@ def cleanup_old_events_and_images(days_to_keep):
         
         c.execute("DELETE FROM events WHERE STR_TO_DATE(date, '%Y-%m-%d') < %s", (cutoff_date_str,))
         deleted_rows = c.rowcount
+        c.execute("DELETE FROM dead_letter_events WHERE STR_TO_DATE(date, '%Y-%m-%d') < %s", (cutoff_date_str,))
         
         for dir_path in empty_dirs_to_check:
             try:
@@ -485,7 +1384,7 @@ def get_dashboard_stats():
     c.execute("""
         SELECT 
             COUNT(*) as total,
-            SUM(CASE WHEN apiStatus='failed' THEN 1 ELSE 0 END) as failed,
+            SUM(CASE WHEN apiStatus IN ('failed', 'dead') THEN 1 ELSE 0 END) as failed,
             SUM(CASE WHEN syncType='catch-up' THEN 1 ELSE 0 END) as catchup,
             SUM(CASE WHEN syncType='realtime' THEN 1 ELSE 0 END) as realtime
         FROM events 
@@ -649,7 +1548,7 @@ def get_ai_context_stats():
         sql_template = """
             SELECT 
                 COUNT(*) as total, 
-                SUM(CASE WHEN apiStatus='failed' THEN 1 ELSE 0 END) as failed,
+                SUM(CASE WHEN apiStatus IN ('failed', 'dead') THEN 1 ELSE 0 END) as failed,
                 SUM(CASE WHEN syncType='catch-up' THEN 1 ELSE 0 END) as catchup,
                 SUM(CASE WHEN syncType='realtime' THEN 1 ELSE 0 END) as realtime
             FROM events 
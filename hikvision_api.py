@@ -1,49 +1,81 @@
 import requests
-from requests.auth import HTTPDigestAuth
 import datetime
-from config import TIMEZONE, REQUEST_TIMEOUT
+import uuid
+from config import TIMEZONE, REQUEST_TIMEOUT, USER_SEARCH_PAGE_SIZE
+import isapi_client
 
 def get_device_credentials(func):
-    """Decorator to get device credentials from the database before making an API call."""
+    """Decorator to validate device credentials and pass the device's pooled ISAPI client to the API call."""
     def wrapper(device, *args, **kwargs):
         if not device or not device.get('username') or not device.get('password'):
             return {'error': 'Informasi perangkat atau kredensial tidak lengkap.'}, 400
         
-        ip = device.get('ip')
-        user = device.get('username')
-        password = device.get('password')
-        auth = HTTPDigestAuth(user, password)
-        
-        return func(ip, auth, *args, **kwargs)
+        return func(isapi_client.get_client(device), *args, **kwargs)
     return wrapper
 
-@get_device_credentials
-def search_users(ip, auth):
-    """Mengambil daftar semua pengguna dari perangkat."""
-    url = f"http://{ip}/ISAPI/AccessControl/UserInfo/Search?format=json"
-    payload = {
-        "UserInfoSearchCond": {
-            "searchID": "1",
-            "searchResultPosition": 0,
-            "maxResults": 2000 # Ambil maksimal 2000 user
+class UserSearchError(Exception):
+    """Pencarian UserInfo gagal (error koneksi atau ditolak perangkat)."""
+
+def iter_user_pages(device, page_size=USER_SEARCH_PAGE_SIZE):
+    """
+    Generator pencarian pengguna per halaman selama perangkat membalas 'MORE' dengan halaman berisi.
+    totalMatches hanya dipakai sebagai batas bila perangkat mengirimkannya. Posisi maju sebanyak numOfMatches yang benar-benar dikirim perangkat, sehingga perangkat
+    yang membatasi maxResults lebih kecil dari page_size tetap terbaca seluruhnya.
+    """
+    if not device or not device.get('username') or not device.get('password'):
+        raise UserSearchError('Informasi perangkat atau kredensial tidak lengkap.')
+
+    client = isapi_client.get_client(device)
+    url = "/ISAPI/AccessControl/UserInfo/Search?format=json"
+    search_id = uuid.uuid4().hex
+    position = 0
+    while True:
+        payload = {
+            "UserInfoSearchCond": {
+                "searchID": search_id,
+                "searchResultPosition": position,
+                "maxResults": page_size
+            }
         }
-    }
+        try:
+            r = client.post(url, json=payload, timeout=REQUEST_TIMEOUT, idempotent=True)
+            response_data = r.json() if r.content else {}
+        except requests.exceptions.RequestException as e:
+            raise UserSearchError(f"Error koneksi ke perangkat: {e}") from e
+        except ValueError:
+            raise UserSearchError(f"Respons perangkat bukan JSON (HTTP {r.status_code}).")
+
+        search = response_data.get('UserInfoSearch', {})
+        if r.status_code != 200 or search.get('responseStatusStrg') not in ('OK', 'MORE', 'NO MATCH'):
+            raise UserSearchError(search.get('errorMsg') or response_data.get('errorMsg') or 'Gagal mencari pengguna')
+
+        users = search.get('UserInfo', []) or []
+        if users:
+            yield users
+        position += int(search.get('numOfMatches') or len(users))
+        total_matches = int(search.get('totalMatches', 0) or 0)
+        has_more = (search.get('responseStatusStrg') == 'MORE' and users
+                    and (not total_matches or position < total_matches))
+        if not has_more:
+            return
+
+def iter_users(device, page_size=USER_SEARCH_PAGE_SIZE):
+    """Generator satu per satu pengguna perangkat (tanpa menampung seluruh daftar di memori)."""
+    for page in iter_user_pages(device, page_size):
+        yield from page
+
+def search_users(device):
+    """Mengambil daftar semua pengguna dari perangkat (seluruh halaman)."""
     try:
-        r = requests.post(url, json=payload, auth=auth, timeout=REQUEST_TIMEOUT)
-        r.raise_for_status()
-        response_data = r.json()
-        if response_data.get('UserInfoSearch', {}).get('responseStatusStrg') == 'OK':
-            return response_data.get('UserInfoSearch', {}).get('UserInfo', []), 200
-        else:
-            return {'error': response_data.get('UserInfoSearch', {}).get('errorMsg', 'Gagal mencari pengguna')}, 400
-    except requests.exceptions.RequestException as e:
-        return {'error': f"Error koneksi ke perangkat: {e}"}, 500
+        return list(iter_users(device)), 200
+    except UserSearchError as e:
+        return {'error': str(e)}, 400
 
 @get_device_credentials
-def add_or_update_user(ip, auth, user_data, mode='add'):
+def add_or_update_user(client, user_data, mode='add'):
     """Menambah atau memperbarui pengguna di perangkat."""
     endpoint = 'Record' if mode == 'add' else 'Modify'
-    url = f"http://{ip}/ISAPI/AccessControl/UserInfo/{endpoint}?format=json"
+    url = f"/ISAPI/AccessControl/UserInfo/{endpoint}?format=json"
     
     # Set masa berlaku default jika tidak ada
     begin_time = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S') + TIMEZONE
@@ -69,7 +101,7 @@ def add_or_update_user(ip, auth, user_data, mode='add'):
     try:
         # Gunakan PUT untuk update, POST untuk add
         method = 'PUT' if mode == 'update' else 'POST'
-        r = requests.request(method, url, json=payload, auth=auth, timeout=REQUEST_TIMEOUT)
+        r = client.request(method, url, json=payload, timeout=REQUEST_TIMEOUT)
         
         r.raise_for_status()
         response_data = r.json()
@@ -85,9 +117,9 @@ def add_or_update_user(ip, auth, user_data, mode='add'):
         return {'error': f"Error koneksi ke perangkat: {e}"}, 500
 
 @get_device_credentials
-def delete_user(ip, auth, employee_no):
+def delete_user(client, employee_no):
     """Menghapus pengguna dari perangkat."""
-    url = f"http://{ip}/ISAPI/AccessControl/UserInfo/Delete?format=json"
+    url = "/ISAPI/AccessControl/UserInfo/Delete?format=json"
     payload = {
         "UserInfoDelCond": {
             "employeeNoList": [
@@ -97,7 +129,7 @@ def delete_user(ip, auth, employee_no):
     }
     try:
         # Hikvision menggunakan metode PUT untuk operasi hapus ini
-        r = requests.put(url, json=payload, auth=auth, timeout=REQUEST_TIMEOUT)
+        r = client.put(url, json=payload, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
         response_data = r.json()
         
@@ -106,4 +138,4 @@ def delete_user(ip, auth, employee_no):
         else:
             return {'error': response_data.get('subStatusCode', 'Gagal menghapus pengguna')}, 400
     except requests.exceptions.RequestException as e:
-        return {'error': f"Error koneksi ke perangkat: {e}"}, 500
\ No newline at end of file
+        return {'error': f"Error koneksi ke perangkat: {e}"}, 500
\ No newline at end of file
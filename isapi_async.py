@@ -0,0 +1,339 @@
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import platform
+import threading
+import subprocess
+from urllib.parse import urlsplit
+import aiohttp
+
+from config import (ASYNC_ISAPI_GLOBAL_LIMIT, ASYNC_ISAPI_PER_DEVICE_LIMIT, ASYNC_ISAPI_TIMEOUT,
+                    DEVICE_PING_METHOD, DEVICE_PING_TIMEOUT, USER_SEARCH_PAGE_SIZE)
+
+# ==========================================
+# ENGINE ISAPI ASYNC (Fan-out ke banyak perangkat dari satu thread)
+# ==========================================
+# Satu event loop di thread latar + satu aiohttp.ClientSession (keep-alive) untuk semua perangkat.
+# Batas konkurensi global (ASYNC_ISAPI_GLOBAL_LIMIT) dan per perangkat (ASYNC_ISAPI_PER_DEVICE_LIMIT)
+# berlaku untuk SEMUA pemanggil, karena semua batch dijalankan di loop yang sama.
+# Pemakaian (dari kode sinkron: route Flask, worker_service, dsb.):
+#   results = isapi_async.run_batch('ping', devices)
+#   results = isapi_async.run_batch('upsert_user', devices, employee_no='123', name='Budi', ...)
+# Hasil: {ip: {'ip', 'name', 'ok', 'result' | 'error', 'elapsed_ms'}}
+
+DIGEST_PARAM_RE = re.compile(r'(\w+)=(?:"([^"]*)"|([^,\s]*))')
+
+class DigestState:
+    """
+    Digest Auth (RFC 7616: MD5/SHA-256, -sess, qop=auth) per perangkat. Challenge terakhir disimpan
+    sehingga request berikutnya langsung membawa Authorization (nc bertambah) tanpa putaran 401.
+    """
+    def __init__(self, username, password):
+        self.username = username or ''
+        self.password = password or ''
+        self.challenge = None
+        self.nc = 0
+
+    def update(self, www_authenticate):
+        params = {m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3)
+                  for m in DIGEST_PARAM_RE.finditer(www_authenticate)}
+        if not params.get('nonce'):
+            return False
+        self.challenge = params
+        self.nc = 0
+        return True
+
+    def header(self, method, uri):
+        ch = self.challenge
+        algorithm = (ch.get('algorithm') or 'MD5').upper()
+        hash_name = 'sha256' if algorithm.startswith('SHA-256') else 'md5'
+        digest = lambda s: hashlib.new(hash_name, s.encode('utf-8')).hexdigest()
+
+        self.nc += 1
+        nc = f"{self.nc:08x}"
+        cnonce = uuid.uuid4().hex[:16]
+        ha1 = digest(f"{self.username}:{ch.get('realm', '')}:{self.password}")
+        if algorithm.endswith('-SESS'):
+            ha1 = digest(f"{ha1}:{ch['nonce']}:{cnonce}")
+        ha2 = digest(f"{method}:{uri}")
+
+        qop_options = [q.strip() for q in (ch.get('qop') or '').split(',') if q.strip()]
+        if 'auth' in qop_options:
+            response = digest(f"{ha1}:{ch['nonce']}:{nc}:{cnonce}:auth:{ha2}")
+        else:
+            response = digest(f"{ha1}:{ch['nonce']}:{ha2}")
+
+        parts = [f'username="{self.username}"', f'realm="{ch.get("realm", "")}"', f'nonce="{ch["nonce"]}"',
+                 f'uri="{uri}"', f'response="{response}"', f'algorithm={ch.get("algorithm") or "MD5"}']
+        if ch.get('opaque'):
+            parts.append(f'opaque="{ch["opaque"]}"')
+        if 'auth' in qop_options:
+            parts += ['qop=auth', f'nc={nc}', f'cnonce="{cnonce}"']
+        return 'Digest ' + ', '.join(parts)
+
+class AsyncISAPIEngine:
+    def __init__(self, global_limit=ASYNC_ISAPI_GLOBAL_LIMIT, per_device_limit=ASYNC_ISAPI_PER_DEVICE_LIMIT):
+        self.global_limit = global_limit
+        self.per_device_limit = per_device_limit
+        self.loop = None
+        self.session = None
+        self.global_sem = None
+        self.probe_sem = None
+        self.device_sems = {}
+        self.digest_states = {}
+        self.start_lock = threading.Lock()
+
+    # --- Siklus hidup loop latar ---
+    def ensure_started(self):
+        with self.start_lock:
+            if self.loop and self.loop.is_running():
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            def _run():
+                asyncio.set_event_loop(self.loop)
+                self.loop.call_soon(ready.set)
+                self.loop.run_forever()
+            threading.Thread(target=_run, name="isapi-async", daemon=True).start()
+            ready.wait()
+            asyncio.run_coroutine_threadsafe(self._init_session(), self.loop).result()
+
+    async def _init_session(self):
+        connector = aiohttp.TCPConnector(limit=self.global_limit, limit_per_host=self.per_device_limit,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.global_sem = asyncio.Semaphore(self.global_limit)
+        # Probe ping punya batas sendiri, terpisah dari slot request ISAPI (global & per perangkat)
+        self.probe_sem = asyncio.Semaphore(self.global_limit)
+        self.device_sems = {}
+
+    def _device_sem(self, ip):
+        sem = self.device_sems.get(ip)
+        if sem is None:
+            sem = self.device_sems[ip] = asyncio.Semaphore(self.per_device_limit)
+        return sem
+
+    def _digest_state(self, device):
+        key = (device.get('ip'), device.get('username'), device.get('password'))
+        state = self.digest_states.get(key)
+        if state is None:
+            state = self.digest_states[key] = DigestState(device.get('username'), device.get('password'))
+        return state
+
+    # --- Request dasar ---
+    async def request(self, device, method, path, json_body=None, form_factory=None, timeout=ASYNC_ISAPI_TIMEOUT):
+        """
+        Satu request ISAPI ber-digest. `form_factory` membuat ulang aiohttp.FormData setiap percobaan
+        (body multipart tidak bisa dikirim dua kali). Mengembalikan (status, body_bytes).
+        """
+        ip = device.get('ip')
+        url = path if path.startswith(('http://', 'https://')) else f"http://{ip}{path}"
+        split = urlsplit(url)
+        uri = split.path + (f"?{split.query}" if split.query else '')
+        state = self._digest_state(device)
+
+        async with self.global_sem, self._device_sem(ip):
+            for attempt in range(2):
+                headers = {}
+                if state.challenge:
+                    headers['Authorization'] = state.header(method, uri)
+                kwargs = {}
+                if json_body is not None:
+                    kwargs['json'] = json_body
+                if form_factory is not None:
+                    kwargs['data'] = form_factory()
+                async with self.session.request(method, url, headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as resp:
+                    body = await resp.read()
+                    challenge = resp.headers.get('WWW-Authenticate', '')
+                    if (resp.status == 401 and attempt == 0 and challenge.lower().startswith('digest')
+                            and state.update(challenge)):
+                        continue
+                    return resp.status, body
+
+    async def request_json(self, device, method, path, **kwargs):
+        status, body = await self.request(device, method, path, **kwargs)
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {'raw': body[:200].decode('utf-8', 'replace')}
+        return status, data
+
+    # --- Batch ---
+    async def _run_one(self, operation, device, timeout, params):
+        started = time.monotonic()
+        entry = {'ip': device.get('ip'), 'name': device.get('name')}
+        try:
+            entry['result'] = await asyncio.wait_for(OPERATIONS[operation](self, device, **params), timeout)
+            entry['ok'] = True
+        except asyncio.TimeoutError:
+            entry.update(ok=False, error=f"Timeout setelah {timeout} detik")
+        except aiohttp.ClientError as e:
+            entry.update(ok=False, error=f"Error koneksi ke perangkat: {e}")
+        except ISAPIOperationError as e:
+            entry.update(ok=False, error=str(e))
+        except Exception as e:
+            entry.update(ok=False, error=f"Error tak terduga: {e}")
+        entry['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+        return entry
+
+    async def _run_batch(self, operation, devices, timeout, params):
+        entries = await asyncio.gather(*(self._run_one(operation, d, timeout, params) for d in devices))
+        return {entry['ip']: entry for entry in entries}
+
+    def run_batch(self, operation, devices, timeout=None, **params):
+        """Menjalankan satu operasi ke banyak perangkat sekaligus; memblokir sampai semua selesai."""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Operasi tidak dikenal: {operation}")
+        if not devices:
+            return {}
+        self.ensure_started()
+        # Batas waktu per perangkat; operasi multi-langkah (upsert_user) mendapat jatah lebih
+        timeout = timeout or ASYNC_ISAPI_TIMEOUT * OPERATION_TIMEOUT_FACTOR.get(operation, 1)
+        future = asyncio.run_coroutine_threadsafe(self._run_batch(operation, list(devices), timeout, params), self.loop)
+        return future.result()
+
+class ISAPIOperationError(Exception):
+    """Perangkat menolak operasi (respon ISAPI bukan OK)."""
+
+def isapi_error(status, data, default):
+    message = data.get('subStatusCode') or data.get('statusString') or data.get('errorMsg') or default
+    return ISAPIOperationError(f"{message} (HTTP {status})")
+
+# --- OPERASI ---
+async def icmp_ping(host, timeout):
+    """Satu ping ICMP lewat perintah ping OS (tanpa shell). True jika perangkat membalas."""
+    if platform.system().lower() == "windows":
+        args = ['ping', '-n', '1', '-w', str(int(timeout * 1000)), host]
+    else:
+        args = ['ping', '-c', '1', '-W', str(max(1, int(timeout))), host]
+    try:
+        proc = await asyncio.create_subprocess_exec(*args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        return False
+    try:
+        return await asyncio.wait_for(proc.wait(), timeout + 1) == 0
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return False
+
+async def tcp_ping(host, port, timeout):
+    """Koneksi TCP ke port ISAPI (tanpa request HTTP/autentikasi). True jika koneksi diterima."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def op_ping(engine, device):
+    """
+    Keterjangkauan perangkat menurut DEVICE_PING_METHOD ('icmp' atau 'tcp' ke port ISAPI).
+    Dipakai worker (status & notifikasi) dan dashboard (/api/ping) agar keduanya selalu sepakat.
+    Tidak memakai slot semaphore perangkat, sehingga perangkat yang sedang sibuk melayani request lain
+    (sync, unduh gambar) tidak ikut terhitung gagal ping.
+    """
+    split = urlsplit(f"http://{device.get('ip')}")
+    async with engine.probe_sem:
+        if DEVICE_PING_METHOD == 'tcp':
+            reachable = await tcp_ping(split.hostname, split.port or 80, DEVICE_PING_TIMEOUT)
+        else:
+            reachable = await icmp_ping(split.hostname, DEVICE_PING_TIMEOUT)
+    return {'reachable': reachable}
+
+async def op_status(engine, device):
+    status, body = await engine.request(device, 'GET', '/ISAPI/System/deviceInfo')
+    if status != 200:
+        raise ISAPIOperationError(f"deviceInfo gagal (HTTP {status})")
+    text = body.decode('utf-8', 'replace')
+    info = {}
+    for tag in ('deviceName', 'model', 'serialNumber', 'firmwareVersion', 'macAddress'):
+        match = re.search(rf"<{tag}>([^<]*)</{tag}>", text)
+        info[tag] = match.group(1).strip() if match else None
+    return info
+
+async def op_users(engine, device, include_users=False, page_size=USER_SEARCH_PAGE_SIZE):
+    """Menarik roster pengguna (semua halaman). Tanpa include_users hanya jumlahnya yang dikembalikan."""
+    search_id, position, users, count = uuid.uuid4().hex, 0, [], 0
+    while True:
+        body = {"UserInfoSearchCond": {"searchID": search_id, "searchResultPosition": position, "maxResults": page_size}}
+        status, data = await engine.request_json(device, 'POST', '/ISAPI/AccessControl/UserInfo/Search?format=json',
+                                                 json_body=body)
+        search = data.get('UserInfoSearch', {})
+        if status != 200:
+            raise isapi_error(status, data, 'Gagal mencari pengguna')
+        batch = search.get('UserInfo', []) or []
+        count += len(batch)
+        if include_users:
+            users.extend(batch)
+        position += int(search.get('numOfMatches') or len(batch))
+        # totalMatches hanya membatasi bila dikirim perangkat (aturan sama dengan paginasi AcsEvent)
+        total_matches = int(search.get('totalMatches', 0) or 0)
+        if (search.get('responseStatusStrg') != 'MORE' or not batch
+                or (total_matches and position >= total_matches)):
+            break
+    return {'count': count, 'users': users} if include_users else {'count': count}
+
+async def op_delete_user(engine, device, employee_no):
+    body = {"UserInfoDelCond": {"employeeNoList": [{"employeeNo": str(employee_no)}]}}
+    status, data = await engine.request_json(device, 'PUT', '/ISAPI/AccessControl/UserInfo/Delete?format=json', json_body=body)
+    if status not in (200, 204):
+        raise isapi_error(status, data, 'Gagal menghapus pengguna')
+    return {'deleted': True}
+
+async def op_upsert_user(engine, device, employee_no, name, begin_time, end_time, photo=None, photo_name='photo.jpg'):
+    """
+    Alur HRIS /create per perangkat: hapus pengguna lama (abaikan hasil), jeda 1 detik,
+    buat ulang UserInfo, lalu unggah foto ke FDLib jika ada.
+    """
+    employee_no = str(employee_no)
+    try:
+        await op_delete_user(engine, device, employee_no)
+    except ISAPIOperationError:
+        pass
+    await asyncio.sleep(1)
+
+    user_payload = {
+        "UserInfo": {
+            "employeeNo": employee_no, "name": name, "userType": "normal",
+            "gender": "unknown",
+            "Valid": {"enable": True, "beginTime": begin_time, "endTime": end_time},
+            "doorRight": "1", "RightPlan": [{"doorNo": 1, "planTemplateNo": "1"}]
+        }
+    }
+    status, data = await engine.request_json(device, 'POST', '/ISAPI/AccessControl/UserInfo/Record?format=json',
+                                             json_body=user_payload)
+    if status not in (200, 204):
+        raise isapi_error(status, data, 'Gagal membuat pengguna')
+
+    result = {'user': True, 'photo': None}
+    if photo:
+        meta = json.dumps({"faceLibType": "blackFD", "FDID": "1", "employeeNo": employee_no, "FPID": employee_no})
+        def form_factory():
+            form = aiohttp.FormData()
+            form.add_field('FaceDataRecord', meta, content_type='application/json')
+            form.add_field('FaceImage', photo, filename=photo_name, content_type='image/jpeg')
+            return form
+        status, _ = await engine.request(device, 'POST', '/ISAPI/Intelligent/FDLib/FaceDataRecord?format=json',
+                                         form_factory=form_factory)
+        result['photo'] = status in (200, 204)
+    return result
+
+OPERATIONS = {
+    'ping': op_ping,
+    'status': op_status,
+    'users': op_users,
+    'delete_user': op_delete_user,
+    'upsert_user': op_upsert_user,
+}
+OPERATION_TIMEOUT_FACTOR = {'users': 4, 'upsert_user': 3}
+
+# --- Engine bersama per proses ---
+ENGINE = AsyncISAPIEngine()
+
+def run_batch(operation, devices, timeout=None, **params):
+    return ENGINE.run_batch(operation, devices, timeout=timeout, **params)
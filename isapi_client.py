@@ -0,0 +1,106 @@
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+from config import (REQUEST_TIMEOUT, ISAPI_CONNECT_TIMEOUT, ISAPI_MAX_CONNECTIONS_PER_DEVICE, ISAPI_POOL_TIMEOUT,
+                    ISAPI_RETRIES, ISAPI_RETRY_BACKOFF)
+
+# ==========================================
+# KLIEN ISAPI BERSAMA (dipakai app.py, hikvision_api, sync_service, worker_service)
+# ==========================================
+# Satu requests.Session keep-alive per perangkat:
+# - Koneksi TCP dipakai ulang (tidak connect ulang setiap request).
+# - Satu HTTPDigestAuth per perangkat: setelah challenge pertama, nonce disimpan (per thread)
+#   dan request berikutnya langsung membawa header Authorization tanpa putaran 401.
+# - Pool koneksi per perangkat dibatasi (pool_block=True): request ke-N+1 menunggu, bukan membuka koneksi baru,
+#   paling lama ISAPI_POOL_TIMEOUT detik (perangkat yang menggantung tidak menahan pemanggil selamanya).
+# - Timeout (connect, read) dan kebijakan retry diatur di satu tempat.
+
+RETRY_STATUSES = (502, 503, 504)
+# Unduhan gambar: gambar kadang belum tersedia (404) sesaat setelah event; 408/429/5xx bersifat sementara.
+# 401/403 dan 4xx lain tidak diulang (kredensial salah tidak membaik dengan menunggu).
+DOWNLOAD_RETRY_STATUSES = (404, 408, 429) + tuple(range(500, 600))
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE', 'HEAD')
+
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+class ISAPIClient:
+    def __init__(self, ip, username, password):
+        self.ip = ip
+        self.credentials = (username, password)
+        self.session = requests.Session()
+        self.session.auth = HTTPDigestAuth(username, password)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=ISAPI_MAX_CONNECTIONS_PER_DEVICE, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Slot koneksi dengan batas tunggu: urllib3 menunggu tanpa batas saat pool_block=True
+        self.slots = threading.BoundedSemaphore(ISAPI_MAX_CONNECTIONS_PER_DEVICE)
+
+    def url(self, path):
+        # pictureURL dari perangkat sudah berupa URL lengkap
+        return path if path.startswith(("http://", "https://")) else f"http://{self.ip}{path}"
+
+    def request(self, method, path, timeout=None, retries=None, idempotent=None, retry_statuses=RETRY_STATUSES, **kwargs):
+        """
+        Mengirim request ke perangkat. Error koneksi/timeout dan status `retry_statuses` (default 502/503/504)
+        diulang `retries` kali (default ISAPI_RETRIES) dengan jeda bertambah. Request non-idempoten
+        (mis. POST UserInfo/Record) hanya diulang jika koneksi belum sempat terbentuk.
+        Mengembalikan requests.Response; exception RequestException diteruskan ke pemanggil.
+        """
+        method = method.upper()
+        read_timeout = timeout or REQUEST_TIMEOUT
+        timeouts = (min(ISAPI_CONNECT_TIMEOUT, read_timeout), read_timeout)
+        attempts = 1 + max(0, ISAPI_RETRIES if retries is None else retries)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        for attempt in range(1, attempts + 1):
+            if not self.slots.acquire(timeout=ISAPI_POOL_TIMEOUT):
+                raise requests.exceptions.ConnectionError(
+                    f"Semua {ISAPI_MAX_CONNECTIONS_PER_DEVICE} koneksi ke {self.ip} sibuk lebih dari {ISAPI_POOL_TIMEOUT} detik")
+            try:
+                response = self.session.request(method, self.url(path), timeout=timeouts, **kwargs)
+                if response.status_code not in retry_statuses or not idempotent or attempt == attempts:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                safe_to_retry = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not safe_to_retry or attempt == attempts:
+                    raise
+            finally:
+                self.slots.release()
+            time.sleep(ISAPI_RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+def get_client(device):
+    """Klien untuk perangkat (dict baris devices). Dibuat ulang jika kredensial berubah."""
+    ip = device.get("ip")
+    credentials = (device.get("username"), device.get("password"))
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(ip)
+        if client and client.credentials == credentials:
+            return client
+        if client:
+            client.close()
+        client = CLIENTS[ip] = ISAPIClient(ip, *credentials)
+        return client
+
+def drop_client(ip):
+    """Menutup session perangkat (mis. perangkat dihapus)."""
+    with CLIENTS_LOCK:
+        client = CLIENTS.pop(ip, None)
+    if client:
+        client.close()
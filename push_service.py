@@ -0,0 +1,162 @@
+import hmac
+import json
+import time
+import threading
+import ipaddress
+from flask import Flask, request, jsonify
+
+# Impor konfigurasi dan modul kustom
+from config import *
+import database as db
+from sync_service import save_event, get_event_desc, log, log_system
+
+# ==========================================
+# PUSH SERVICE (Penerima Event dari Perangkat)
+# ==========================================
+# Perangkat Hikvision dengan fitur "HTTP Listening" / alarm host mengirim event
+# AccessControllerEvent ke alamat service ini. Event diproses dengan logika yang sama
+# (EVENT_MAP & save_event) seperti sync_service. sync_service tetap mem-poll perangkat
+# mode push secara berkala (push_gap_repair_interval) untuk menambal event yang terlewat.
+
+app = Flask(__name__)
+
+# --- Cache Perangkat (hindari query DB untuk setiap event push) ---
+DEVICE_CACHE_SECONDS = 30
+DEVICE_CACHE = {}
+DEVICE_CACHE_LOCK = threading.Lock()
+
+def get_push_device(ip):
+    now = time.time()
+    with DEVICE_CACHE_LOCK:
+        cached = DEVICE_CACHE.get(ip)
+        if cached and now - cached[0] < DEVICE_CACHE_SECONDS:
+            return cached[1]
+    device = db.get_device_by_ip(ip)
+    with DEVICE_CACHE_LOCK:
+        DEVICE_CACHE[ip] = (now, device)
+    return device
+
+# --- AUTENTIKASI PUSH ---
+ALLOWED_NETWORKS = [ipaddress.ip_network(net, strict=False) for net in PUSH_ALLOWED_NETWORKS]
+
+def is_push_authorized(req, path):
+    """
+    True jika request push lolos allow-list sumber (PUSH_ALLOWED_NETWORKS) dan membawa token
+    PUSH_SHARED_SECRET (segmen terakhir URL, header X-Push-Token, atau password HTTP Basic).
+    Pemeriksaan yang tidak dikonfigurasi dilewati; main_push memastikan minimal satu aktif.
+    """
+    if ALLOWED_NETWORKS:
+        try:
+            source = ipaddress.ip_address(req.remote_addr)
+        except ValueError:
+            return False
+        if not any(source in net for net in ALLOWED_NETWORKS):
+            return False
+
+    if PUSH_SHARED_SECRET:
+        candidates = [path.rstrip('/').rsplit('/', 1)[-1], req.headers.get('X-Push-Token', '')]
+        if req.authorization and req.authorization.password:
+            candidates.append(req.authorization.password)
+        secret = PUSH_SHARED_SECRET.encode('utf-8')
+        if not any(hmac.compare_digest(c.encode('utf-8'), secret) for c in candidates if c):
+            return False
+
+    return True
+
+# --- PARSING PAYLOAD PUSH ---
+def extract_alert_and_picture(req):
+    """
+    Mengambil JSON EventNotificationAlert dan gambar (jika terlampir) dari request push.
+    Mendukung body JSON murni maupun multipart/form-data (bagian JSON + bagian gambar).
+    """
+    alert, picture = None, None
+
+    if req.mimetype == 'application/json':
+        return req.get_json(silent=True), None
+
+    # Bagian JSON bisa datang sebagai field teks atau sebagai "file" bertipe application/json
+    for value in req.form.values():
+        try:
+            candidate = json.loads(value)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(candidate, dict) and candidate.get('eventType'):
+            alert = candidate
+            break
+
+    for part in req.files.values():
+        if part.mimetype and part.mimetype.startswith('image/'):
+            picture = part.read()
+        elif alert is None and part.mimetype == 'application/json':
+            try:
+                alert = json.loads(part.read())
+            except ValueError:
+                pass
+
+    return alert, picture
+
+def to_acs_event(alert):
+    """Mengubah format push (AccessControllerEvent) ke format AcsEvent/InfoList milik polling."""
+    ace = alert.get('AccessControllerEvent') or {}
+    return {
+        "major": ace.get("majorEventType"),
+        "minor": ace.get("subEventType"),
+        "time": alert.get("dateTime"),
+        "name": ace.get("name"),
+        "employeeNoString": str(ace.get("employeeNoString") or ""),
+        "serialNo": ace.get("serialNo"),
+        "pictureURL": ace.get("pictureURL"),
+    }
+
+# --- ENDPOINT ---
+@app.route('/', methods=['POST'])
+@app.route('/<path:path>', methods=['POST'])
+def receive_event(path=''):
+    if not is_push_authorized(request, path):
+        log_system(f"PUSH: Request tanpa autentikasi valid dari {request.remote_addr} ditolak.", level="WARN")
+        return jsonify({'error': 'Tidak diizinkan.'}), 401
+
+    alert, picture = extract_alert_and_picture(request)
+    if not alert:
+        return jsonify({'error': 'Payload event tidak dikenali.'}), 400
+
+    # Heartbeat dan event non access-control cukup diakui
+    if alert.get('eventType') != 'AccessControllerEvent':
+        return jsonify({'status': 'ignored'}), 200
+
+    # Identitas perangkat hanya dari alamat koneksi; 'ipAddress' di payload bisa diisi siapa saja
+    ip = request.remote_addr
+    device = get_push_device(ip)
+    if not device or not device.get('is_active'):
+        log_system(f"PUSH: Event dari perangkat tidak terdaftar/nonaktif ({ip}) diabaikan.", level="WARN")
+        return jsonify({'status': 'ignored'}), 200
+
+    db.update_device_last_push(ip)
+    event = to_acs_event(alert)
+
+    # Sama seperti polling: hanya Face Recognized yang disimpan
+    if get_event_desc(event) != "Face Recognized":
+        return jsonify({'status': 'ignored'}), 200
+
+    if event.get("serialNo") is None:
+        # Tanpa serialNo event tidak bisa dide-duplikasi; biarkan polling tambal celah yang menyimpannya
+        log(device, "PUSH: Event tanpa serialNo, diserahkan ke polling.", level="WARN")
+        return jsonify({'status': 'deferred'}), 200
+
+    log(device, f"PUSH: Menerima event (ID: {event.get('serialNo')}) untuk '{event.get('name')}'...")
+    saved = save_event(event, device, image_content=picture)
+    return jsonify({'status': 'saved' if saved else 'duplicate'}), 200
+
+# --- ENTRY POINT ---
+def main_push():
+    if not PUSH_SHARED_SECRET and not PUSH_ALLOWED_NETWORKS:
+        log_system("Push Service tidak dijalankan: isi PUSH_SHARED_SECRET dan/atau PUSH_ALLOWED_NETWORKS di config.py.", level="ERROR")
+        return
+    db.init_db()
+    log_system(f"Memulai [Push Service] - mendengarkan event di {PUSH_LISTEN_HOST}:{PUSH_LISTEN_PORT}...")
+    # Gambar event push tanpa lampiran tidak diunduh di sini: save_event memberi sinyal UDP ke pipeline
+    # gambar sync_service (satu-satunya proses pengunduh, mencegah unduhan ganda) yang langsung mengambilnya
+    app.run(host=PUSH_LISTEN_HOST, port=PUSH_LISTEN_PORT, threaded=True)
+
+if __name__ == "__main__":
+    main_push()
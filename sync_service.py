@@ -1,6 +1,4 @@
 import requests
-from requests.auth import HTTPDigestAuth
-import mysql.connector
 import datetime
 import time
 import os
@@ -9,12 +7,17 @@ import base64
 import json
 import logging
 import threading
+import collections
+import queue
+import socket
+import select
 from concurrent.futures import ThreadPoolExecutor
 import uuid  # [PENTING] Untuk generate searchID unik
 
 # Impor konfigurasi (termasuk EVENT_MAP) dan modul database kustom
 from config import *
 import database as db
+import isapi_client
 
 # --- SETUP LOGGING ---
 LOG_LOCK = threading.Lock()
@@ -91,7 +94,18 @@ def log_system(message, level="INFO"):
 # --- AKHIR SETUP LOGGING ---
 
 # --- Variabel Global & Kunci Thread ---
-LAST_SEEN_EVENT_ID = {}
+# Checkpoint per perangkat (cermin dari tabel device_cursors), di-key berdasarkan IP
+DEVICE_CURSORS = {}
+# Profil kemampuan per perangkat (cermin dari tabel device_capabilities), di-key berdasarkan IP
+DEVICE_CAPABILITIES = {}
+# Deteksi kemampuan yang gagal: ip -> (waktu monotonic boleh deteksi lagi, jumlah kegagalan berturut-turut)
+PROBE_BACKOFF = {}
+# Governor laju per perangkat (pengganti jeda tetap event_sleep_delay), di-key berdasarkan IP
+RATE_GOVERNORS = {}
+# Batas governor (min_rate, max_rate, latency_target) + versi pengaturan asalnya
+GOVERNOR_SETTINGS = {'version': None, 'limits': None}
+# Waktu poll terakhir perangkat mode push (polling hanya untuk perbaikan celah)
+LAST_POLL_TIME = {}
 DEVICE_DATA_LOCK = threading.Lock()
 # ----------------------------------------
 
@@ -105,6 +119,15 @@ def device_label(device):
 
 def parse_iso_time(time_str):
     return datetime.datetime.fromisoformat(time_str.replace(TIMEZONE, ''))
+
+def to_iso_time(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE
+
+def parse_event_time(event):
+    try:
+        return datetime.datetime.strptime(event.get("time")[:19], "%Y-%m-%dT%H:%M:%S")
+    except Exception:
+        return None
 # ----------------------------------
 
 # --- FUNGSI DATABASE ---
@@ -128,13 +151,292 @@ def get_last_sync_time(ip):
             return dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE
     dt = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     return dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE
+
+# --- CURSOR SYNC (Checkpoint Persisten) ---
+def load_device_cursors():
+    """Memuat checkpoint semua perangkat dari DB. Dipanggil sekali saat service start."""
+    try:
+        cursors = db.get_all_device_cursors()
+    except Exception as e:
+        log_system(f"Gagal memuat cursor perangkat dari DB: {e}", level="ERROR")
+        return
+    with DEVICE_DATA_LOCK:
+        DEVICE_CURSORS.clear()
+        DEVICE_CURSORS.update(cursors)
+    log_system(f"Cursor sync dimuat untuk {len(cursors)} perangkat.")
+
+def get_device_cursor(ip):
+    with DEVICE_DATA_LOCK:
+        return dict(DEVICE_CURSORS.get(ip) or {})
+
+def update_device_cursor(ip, last_serial_no, last_event_time, search_start_time=None, search_position=0):
+    """Menyimpan checkpoint ke memori lalu ke DB agar restart bisa melanjutkan dari titik ini."""
+    cursor = {
+        'ip': ip,
+        'lastSerialNo': last_serial_no,
+        'lastEventTime': last_event_time,
+        'searchStartTime': search_start_time,
+        'searchPosition': search_position,
+    }
+    with DEVICE_DATA_LOCK:
+        cursor['deviceSerial'] = (DEVICE_CURSORS.get(ip) or {}).get('deviceSerial')
+        DEVICE_CURSORS[ip] = cursor
+    db.save_device_cursor(ip, last_serial_no, last_event_time, search_start_time, search_position)
+
+def reset_serial_cursor(device, reason):
+    """
+    serialNo perangkat mulai ulang (reset pabrik, ganti perangkat, log dikosongkan): cursor serialNo
+    dikembalikan ke 0 agar event baru tidak tersaring sebagai "sudah dilihat". Waktu event terakhir
+    tetap dipakai sebagai titik awal pencarian. Mengembalikan serialNo cursor yang baru (0).
+    """
+    ip = device.get("ip")
+    cursor = get_device_cursor(ip)
+    log(device, f"serialNo perangkat terdeteksi mulai ulang ({reason}); cursor serialNo "
+                f"{cursor.get('lastSerialNo') or 0} direset ke 0.", level="WARN")
+    update_device_cursor(ip, 0, cursor.get('lastEventTime'))
+    return 0
+
+def is_serial_reset(events, last_seen_id, last_event_dt):
+    """
+    True jika halaman berisi event yang lebih baru dari event terakhir yang dikenal, tetapi serialNo
+    terbesarnya masih di bawah cursor (serialNo perangkat tidak mungkin mundur tanpa reset).
+    """
+    if not last_seen_id or not last_event_dt or not events:
+        return False
+    newer = [int(e.get("serialNo") or 0) for e in events
+             if (parse_event_time(e) or datetime.datetime.min) > last_event_dt]
+    return bool(newer) and max(newer) < last_seen_id
+
+def check_device_serial(device, device_serial):
+    """Membandingkan nomor seri perangkat hasil deteksi dengan yang tersimpan; berbeda = perangkat diganti."""
+    if not device_serial:
+        return
+    ip = device.get("ip")
+    known = get_device_cursor(ip).get('deviceSerial')
+    if known == device_serial:
+        return
+    if known:
+        reset_serial_cursor(device, f"nomor seri perangkat berubah {known} -> {device_serial}")
+    with DEVICE_DATA_LOCK:
+        DEVICE_CURSORS.setdefault(ip, {'ip': ip})['deviceSerial'] = device_serial
+    db.save_device_serial(ip, device_serial)
+
+def get_resume_point(ip, cursor):
+    """
+    Menentukan titik lanjut pencarian: (startTime, searchResultPosition).
+    Prioritas: pencarian yang belum habis -> waktu event terakhir -> devices.lastSync.
+    """
+    if cursor.get('searchStartTime') and cursor.get('searchPosition'):
+        return to_iso_time(cursor['searchStartTime']), int(cursor['searchPosition'])
+    if cursor.get('lastEventTime'):
+        return to_iso_time(cursor['lastEventTime']), 0
+    return get_last_sync_time(ip), 0
+# ----------------------------------------------------
+
+# --- PROFIL KEMAMPUAN PERANGKAT ---
+# Format waktu yang diterima, batas maxResults, dukungan push & gambar dideteksi SEKALI per perangkat,
+# disimpan di DB, dan dipakai ulang. Deteksi ulang hanya dilakukan setelah perangkat menolak
+# request yang sebelumnya diterima (mis. setelah update firmware).
+def load_device_capabilities():
+    """Memuat profil kemampuan semua perangkat dari DB. Dipanggil sekali saat service start."""
+    try:
+        profiles = db.get_all_device_capabilities()
+    except Exception as e:
+        log_system(f"Gagal memuat profil kemampuan perangkat dari DB: {e}", level="ERROR")
+        return
+    with DEVICE_DATA_LOCK:
+        DEVICE_CAPABILITIES.clear()
+        DEVICE_CAPABILITIES.update(profiles)
+    log_system(f"Profil kemampuan dimuat untuk {len(profiles)} perangkat.")
+
+def cached_capabilities(ip):
+    """Profil yang sudah diketahui (tanpa deteksi). Dict kosong jika belum pernah dideteksi."""
+    with DEVICE_DATA_LOCK:
+        return dict(DEVICE_CAPABILITIES.get(ip) or {})
+
+def probe_device_capabilities(device, timeout):
+    """
+    Mendeteksi kemampuan perangkat lewat deviceInfo, capabilities AcsEvent & httpHosts,
+    serta satu pencarian AcsEvent kecil untuk menentukan format waktu yang diterima.
+    Mengembalikan None jika format waktu tidak bisa ditentukan (perangkat tidak terjangkau/auth gagal).
+    """
+    client = isapi_client.get_client(device)
+    caps = {'timeFormat': None, 'maxPageSize': None, 'supportsPush': None, 'supportsPicture': None, 'firmware': None,
+            'deviceSerial': None}
+
+    try:
+        r = client.get("/ISAPI/System/deviceInfo", timeout=timeout)
+        if r.status_code == 200:
+            match = re.search(r"<firmwareVersion>([^<]+)</firmwareVersion>", r.text)
+            caps['firmware'] = match.group(1).strip()[:100] if match else None
+            match = re.search(r"<serialNumber>([^<]+)</serialNumber>", r.text)
+            caps['deviceSerial'] = match.group(1).strip()[:100] if match else None
+
+        r = client.get("/ISAPI/AccessControl/AcsEvent/capabilities?format=json", timeout=timeout)
+        if r.status_code == 200:
+            try:
+                cond = (r.json().get("AcsEvent") or {}).get("AcsEventCond") or {}
+            except ValueError:
+                cond = {}
+            max_results = cond.get("maxResults")
+            if isinstance(max_results, dict) and str(max_results.get("@max", "")).isdigit():
+                caps['maxPageSize'] = int(max_results["@max"])
+            if cond:
+                caps['supportsPicture'] = "picEnable" in cond
+
+        r = client.get("/ISAPI/Event/notification/httpHosts/capabilities", timeout=timeout)
+        if r.status_code == 200:
+            caps['supportsPush'] = True
+        elif r.status_code in (403, 404, 405, 501):
+            caps['supportsPush'] = False
+
+        # Format waktu: coba dengan zona waktu dulu (standar ISAPI), lalu tanpa zona waktu
+        start_iso, end_iso = iso8601_now(60), iso8601_now()
+        for time_format in ('tz', 'naive'):
+            s_time, e_time = (start_iso, end_iso) if time_format == 'tz' else (start_iso.split('+')[0], end_iso.split('+')[0])
+            body = {"AcsEventCond": {"searchID": uuid.uuid4().hex, "searchResultPosition": 0, "maxResults": 1,
+                                     "major": 0, "minor": 0, "startTime": s_time, "endTime": e_time}}
+            r = client.post("/ISAPI/AccessControl/AcsEvent?format=json", json=body, timeout=timeout, idempotent=True)
+            if r.status_code == 200:
+                caps['timeFormat'] = time_format
+                break
+            if r.status_code != 400:
+                break
+    except requests.exceptions.RequestException as e:
+        log(device, f"Deteksi kemampuan perangkat gagal (koneksi): {e}", level="WARN")
+        return None
+
+    if not caps['timeFormat']:
+        log(device, "Deteksi kemampuan perangkat gagal: format waktu AcsEvent tidak dikenali.", level="WARN")
+        return None
+    return caps
+
+def get_device_capabilities(device, timeout):
+    """
+    Profil kemampuan dari cache; dideteksi (dan disimpan) hanya jika belum ada.
+    Deteksi yang gagal di-backoff (CAPABILITY_PROBE_BACKOFF_SECONDS, naik 2x sampai ..._MAX_SECONDS)
+    sehingga perangkat yang tidak terjangkau tidak dideteksi ulang setiap poll; selama itu dict kosong.
+    """
+    ip = device.get("ip")
+    caps = cached_capabilities(ip)
+    if caps:
+        return caps
+
+    with DEVICE_DATA_LOCK:
+        retry_at, failures = PROBE_BACKOFF.get(ip, (0, 0))
+    if time.monotonic() < retry_at:
+        return {}
+
+    caps = probe_device_capabilities(device, timeout)
+    if not caps:
+        delay = min(CAPABILITY_PROBE_BACKOFF_MAX_SECONDS, CAPABILITY_PROBE_BACKOFF_SECONDS * 2 ** failures)
+        with DEVICE_DATA_LOCK:
+            PROBE_BACKOFF[ip] = (time.monotonic() + delay, failures + 1)
+        log(device, f"Deteksi kemampuan dicoba lagi dalam {delay} detik.", level="WARN")
+        return {}
+    with DEVICE_DATA_LOCK:
+        PROBE_BACKOFF.pop(ip, None)
+    # Deteksi ulang terjadi antara lain setelah update firmware/ganti perangkat: cek apakah serialNo mulai ulang
+    check_device_serial(device, caps.pop('deviceSerial'))
+    db.save_device_capabilities(ip, caps['timeFormat'], caps['maxPageSize'], caps['supportsPush'],
+                                caps['supportsPicture'], caps['firmware'])
+    with DEVICE_DATA_LOCK:
+        DEVICE_CAPABILITIES[ip] = dict(caps, ip=ip)
+    log(device, f"Profil kemampuan terdeteksi: format waktu={caps['timeFormat']}, maxResults={caps['maxPageSize']}, "
+                f"push={caps['supportsPush']}, gambar={caps['supportsPicture']}, firmware={caps['firmware']}.")
+    return caps
+
+def invalidate_device_capabilities(device, reason):
+    """Membuang profil agar dideteksi ulang pada poll berikutnya (mis. firmware berubah)."""
+    ip = device.get("ip")
+    with DEVICE_DATA_LOCK:
+        DEVICE_CAPABILITIES.pop(ip, None)
+    db.delete_device_capabilities(ip)
+    log(device, f"Profil kemampuan dibuang, akan dideteksi ulang: {reason}", level="WARN")
+# ----------------------------------------------------
+
+# --- GOVERNOR LAJU PER PERANGKAT ---
+class DeviceRateGovernor:
+    """
+    Token bucket per perangkat dengan laju adaptif (AIMD).
+    Laju naik sedikit demi sedikit selama unduhan gambar cepat & sukses, dan turun setengah
+    saat perangkat membalas error atau lebih lambat dari latency_target.
+    """
+    def __init__(self, min_rate, max_rate, latency_target):
+        self.lock = threading.Lock()
+        self.min_rate, self.max_rate, self.latency_target = min_rate, max_rate, latency_target
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+
+    def configure(self, min_rate, max_rate, latency_target):
+        with self.lock:
+            self.min_rate, self.max_rate, self.latency_target = min_rate, max_rate, latency_target
+            self.rate = min(max(self.rate, min_rate), max_rate)
+
+    def acquire(self):
+        """Menunggu sampai ada token (izin memproses satu event)."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                burst = max(1.0, self.rate)
+                self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, latency, ok):
+        """Umpan balik dari setiap request gambar ke perangkat."""
+        with self.lock:
+            if not ok or latency > self.latency_target:
+                self.rate = max(self.min_rate, self.rate * 0.5)
+            else:
+                self.rate = min(self.max_rate, self.rate + max(0.1, self.rate * 0.1))
+
+def get_governor_limits():
+    """
+    Batas governor dari pengaturan: batas bawah laju berasal dari event_sleep_delay
+    (jeda terlama yang diizinkan), batas atas dari governor_max_rate.
+    """
+    try:
+        sleep_delay = float(db.get_setting('event_sleep_delay', '1'))
+        max_rate = float(db.get_setting('governor_max_rate', '20'))
+        latency_target = float(db.get_setting('governor_latency_target', '2'))
+    except ValueError:
+        sleep_delay, max_rate, latency_target = 1, 20, 2
+    max_rate = max(max_rate, 0.1)
+    min_rate = min(1.0 / sleep_delay, max_rate) if sleep_delay > 0 else max_rate
+    return min_rate, max_rate, latency_target
+
+def get_rate_governor(device):
+    """
+    Mengambil governor perangkat. Pengaturan hanya dibaca ulang dan diterapkan ke semua governor
+    saat versi cache pengaturan berubah, bukan pada setiap unduhan gambar.
+    """
+    version = db.get_settings_version()
+    with DEVICE_DATA_LOCK:
+        if GOVERNOR_SETTINGS['limits'] is None or version != GOVERNOR_SETTINGS['version']:
+            GOVERNOR_SETTINGS['limits'] = get_governor_limits()
+            GOVERNOR_SETTINGS['version'] = version
+            for governor in RATE_GOVERNORS.values():
+                governor.configure(*GOVERNOR_SETTINGS['limits'])
+        ip = device.get("ip")
+        governor = RATE_GOVERNORS.get(ip)
+        if governor is None:
+            governor = RATE_GOVERNORS[ip] = DeviceRateGovernor(*GOVERNOR_SETTINGS['limits'])
+        return governor
 # ----------------------------------------------------
 
 # --- FUNGSI API & PROSES EVENT ---
 
-def download_image_with_retry(device, pictureURL, auth):
+def download_image_with_retry(device, pictureURL):
     """
-    Mencoba mengunduh gambar.
+    Mencoba mengunduh gambar lewat klien ISAPI bersama (koneksi keep-alive perangkat).
+    Retry error koneksi/timeout dan status 404 (gambar belum siap), 408, 429 dan 5xx
+    ditangani isapi_client sebanyak sync_download_retries.
     """
     if not pictureURL:
         log(device, "URL Gambar kosong, download dilewati.", level="WARN")
@@ -146,22 +448,19 @@ def download_image_with_retry(device, pictureURL, auth):
     except ValueError:
         max_retries = 5
         timeout = 30
+    governor = get_rate_governor(device)
 
-    for attempt in range(1, max_retries + 1):
-        try:
-            r_img = requests.get(pictureURL, auth=auth, timeout=timeout)
-            if r_img.status_code == 200:
-                return r_img.content  # Sukses, kembalikan konten mentah (bytes)
-            
-            log(device, f"[Attempt {attempt}/{max_retries}] Gagal mendapatkan gambar (HTTP {r_img.status_code}). URL: {pictureURL}", level="WARN")
-        
-        except requests.exceptions.RequestException as e:
-            log(device, f"[Attempt {attempt}/{max_retries}] Error koneksi saat mengambil gambar: {e}", level="WARN")
-        
-        if attempt < max_retries:
-            time.sleep(2)
-    
-    log(device, f"Gagal mengunduh gambar setelah {max_retries} percobaan. URL: {pictureURL}", level="ERROR")
+    started = time.monotonic()
+    try:
+        r_img = isapi_client.get_client(device).get(pictureURL, timeout=timeout, retries=max_retries - 1,
+                                                    retry_statuses=isapi_client.DOWNLOAD_RETRY_STATUSES)
+        governor.record(time.monotonic() - started, r_img.status_code == 200)
+        if r_img.status_code == 200:
+            return r_img.content  # Sukses, kembalikan konten mentah (bytes)
+        log(device, f"Gagal mendapatkan gambar (HTTP {r_img.status_code}) setelah {max_retries} percobaan. URL: {pictureURL}", level="ERROR")
+    except requests.exceptions.RequestException as e:
+        governor.record(time.monotonic() - started, False)
+        log(device, f"Gagal mengunduh gambar setelah {max_retries} percobaan (koneksi): {e}. URL: {pictureURL}", level="ERROR")
     return None
 
 # ----------------------------------------------------
@@ -171,78 +470,122 @@ def iso8601_now(offset_seconds=0):
     t = datetime.datetime.now() - datetime.timedelta(seconds=offset_seconds)
     return t.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE
 
-def get_events_from_device(device, start_time, end_time, batch_max, timeout):
-
-    ip, user, password = device.get("ip"), device.get("username"), device.get("password")
+def iter_event_pages(device, start_time, end_time, page_size, timeout, position=0, caps=None):
+    """
+    Generator paginasi AcsEvent. Menghasilkan (events, next_position, has_more) per halaman
+    sampai perangkat tidak lagi membalas responseStatusStrg 'MORE' / totalMatches habis.
+    `caps` adalah profil kemampuan yang sudah diambil pemanggil (tanpa deteksi ulang di sini).
+    """
+    # URL Standar (path relatif terhadap IP perangkat di klien ISAPI bersama)
+    client = isapi_client.get_client(device)
+    url = "/ISAPI/AccessControl/AcsEvent?format=json"
+    headers = {"Content-Type": "application/json"}
     
-    # URL Standar
-    url = f"http://{ip}/ISAPI/AccessControl/AcsEvent?format=json"
-
-    # Fungsi internal pengirim request
-    def _send_request(s_time, e_time):
-        # Gunakan random string pendek untuk searchID agar sesi selalu baru
-        import random
-        search_id = f"search_{random.randint(1000, 9999)}"
-        
+    # Satu searchID untuk seluruh halaman dalam satu sesi pencarian
+    search_id = uuid.uuid4().hex
+    # Format waktu sesuai profil perangkat (tanpa zona waktu untuk model yang menolaknya)
+    s_time, e_time = start_time, end_time
+    if caps is None:
+        caps = cached_capabilities(device.get("ip"))
+    if caps.get('timeFormat') == 'naive':
+        s_time, e_time = start_time.split('+')[0], end_time.split('+')[0]
+
+    while True:
         body = {
             "AcsEventCond": {
                 "searchID": search_id,
-                "searchResultPosition": 0,
-                "maxResults": batch_max,
+                "searchResultPosition": position,
+                "maxResults": page_size,
                 "major": 0,
                 "minor": 0,
                 "startTime": s_time,
                 "endTime": e_time
             }
         }
-        headers = {"Content-Type": "application/json"}
-        return requests.post(url, json=body, auth=HTTPDigestAuth(user, password), headers=headers, timeout=timeout)
-
-    try:
-        # --- Percobaan 1: Normal (dengan Timezone) ---
-        r = _send_request(start_time, end_time)
-        
-        # Handle Error 400 (Biasanya masalah format waktu)
-        if r.status_code == 400:
-            log(device, f"Gagal Format Standar (400). Response: {r.text}", level="WARN")
-            
-            # --- Percobaan 2: Retry Tanpa Timezone ---
-            s_clean = start_time.split('+')[0]
-            e_clean = end_time.split('+')[0]
+        try:
+            r = client.post(url, json=body, headers=headers, timeout=timeout, idempotent=True)
             
-            log(device, f"Mencoba retry tanpa timezone: {s_clean} s/d {e_clean}...", level="INFO")
-            r_retry = _send_request(s_clean, e_clean)
+            # 400 untuk format yang sebelumnya diterima: kemungkinan firmware berubah -> deteksi ulang
+            if r.status_code == 400:
+                invalidate_device_capabilities(device, f"AcsEvent ditolak (400): {r.text[:200]}")
+                return
             
-            if r_retry.status_code == 200:
-                log(device, "Berhasil dengan format tanpa timezone!", level="INFO")
-                return r_retry.json().get("AcsEvent", {}).get("InfoList", [])
-            else:
-                log(device, f"Tetap gagal (HTTP {r_retry.status_code}).", level="ERROR")
-                return []
+            r.raise_for_status()
+            acs_event = r.json().get("AcsEvent", {})
 
-        r.raise_for_status()
-        return r.json().get("AcsEvent", {}).get("InfoList", [])
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 401:
+                 log(device, "GAGAL AUTH (401). Device terkunci/password salah. Jeda 10s...", level="ERROR")
+                 time.sleep(10)
+            else:
+                 log(device, f"HTTP Error: {e}", level="ERROR")
+            return
 
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 401:
-             log(device, "GAGAL AUTH (401). Device terkunci/password salah. Jeda 10s...", level="ERROR")
-             time.sleep(10)
-        else:
-             log(device, f"HTTP Error: {e}", level="ERROR")
+        except requests.exceptions.RequestException as e:
+            log(device, f"Koneksi Error: {e}", level="ERROR")
+            return
 
-    except requests.exceptions.RequestException as e:
-        log(device, f"Koneksi Error: {e}", level="ERROR")
+        page = acs_event.get("InfoList", []) or []
+        num_matches = int(acs_event.get("numOfMatches", len(page)) or 0)
+        total_matches = int(acs_event.get("totalMatches", 0) or 0)
+        position += num_matches
         
-    return []
+        has_more = (acs_event.get("responseStatusStrg") == "MORE" and num_matches > 0
+                    and (not total_matches or position < total_matches))
+        yield page, position, has_more
+        
+        if not has_more:
+            return
+
+def get_events_from_device(device, start_time, end_time, batch_max, timeout, position=0, caps=None):
+    """
+    Mengambil SEMUA event dalam rentang waktu (seluruh halaman) sebagai satu list.
+    Mengembalikan None jika pencarian terputus (error) sebelum halaman terakhir.
+    """
+    events, complete = [], False
+    for page, _, has_more in iter_event_pages(device, start_time, end_time, batch_max, timeout, position, caps):
+        events.extend(page)
+        complete = not has_more
+    return events if complete else None
+
+def get_page_size(device, default):
+    """
+    Ukuran halaman AcsEvent per perangkat (kolom devices.eventPageSize), fallback ke event_batch_max,
+    dibatasi maxResults dari profil kemampuan perangkat.
+    """
+    try:
+        page_size = int(device.get("eventPageSize") or default)
+    except (TypeError, ValueError):
+        page_size = default
+    max_page_size = cached_capabilities(device.get("ip")).get('maxPageSize')
+    return min(page_size, max_page_size) if max_page_size else page_size
 
 def get_event_desc(event):
     major, minor = event.get("major"), event.get("minor")
     return EVENT_MAP.get((major, minor))
 
-def save_event(event, device):
-    user, password = device.get("username"), device.get("password")
-    auth = HTTPDigestAuth(user, password)
-    
+def store_event_image(device, device_name, name, event_id, dt, image_content):
+    """Menyimpan gambar event ke disk. Mengembalikan path relatif (terhadap static) atau None."""
+    try:
+        safe_dev = sanitize_name(device_name)
+        date_folder = dt.strftime("%Y-%m-%d")
+        relative_folder = os.path.join("images", safe_dev, date_folder)
+        absolute_folder = os.path.join("static", relative_folder)
+        os.makedirs(absolute_folder, exist_ok=True)
+        file_name = f"{sanitize_name(name)}-{event_id}.jpg"
+        with open(os.path.join(absolute_folder, file_name), "wb") as f:
+            f.write(image_content)
+        return os.path.join(relative_folder, file_name).replace("\\", "/")
+    except Exception as e:
+        log(device, f"Error simpan gambar ke disk (ID: {event_id}): {e}", level="WARN")
+        return None
+
+def build_event_row(event, device, image_content=None):
+    """
+    Menyiapkan satu baris tabel events dari event perangkat. Gambar TIDAK diunduh di sini:
+    event wajah ditandai 'image_pending' dan gambarnya diambil oleh pipeline unduh gambar.
+    `image_content` dapat diisi jika gambar sudah tersedia (mis. terlampir pada event push).
+    """
     eventId, device_name, pictureURL = event.get("serialNo"), device_label(device), event.get("pictureURL")
     name = event.get("name") or "unknown"
     
@@ -264,147 +607,408 @@ def save_event(event, device):
     is_valid_for_api = (event_desc == "Face Recognized")
     
     local_image_path = None
-    image_content = None
     initial_api_status = 'skipped' # Status default
     
-    if dt and pictureURL and is_valid_for_api:
-        # Langkah 1: Coba download gambar
-        image_content = download_image_with_retry(device, pictureURL, auth)
-        
-        if image_content:
-            # Langkah 2: Jika download berhasil, simpan ke disk
-            try:
-                safe_dev = sanitize_name(device_name)
-                date_folder = dt.strftime("%Y-%m-%d")
-                relative_folder = os.path.join("images", safe_dev, date_folder)
-                absolute_folder = os.path.join("static", relative_folder)
-                os.makedirs(absolute_folder, exist_ok=True)
-                file_name = f"{sanitize_name(name)}-{eventId}.jpg"
-                local_image_path = os.path.join(relative_folder, file_name).replace("\\", "/")
-                with open(os.path.join(absolute_folder, file_name), "wb") as f:
-                    f.write(image_content)
-                
-                # Set status untuk diproses oleh worker
-                initial_api_status = 'pending' 
-                
-            except Exception as e:
-                log(device, f"Error simpan gambar ke disk (ID: {eventId}): {e}", level="WARN")
-                initial_api_status = 'failed' # Gagal simpan ke disk, tandai gagal
-        else:
-            # Jika download gambar gagal setelah 5x retry
-            log(device, f"Download gambar gagal untuk event {eventId}, menandai 'failed'.", level="ERROR")
-            initial_api_status = 'failed'
+    if dt and image_content and is_valid_for_api:
+        # Gambar sudah terlampir (push): langsung simpan ke disk
+        local_image_path = store_event_image(device, device_name, name, eventId, dt, image_content)
+        initial_api_status = 'pending' if local_image_path else 'failed'
+    elif dt and pictureURL and is_valid_for_api:
+        # Baris ditulis segera; gambar diunduh terpisah oleh pipeline unduh gambar
+        initial_api_status = 'image_pending'
+    elif dt and is_valid_for_api and cached_capabilities(device.get("ip")).get('supportsPicture') is False:
+        # Perangkat tanpa fitur gambar: tetap dikirim ke API tanpa gambar
+        initial_api_status = 'pending'
     
-    # Langkah 4: Simpan event ke database
-    conn, c, db_event_id = db.get_db(), None, None
+    return {
+        'deviceName': device_name, 'eventId': eventId, 'employeeId': employee_id, 'name': name,
+        'date': date_value, 'time': time_value, 'eventDesc': event_desc, 'pictureURL': pictureURL,
+        'localImagePath': local_image_path, 'syncType': sync_type, 'apiStatus': initial_api_status,
+    }
+
+# --- WAKEUP WORKER ---
+WAKEUP_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+def notify_worker():
+    """
+    Mengirim datagram UDP ke worker_service agar antrean API langsung diproses (tanpa menunggu
+    worker_api_interval). Best-effort: jika worker tidak mendengar, polling berkala tetap menjadi jaring pengaman.
+    """
+    for addr in WORKER_WAKEUP_ADDRS:
+        try:
+            WAKEUP_SOCKET.sendto(b"wake", addr)
+        except OSError:
+            pass
+
+def notify_image_pipeline():
+    """
+    Sinyal UDP ke sync_service agar baris 'image_pending' (mis. dari push_service) langsung diunduh,
+    tanpa menunggu sweeper IMAGE_SWEEP_SECONDS. Best-effort seperti notify_worker.
+    """
+    for addr in SYNC_IMAGE_WAKEUP_ADDRS:
+        try:
+            WAKEUP_SOCKET.sendto(b"image", addr)
+        except OSError:
+            pass
+
+def open_image_wakeup_socket():
+    """Socket UDP non-blocking untuk sinyal pipeline gambar. None jika port tidak bisa dipakai (sweeper saja)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        c = conn.cursor()
-        # Perhatikan: apiRetryCount di-set ke 0
-        sql = """
-            INSERT INTO events 
-            (deviceName, eventId, employeeId, name, date, time, eventDesc, 
-             pictureURL, localImagePath, syncType, apiStatus, apiRetryCount) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0)
-        """
-        values = (device_name, eventId, employee_id, name, date_value, time_value, 
-                  event_desc, pictureURL, local_image_path, sync_type, initial_api_status)
-        c.execute(sql, values)
-        db_event_id = c.lastrowid
-        
-        return True
-    except mysql.connector.IntegrityError:
-        log(device, f"Info: Event (ID: {eventId}) sudah ada di database, dilewati.")
+        sock.bind(SYNC_IMAGE_WAKEUP_LISTEN)
+    except OSError as e:
+        log_system(f"Gagal membuka socket wakeup gambar {SYNC_IMAGE_WAKEUP_LISTEN}: {e}. Hanya mengandalkan sweeper.", level="WARN")
+        sock.close()
+        return None
+    sock.setblocking(False)
+    return sock
+
+def wait_for_image_wakeup(sock, timeout):
+    """Menunggu sinyal maks. `timeout` detik. True jika ada sinyal (semua sinyal tertunda dibuang)."""
+    if sock is None:
+        time.sleep(timeout)
+        return False
+    ready, _, _ = select.select([sock], [], [], timeout)
+    if not ready:
         return False
+    while True:
+        try:
+            sock.recv(64)
+        except OSError: # BlockingIOError: antrean sinyal sudah kosong
+            return True
+
+def write_event_rows(device, rows):
+    """
+    Menyimpan banyak baris event dalam satu transaksi (INSERT IGNORE multi-baris).
+    Mengembalikan dict eventId -> id baris untuk event yang benar-benar baru.
+    """
+    if not rows:
+        return {}
+    try:
+        inserted, duplicates = db.insert_events_batch(device_label(device), rows)
     except Exception as e:
-        log(device, f"DB error (ID: {eventId}): {e}", level="ERROR")
+        log(device, f"DB error saat menyimpan {len(rows)} event: {e}", level="ERROR")
+        return {}
+    for event_id in duplicates:
+        log(device, f"Info: Event (ID: {event_id}) sudah ada di database, dilewati.")
+    image_signal = False
+    for row in rows:
+        if row['apiStatus'] == 'image_pending' and row['eventId'] in inserted:
+            if not enqueue_image_job(dict(row, id=inserted[row['eventId']]), device):
+                image_signal = True
+    if image_signal and not IMAGE_WORKERS_STARTED.is_set():
+        # Proses ini tidak mengunduh gambar (push_service): minta pipeline sync_service mengambilnya sekarang
+        notify_image_pipeline()
+    if any(row['apiStatus'] == 'pending' and row['eventId'] in inserted for row in rows):
+        notify_worker()
+    return inserted
+
+def save_event(event, device, image_content=None):
+    """Menyimpan satu event (dipakai push_service). True jika event baru tersimpan."""
+    return bool(write_event_rows(device, [build_event_row(event, device, image_content)]))
+# ----------------------------------------------------
+
+# --- PIPELINE UNDUH GAMBAR ---
+# Antrean terbatas bersama untuk semua perangkat + batas unduhan paralel per perangkat.
+# Job yang tidak muat di antrean tetap berstatus 'image_pending' di DB dan diambil ulang oleh sweeper.
+# Pipeline hanya berjalan di proses sync_service; di proses lain (push_service) job tidak diantrekan,
+# melainkan sync_service diberi sinyal UDP (notify_image_pipeline) lalu langsung menjalankan sweeper,
+# sehingga satu gambar tidak diunduh dua proses sekaligus tanpa menunggu IMAGE_SWEEP_SECONDS.
+IMAGE_WORKERS_STARTED = threading.Event()
+IMAGE_QUEUE = queue.Queue(maxsize=IMAGE_QUEUE_MAX)
+IMAGE_JOBS_IN_FLIGHT = set()
+IMAGE_DEVICE_SLOTS = {}
+IMAGE_LOCK = threading.Lock()
+
+def enqueue_image_job(job, device):
+    """Menjadwalkan unduhan gambar untuk baris event (job berisi id, eventId, name, date, time, pictureURL)."""
+    if not IMAGE_WORKERS_STARTED.is_set():
         return False
-    finally:
-        if c: c.close()
-        conn.close()
+    with IMAGE_LOCK:
+        if job['id'] in IMAGE_JOBS_IN_FLIGHT:
+            return False
+        try:
+            IMAGE_QUEUE.put_nowait((job, device))
+        except queue.Full:
+            return False
+        IMAGE_JOBS_IN_FLIGHT.add(job['id'])
+    return True
+
+def get_device_image_slots(ip):
+    try:
+        per_device = int(db.get_setting('image_fetch_per_device', '2'))
+    except ValueError:
+        per_device = 2
+    with IMAGE_LOCK:
+        slots = IMAGE_DEVICE_SLOTS.get(ip)
+        if slots is None:
+            slots = IMAGE_DEVICE_SLOTS[ip] = threading.BoundedSemaphore(max(1, per_device))
+        return slots
+
+def fetch_event_image(job, device):
+    """Mengunduh & menyimpan satu gambar, lalu mempromosikan apiStatus ke 'pending' (atau 'failed')."""
+    event_id = job['eventId']
+    try:
+        dt = datetime.datetime.strptime(f"{job['date']} {job['time']}", "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        dt = datetime.datetime.now()
+
+    get_rate_governor(device).acquire()
+    image_content = download_image_with_retry(device, job['pictureURL'])
+
+    local_image_path = None
+    if image_content:
+        local_image_path = store_event_image(device, device_label(device), job['name'], event_id, dt, image_content)
+    else:
+        log(device, f"Download gambar gagal untuk event {event_id}, menandai 'failed'.", level="ERROR")
+
+    db.update_event_image(job['id'], local_image_path, 'pending' if local_image_path else 'failed')
+    # 'failed' juga diambil worker (unduh ulang gambar), jadi keduanya membangunkan worker
+    notify_worker()
+
+def image_fetch_worker():
+    while True:
+        job, device = IMAGE_QUEUE.get()
+        slots = get_device_image_slots(device.get("ip"))
+        if not slots.acquire(timeout=0.5):
+            # Perangkat ini sedang penuh: kembalikan ke ekor antrean agar perangkat lain tetap jalan
+            try:
+                IMAGE_QUEUE.put_nowait((job, device))
+            except queue.Full:
+                with IMAGE_LOCK:
+                    IMAGE_JOBS_IN_FLIGHT.discard(job['id'])
+            IMAGE_QUEUE.task_done()
+            continue
+        try:
+            fetch_event_image(job, device)
+        except Exception as e:
+            log(device, f"Error pipeline gambar (ID: {job.get('eventId')}): {e}", level="ERROR")
+        finally:
+            slots.release()
+            with IMAGE_LOCK:
+                IMAGE_JOBS_IN_FLIGHT.discard(job['id'])
+            IMAGE_QUEUE.task_done()
+
+def start_image_workers():
+    try:
+        workers = int(db.get_setting('image_fetch_workers', '4'))
+    except ValueError:
+        workers = 4
+    for _ in range(max(1, workers)):
+        threading.Thread(target=image_fetch_worker, daemon=True).start()
+    IMAGE_WORKERS_STARTED.set()
+    log_system(f"Pipeline unduh gambar berjalan dengan {max(1, workers)} worker.")
+
+def sweep_image_pending():
+    """Mengantrekan ulang baris 'image_pending' yang belum dijadwalkan (crash, antrean penuh, event push)."""
+    try:
+        rows = db.get_image_pending_events(IMAGE_QUEUE_MAX)
+    except Exception as e:
+        log_system(f"Gagal mengambil event image_pending: {e}", level="ERROR")
+        return
+    for row in rows:
+        device = {'ip': row['ip'], 'name': row['deviceName'],
+                  'username': row['deviceUsername'], 'password': row['devicePassword']}
+        enqueue_image_job(row, device)
 # ----------------------------------------------------
 
+# --- CATCH-UP ENGINE (Paralel & Adaptif) ---
+def plan_catchup_windows(start_dt, end_dt, hourly_density, target_events):
+    """
+    Membagi rentang catch-up menjadi jendela waktu yang masing-masing diperkirakan berisi
+    sekitar `target_events` event, berdasarkan kepadatan rata-rata per jam (hourly_density).
+    Jam sibuk -> jendela kecil, jam sepi -> jendela besar (dibatasi MIN/MAX chunk).
+    """
+    min_chunk = datetime.timedelta(minutes=CATCH_UP_MIN_CHUNK_MINUTES)
+    max_chunk = datetime.timedelta(minutes=CATCH_UP_MAX_CHUNK_MINUTES)
+    windows = []
+    current = start_dt
+    while current < end_dt:
+        limit = min(current + max_chunk, end_dt)
+        window_end, expected = current, 0.0
+        while window_end < limit:
+            next_hour = window_end.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+            segment_end = min(next_hour, limit)
+            rate = hourly_density[window_end.hour] / 3600.0 # event per detik
+            segment_events = rate * (segment_end - window_end).total_seconds()
+            if rate > 0 and expected + segment_events > target_events:
+                window_end += datetime.timedelta(seconds=(target_events - expected) / rate)
+                break
+            expected += segment_events
+            window_end = segment_end
+        window_end = min(max(window_end, current + min_chunk), end_dt)
+        windows.append((current, window_end))
+        current = window_end
+    return windows
+
+def iter_catchup_chunks(device, windows, page_size, timeout, max_parallel, caps=None):
+    """
+    Generator: mengambil jendela secara paralel (maks. `max_parallel` sedang berjalan) dan
+    menghasilkan (window, events) sesuai urutan jendela. Jendela baru hanya dikirim saat ada
+    slot kosong, sehingga jumlah event di memori tetap terbatas berapa pun panjang backlog.
+    """
+    def _fetch(window):
+        w_start, w_end = window
+        return get_events_from_device(device, to_iso_time(w_start), to_iso_time(w_end), page_size, timeout, caps=caps)
+
+    max_parallel = max(1, max_parallel)
+    windows_iter = iter(windows)
+    executor = ThreadPoolExecutor(max_workers=max_parallel)
+    try:
+        in_flight = collections.deque()
+        for window in windows_iter:
+            in_flight.append((window, executor.submit(_fetch, window)))
+            if len(in_flight) >= max_parallel:
+                break
+        while in_flight:
+            window, future = in_flight.popleft()
+            events = future.result()
+            next_window = next(windows_iter, None)
+            if next_window:
+                in_flight.append((next_window, executor.submit(_fetch, next_window)))
+            yield window, events
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def get_catchup_plan(device, start_dt, end_dt, page_size):
+    density = db.get_device_hourly_density(device_label(device), CATCH_UP_DENSITY_DAYS)
+    if not any(density):
+        # Belum ada histori: pakai ukuran jendela tetap
+        density = [page_size * 60.0 / CATCH_UP_CHUNK_MINUTES] * 24
+    return plan_catchup_windows(start_dt, end_dt, density, page_size)
+
 # --- PING & WORKER ---
+def save_new_events(device, events, last_seen_id):
+    """
+    Menyimpan event dengan serialNo > last_seen_id (urut serialNo).
+    Mengembalikan (jumlah tersimpan, event terbaru atau None).
+    """
+    events = sorted(events, key=lambda x: int(x.get("serialNo") or 0))
+    new_events = [e for e in events if int(e.get("serialNo") or 0) > last_seen_id]
+    if not new_events:
+        return 0, None
+
+    # Event yang sudah masuk lewat push tidak perlu diunduh/di-insert ulang
+    existing_ids = db.get_existing_event_ids(device_label(device), [int(e.get("serialNo") or 0) for e in new_events])
+
+    rows = []
+    for e in new_events:
+        # [DIHAPUS] Tidak lagi mencatat log raw/service log
+        
+        event_desc = get_event_desc(e)
+        
+        if event_desc == "Face Recognized" and int(e.get("serialNo") or 0) not in existing_ids:
+            try:
+                time_value = datetime.datetime.strptime(e.get("time")[:19], "%Y-%m-%dT%H:%M:%S").strftime("%H:%M:%S")
+                try:
+                    realtime_tolerance = int(db.get_setting('realtime_tolerance', '120'))
+                except ValueError:
+                    realtime_tolerance = 120
+                
+                sync_type = "realtime" if abs((datetime.datetime.now() - parse_iso_time(e.get("time"))).total_seconds()) <= realtime_tolerance else "catch-up"
+                log(device, f"Mengambil event '{sync_type}' - {time_value} (ID: {e.get('serialNo')}) untuk '{e.get('name')}'...")
+            except Exception:
+                log(device, f"Mengambil event (ID: {e.get('serialNo')}) untuk '{e.get('name')}'...")
+
+            rows.append(build_event_row(e, device))
+
+    # Satu koneksi & satu transaksi untuk seluruh halaman/jendela
+    inserted = write_event_rows(device, rows)
+    return len(inserted), new_events[-1]
+
+def is_gap_repair_due(device):
+    """
+    Perangkat mode push menerima event lewat push_service; polling hanya dijalankan
+    sesekali (push_gap_repair_interval) untuk menambal event yang terlewat.
+    """
+    if not device.get("pushEnabled"):
+        return True
+    if cached_capabilities(device.get("ip")).get('supportsPush') is False:
+        # Mode push diaktifkan tapi perangkat tidak mendukung HTTP Listening: tetap poll normal
+        return True
+    try:
+        interval = int(db.get_setting('push_gap_repair_interval', '300'))
+    except ValueError:
+        interval = 300
+    ip, now = device.get("ip"), time.time()
+    with DEVICE_DATA_LOCK:
+        if now - LAST_POLL_TIME.get(ip, 0) < interval:
+            return False
+        LAST_POLL_TIME[ip] = now
+    return True
+
 def process_device(device):
     ip = device.get("ip")
     if not all([device.get("username"), device.get("password")]):
         log(device, "Username atau Password belum diatur. Dilewati.", level="WARN")
         return
+    if not is_gap_repair_due(device):
+        return
         
     try:
         try:
             batch_max = int(db.get_setting('event_batch_max', '100'))
             timeout = int(db.get_setting('request_timeout', '30'))
-            sleep_delay = float(db.get_setting('event_sleep_delay', '1'))
         except ValueError:
             batch_max = 100
             timeout = 30
-            sleep_delay = 1
+        # Deteksi kemampuan (sekali per perangkat) sebelum ukuran halaman & format waktu dipakai
+        caps = get_device_capabilities(device, timeout)
+        page_size = get_page_size(device, batch_max)
 
-        last_sync_str = get_last_sync_time(ip)
+        cursor = get_device_cursor(ip)
+        last_seen_id = int(cursor.get('lastSerialNo') or 0)
+        last_event_dt = cursor.get('lastEventTime')
+        last_sync_str, position = get_resume_point(ip, cursor)
         now_time_str = iso8601_now()
         start_dt, end_dt = parse_iso_time(last_sync_str), parse_iso_time(now_time_str)
         time_diff_seconds = (end_dt - start_dt).total_seconds()
         
+        saved_count = 0
+        newest_event_time_str = None
+
         if time_diff_seconds > BIG_CATCHUP_THRESHOLD_SECONDS: # BIG_CATCHUP masih dari config.py
-            all_events = []
-            current_start_dt = start_dt
-            while current_start_dt < end_dt:
-                current_end_dt = min(current_start_dt + datetime.timedelta(minutes=CATCH_UP_CHUNK_MINUTES), end_dt)
-                chunk_events = get_events_from_device(device, 
-                                                    current_start_dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE, 
-                                                    current_end_dt.strftime("%Y-%m-%dT%H:%M:%S") + TIMEZONE,
-                                                    batch_max, timeout)
-                if chunk_events: all_events.extend(chunk_events)
-                current_start_dt = current_end_dt
-            events = all_events
+            try:
+                max_parallel = int(db.get_setting('catchup_parallel_windows', '3'))
+            except ValueError:
+                max_parallel = 3
+            windows = get_catchup_plan(device, start_dt, end_dt, page_size)
+            log(device, f"Catch-up besar: {len(windows)} jendela, paralel maks. {max_parallel}.")
+            # Setiap jendela langsung disimpan & di-checkpoint, tidak ditumpuk di memori
+            for (w_start, w_end), chunk_events in iter_catchup_chunks(device, windows, page_size, timeout, max_parallel, caps):
+                if chunk_events is None:
+                    log(device, f"Catch-up terhenti di jendela {to_iso_time(w_start)}. Dilanjutkan pada siklus berikutnya.", level="WARN")
+                    break
+                if is_serial_reset(chunk_events, last_seen_id, last_event_dt):
+                    last_seen_id = reset_serial_cursor(device, "event lebih baru dengan serialNo di bawah cursor")
+                saved, newest_event = save_new_events(device, chunk_events, last_seen_id)
+                saved_count += saved
+                if newest_event:
+                    last_seen_id = int(newest_event.get("serialNo") or 0)
+                    newest_event_time_str = newest_event.get("time")
+                # Jendela ini sudah tuntas: cursor maju ke batas akhirnya meski jendelanya kosong
+                last_event_dt = w_end
+                update_device_cursor(ip, last_seen_id, last_event_dt)
         else:
-            events = get_events_from_device(device, last_sync_str, now_time_str, batch_max, timeout)
-        
-        if not events: return
-        
-        events.sort(key=lambda x: int(x.get("serialNo") or 0))
-        
-        with DEVICE_DATA_LOCK:
-            last_seen_id = LAST_SEEN_EVENT_ID.get(ip, 0)
-        
-        new_events = [e for e in events if int(e.get("serialNo") or 0) > last_seen_id]
-
-        if not new_events:
-            return
+            for page, next_position, has_more in iter_event_pages(device, last_sync_str, now_time_str,
+                                                                   page_size, timeout, position, caps):
+                if is_serial_reset(page, last_seen_id, last_event_dt):
+                    last_seen_id = reset_serial_cursor(device, "event lebih baru dengan serialNo di bawah cursor")
+                saved, newest_event = save_new_events(device, page, last_seen_id)
+                saved_count += saved
+                if newest_event:
+                    last_seen_id = int(newest_event.get("serialNo") or 0)
+                    last_event_dt = parse_event_time(newest_event) or last_event_dt
+                    newest_event_time_str = newest_event.get("time")
 
-        saved_count = 0
-        for e in new_events:
-            # [DIHAPUS] Tidak lagi mencatat log raw/service log
-            
-            time.sleep(sleep_delay)
-            
-            event_desc = get_event_desc(e)
-            
-            if event_desc == "Face Recognized":
-                try:
-                    time_value = datetime.datetime.strptime(e.get("time")[:19], "%Y-%m-%dT%H:%M:%S").strftime("%H:%M:%S")
-                    try:
-                        realtime_tolerance = int(db.get_setting('realtime_tolerance', '120'))
-                    except ValueError:
-                        realtime_tolerance = 120
-                    
-                    sync_type = "realtime" if abs((datetime.datetime.now() - parse_iso_time(e.get("time"))).total_seconds()) <= realtime_tolerance else "catch-up"
-                    log(device, f"Mengambil event '{sync_type}' - {time_value} (ID: {e.get('serialNo')}) untuk '{e.get('name')}'...")
-                except Exception:
-                    log(device, f"Mengambil event (ID: {e.get('serialNo')}) untuk '{e.get('name')}'...")
-
-                if save_event(e, device):
-                    saved_count += 1
+                # Checkpoint per halaman: jika proses mati di tengah, pencarian dilanjutkan dari posisi ini
+                if has_more:
+                    update_device_cursor(ip, last_seen_id, last_event_dt, start_dt, next_position)
+                elif newest_event or position:
+                    update_device_cursor(ip, last_seen_id, last_event_dt)
         
         if saved_count > 0:
             log(device, f"Selesai, total {saved_count} event baru berhasil disimpan ke database (status: pending).")
-        
-        newest_event = new_events[-1]
-        newest_event_id = int(newest_event.get("serialNo") or 0)
-        newest_event_time_str = newest_event.get("time")
-
-        with DEVICE_DATA_LOCK:
-            LAST_SEEN_EVENT_ID[ip] = newest_event_id
             
         if newest_event_time_str:
             set_last_sync_time(ip, newest_event_time_str)
@@ -412,32 +1016,97 @@ def process_device(device):
     except Exception as e:
         log(device, f"Terjadi error tak terduga: {e}", level="ERROR")
 
+# --- SCHEDULER PER PERANGKAT ---
+class DevicePollLoop(threading.Thread):
+    """
+    Thread jangka panjang untuk satu perangkat. Setiap perangkat punya jadwal (deadline) sendiri,
+    sehingga perangkat yang lambat/timeout tidak menahan laju poll perangkat lain.
+    """
+    def __init__(self, device):
+        super().__init__(name=f"poll-{device.get('ip')}", daemon=True)
+        self.device = device
+        self.stop_event = threading.Event()
+
+    def update_device(self, device):
+        # Perubahan data perangkat (kredensial, page size, mode push) dipakai pada poll berikutnya
+        self.device = device
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        next_deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            process_device(self.device)
+            try:
+                poll_interval = int(db.get_setting('poll_interval', '2'))
+            except ValueError:
+                poll_interval = 2
+            
+            now = time.monotonic()
+            next_deadline += poll_interval
+            if next_deadline < now:
+                # Poll melewati deadline: jadwalkan ulang dari sekarang, jangan menumpuk siklus yang terlewat
+                next_deadline = now
+            self.stop_event.wait(next_deadline - now)
+
+def refresh_device_loops(loops):
+    """Menyelaraskan thread poll dengan daftar perangkat aktif di DB (tambah/hapus tanpa restart)."""
+    devices = {d['ip']: d for d in db.get_all_devices()}
+
+    for ip in list(loops):
+        if ip not in devices:
+            loops.pop(ip).stop()
+            log_system(f"Perangkat {ip} dihapus/nonaktif, loop poll dihentikan.")
+
+    for ip, device in devices.items():
+        loop = loops.get(ip)
+        if loop is None or not loop.is_alive():
+            loops[ip] = DevicePollLoop(device)
+            loops[ip].start()
+            log(device, "Loop poll perangkat dimulai.")
+        else:
+            loop.update_device(device)
+    return devices
+
 # --- MAIN LOOP ---
 def main_sync():
     db.init_db()
     log_system("Memulai [Sync Service] - (HANYA MENGAMBIL EVENT)...")
+    load_device_cursors()
+    load_device_capabilities()
+    start_image_workers()
+    image_wakeup_socket = open_image_wakeup_socket()
+    loops = {}
+    last_image_sweep = 0
+    last_refresh = 0
+    image_signal = False
     
     try:
         while True:
-            devices = db.get_all_devices()
-            if not devices:
-                log_system("Tidak ada device yang terdaftar. Menunggu 15 detik..."), time.sleep(15)
-                continue
-            
-            with ThreadPoolExecutor(max_workers=len(devices)) as executor:
-                executor.map(process_device, devices)
-            
-            try:
-                poll_interval = int(db.get_setting('poll_interval', '2'))
-            except ValueError:
-                poll_interval = 2
+            now = time.time()
+            if image_signal or now - last_image_sweep > IMAGE_SWEEP_SECONDS:
+                sweep_image_pending()
+                last_image_sweep = now
+
+            if now - last_refresh > DEVICE_REFRESH_SECONDS:
+                try:
+                    if not refresh_device_loops(loops):
+                        log_system(f"Tidak ada device yang terdaftar. Dicek lagi dalam {DEVICE_REFRESH_SECONDS} detik...")
+                except Exception as e:
+                    log_system(f"Gagal memuat daftar perangkat: {e}", level="ERROR")
+                last_refresh = now
             
-            time.sleep(poll_interval) 
+            # Jeda maks. 1 detik, atau langsung lanjut saat push_service menyimpan event tanpa gambar
+            image_signal = wait_for_image_wakeup(image_wakeup_socket, 1)
             
     except KeyboardInterrupt:
         log_system("Sinkronisasi (Sync Service) dihentikan oleh pengguna.")
     except Exception as e:
         log_system(f"FATAL ERROR [Sync Service]: {e}", level="ERROR")
+    finally:
+        for loop in loops.values():
+            loop.stop()
 
 # --- ENTRY POINT ---
 if __name__ == "__main__":
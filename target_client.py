@@ -0,0 +1,283 @@
+import os
+import time
+import uuid
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (REQUEST_TIMEOUT, API_TARGET_CONNECT_TIMEOUT, API_TARGET_MAX_CONNECTIONS,
+                    API_BREAKER_FAILURES, API_BREAKER_RESET_SECONDS)
+
+# ==========================================
+# KLIEN TARGET API (dipakai worker_service untuk pengiriman event)
+# ==========================================
+# Satu requests.Session keep-alive + satu circuit breaker per URL targetApi:
+# - Koneksi ke target dipakai ulang antar event (tidak connect ulang setiap POST).
+# - Jika target gagal berturut-turut (error koneksi/timeout/5xx), breaker OPEN: event untuk target itu
+#   ditunda tanpa dicoba, sehingga tidak menghabiskan request_timeout dan slot thread worker.
+# - Setelah API_BREAKER_RESET_SECONDS, breaker HALF-OPEN: tepat satu event dikirim sebagai probe.
+#   Berhasil -> CLOSED (normal lagi), gagal -> OPEN lagi.
+# - Mode multipart: body di-stream dari disk (MultipartStream), gambar tidak di-base64 dan tidak dimuat ke memori.
+# - Konkurensi adaptif (AIMD) per target: jumlah request bersamaan naik perlahan selama latensi di bawah
+#   target dan turun tajam saat target lambat/error, dalam batas api_concurrency_min..max.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+TARGETS = {}
+TARGETS_LOCK = threading.Lock()
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=API_BREAKER_FAILURES, reset_seconds=API_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """True jika request boleh dikirim. Saat HALF-OPEN hanya satu pemanggil (probe) yang diizinkan."""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self.probe_started = now
+                return True
+            if self.state == HALF_OPEN and now - self.probe_started >= self.reset_seconds:
+                # Probe sebelumnya tidak pernah melapor (mis. thread error): izinkan probe baru
+                self.probe_started = now
+                return True
+            return False
+
+    def retry_in(self):
+        """Detik sampai probe berikutnya boleh dikirim (0 jika breaker tertutup)."""
+        with self.lock:
+            if self.state == CLOSED:
+                return 0
+            started = self.opened_at if self.state == OPEN else self.probe_started
+            return max(0, self.reset_seconds - (time.monotonic() - started))
+
+    def record_success(self):
+        """Mengembalikan True jika breaker baru saja tertutup kembali (probe berhasil)."""
+        with self.lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_started = None
+            return recovered
+
+    def record_failure(self):
+        """Mengembalikan True jika kegagalan ini membuat breaker OPEN."""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+                return True
+            return False
+
+class ConcurrencyLimiter:
+    """
+    Batas request bersamaan ke satu target, diatur AIMD dari latensi & error yang teramati:
+    - Berhasil dan latensi <= latency_target_ms: naik +1 per "satu jendela" (limit += 1/limit per respons).
+    - Error atau latensi > latency_target_ms: limit dikali DECREASE_FACTOR (maks. sekali per DECREASE_COOLDOWN detik,
+      agar satu ledakan respons lambat tidak menjatuhkan limit ke minimum sekaligus).
+    """
+    DECREASE_FACTOR = 0.7
+    DECREASE_COOLDOWN = 1.0
+
+    def __init__(self, initial=None, minimum=1, maximum=20, latency_target_ms=1000):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target_ms = latency_target_ms
+        self.limit = float(initial or minimum)
+        self.in_flight = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+        self.configure(minimum, maximum, latency_target_ms)
+
+    def configure(self, minimum, maximum, latency_target_ms):
+        with self.condition:
+            self.minimum = max(1, minimum)
+            self.maximum = max(self.minimum, maximum)
+            self.latency_target_ms = latency_target_ms
+            self.limit = min(max(self.limit, self.minimum), self.maximum)
+            self.condition.notify_all()
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """Seperti acquire() tetapi tanpa menunggu: False jika semua slot sedang terpakai."""
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency_ms=None, ok=True):
+        """Melepas slot. Tanpa latency_ms (slot tidak jadi dipakai untuk request) limit tidak diubah."""
+        with self.condition:
+            self.in_flight -= 1
+            if latency_ms is not None:
+                self.observe(latency_ms, ok)
+            self.condition.notify_all()
+
+    def observe(self, latency_ms, ok):
+        """Menyesuaikan limit (AIMD) dari satu respons."""
+        with self.condition:
+            now = time.monotonic()
+            if ok and latency_ms <= self.latency_target_ms:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            elif now - self.last_decrease >= self.DECREASE_COOLDOWN:
+                self.limit = max(self.minimum, self.limit * self.DECREASE_FACTOR)
+                self.last_decrease = now
+            self.condition.notify_all()
+
+class TargetClient:
+    def __init__(self, url, initial_concurrency=None):
+        self.url = url
+        self.breaker = CircuitBreaker()
+        self.limiter = ConcurrencyLimiter(initial_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_TARGET_MAX_CONNECTIONS, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, timeout=None, slot_held=False, **kwargs):
+        """
+        POST ke target (tanpa retry; retry dijadwalkan antrean). Menunggu slot limiter konkurensi,
+        lalu melaporkan latensi & hasilnya ke limiter. Exception RequestException diteruskan.
+        slot_held=True: pemanggil sudah memegang slot (limiter.try_acquire) dan melepasnya sendiri.
+        """
+        read_timeout = timeout or REQUEST_TIMEOUT
+        if not slot_held:
+            self.limiter.acquire()
+        started = time.monotonic()
+        ok = False
+        try:
+            response = self.session.post(self.url, timeout=(min(API_TARGET_CONNECT_TIMEOUT, read_timeout), read_timeout), **kwargs)
+            ok = not is_target_failure(response.status_code)
+            return response
+        finally:
+            latency_ms = (time.monotonic() - started) * 1000
+            if slot_held:
+                self.limiter.observe(latency_ms, ok)
+            else:
+                self.limiter.release(latency_ms, ok)
+
+    def post_multipart(self, parts, timeout=None, slot_held=False):
+        """POST multipart/form-data yang di-stream (lihat MultipartStream)."""
+        body = MultipartStream(parts)
+        try:
+            return self.post(data=body, headers={'Content-Type': body.content_type}, timeout=timeout, slot_held=slot_held)
+        finally:
+            body.close()
+
+    def close(self):
+        self.session.close()
+
+class MultipartStream:
+    """
+    Body multipart/form-data yang dibaca bertahap: bagian file dibaca langsung dari disk per blok,
+    tidak pernah dimuat utuh ke memori. `__len__` dipakai requests untuk header Content-Length.
+    parts: list (name, value) untuk field teks, atau (name, filename, content_type, path_or_bytes) untuk file.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, parts):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.segments = [] # bytes, atau path file (str) yang dibaca saat streaming
+        for part in parts:
+            if len(part) == 2:
+                name, value = part
+                self.segments.append(self.header(name) + str(value).encode('utf-8') + b"\r\n")
+            else:
+                name, filename, content_type, source = part
+                self.segments.append(self.header(name, filename, content_type))
+                self.segments.append(source)
+                self.segments.append(b"\r\n")
+        self.segments.append(f"--{self.boundary}--\r\n".encode('ascii'))
+        self.length = sum(os.path.getsize(s) if isinstance(s, str) else len(s) for s in self.segments)
+        self.index = 0
+        self.buffer = b""
+        self.file = None
+
+    def header(self, name, filename=None, content_type=None):
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        lines = [f"--{self.boundary}", f"Content-Disposition: {disposition}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('utf-8')
+
+    def __len__(self):
+        return self.length
+
+    def next_chunk(self):
+        while self.index < len(self.segments):
+            segment = self.segments[self.index]
+            if not isinstance(segment, str):
+                self.index += 1
+                return segment
+            if self.file is None:
+                self.file = open(segment, 'rb')
+            chunk = self.file.read(self.CHUNK_SIZE)
+            if chunk:
+                return chunk
+            self.file.close()
+            self.file = None
+            self.index += 1
+        return b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = self.next_chunk()
+            if not chunk:
+                break
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def is_target_failure(status_code):
+    """Status yang menandakan target bermasalah (dihitung breaker). 4xx lain = target hidup tapi menolak data."""
+    return status_code >= 500 or status_code == 429
+
+def get_target(url, initial_concurrency=None):
+    """
+    Klien untuk satu URL targetApi (dibuat sekali, dipakai ulang semua thread worker).
+    `initial_concurrency` (mis. nilai tersimpan di api_targets) hanya dipakai saat klien pertama dibuat.
+    """
+    with TARGETS_LOCK:
+        target = TARGETS.get(url)
+        if target is None:
+            target = TARGETS[url] = TargetClient(url, initial_concurrency)
+        return target
+
+def configure_limiters(minimum, maximum, latency_target_ms):
+    """Menerapkan batas konkurensi (pengaturan DB) ke semua target yang sudah dikenal."""
+    with TARGETS_LOCK:
+        targets = list(TARGETS.values())
+    for target in targets:
+        target.limiter.configure(minimum, maximum, latency_target_ms)
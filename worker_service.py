@@ -1,6 +1,4 @@
-import platform
 import requests
-from requests.auth import HTTPDigestAuth
 import mysql.connector
 import datetime
 import time
@@ -10,12 +8,23 @@ import base64
 import json
 import logging
 import threading
+import collections
+import socket
+import select
+import uuid
+import math
+import random
+import argparse
 from concurrent.futures import ThreadPoolExecutor
 import shutil
+import cachetools
 
 # Impor konfigurasi dan modul database kustom
 from config import *
 import database as db
+import isapi_client
+import isapi_async
+import target_client
 
 # --- SETUP LOGGING (Tidak berubah) ---
 LOG_LOCK = threading.Lock()
@@ -95,6 +104,8 @@ def cleanup_old_logs(days_to_keep):
 # --- Variabel Global & Kunci Thread ---
 FAIL_COUNT, SUSPEND_UNTIL, LAST_KNOWN_STATUS = {}, {}, {}
 DEVICE_DATA_LOCK = threading.Lock()
+# Identitas pemilik lease antrean API (unik per proses, aman untuk banyak worker/node)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
 # ----------------------------------------
 
 # --- FUNGSI HELPER (Waktu & Notifikasi) ---
@@ -106,11 +117,11 @@ def get_indonesian_month_name(now):
     return months_map.get(now.month, '')
 
 def _send_wa_request(target_number, message_text, wa_api_url):
-    """Fungsi internal untuk mengirim request WA. Dijalankan di thread terpisah."""
+    """Fungsi internal untuk mengirim request WA (dipanggil thread notifier). True jika terkirim."""
     try:
         if not wa_api_url or not target_number:
             log_system(f"WA: URL API ({wa_api_url}) atau Nomor Tujuan ({target_number}) kosong.", level="WARN")
-            return
+            return False
         
         # Mengambil timeout dari DB
         try:
@@ -124,17 +135,21 @@ def _send_wa_request(target_number, message_text, wa_api_url):
         
         if response.status_code == 200:
             log_system(f"WA: Notifikasi berhasil dikirim ke {target_number}.", level="INFO")
-        else:
-            log_system(f"WA: Gagal mengirim notifikasi ke {target_number} (Status: {response.status_code}). Response: {response.text[:100]}", level="ERROR")
+            return True
+        log_system(f"WA: Gagal mengirim notifikasi ke {target_number} (Status: {response.status_code}). Response: {response.text[:100]}", level="ERROR")
             
     except requests.exceptions.RequestException as e:
         log_system(f"WA: Gagal koneksi ke server WhatsApp API ({wa_api_url}). Error: {e}", level="ERROR")
     except Exception as e:
         log_system(f"WA: Terjadi error tidak terduga saat mengirim ke {target_number}. Error: {e}", level="ERROR")
+    return False
 
-def send_whatsapp_notification(message_text, check_setting_key='whatsapp_enabled'):
+def send_whatsapp_notification(message_text, check_setting_key='whatsapp_enabled', group_key=None, group_title=None, summary=None):
     """
-    Mengirim notifikasi WhatsApp ke SEMUA nomor yang terdaftar di thread terpisah.
+    Memasukkan notifikasi WhatsApp ke antrean (notification_queue) untuk SEMUA nomor yang terdaftar.
+    Pengiriman dilakukan satu thread notifier (lihat notifier_loop). Peringatan dengan `group_key` sama
+    yang masuk dalam jendela wa_coalesce_seconds digabung menjadi satu pesan: `group_title`
+    ('{count}' diganti jumlah item) diikuti daftar `summary` tiap item.
     """
     try:
         wa_enabled = db.get_setting(check_setting_key, 'false')
@@ -148,39 +163,122 @@ def send_whatsapp_notification(message_text, check_setting_key='whatsapp_enabled
              log_system(f"WA: Gagal mengirim, URL API atau Nomor Tujuan belum diatur.", level="WARN")
              return
         
-        numbers = number_string.split(',')
-        log_system(f"WA: Mempersiapkan notifikasi ({check_setting_key}) ke {len(numbers)} nomor...", level="INFO")
-
-        for num in numbers:
+        numbers = []
+        for num in number_string.split(','):
             num = num.strip()
             if num.startswith('62') and num[2:].isdigit():
-                t = threading.Thread(target=_send_wa_request, args=(num, message_text, wa_api_url))
-                t.daemon = True
-                t.start()
+                numbers.append(num)
             elif num:
                 log_system(f"WA: Melewatkan nomor '{num}', format salah (harus 62...).", level="WARN")
+
+        # Tanpa group_key: pesan tunggal, dikirim tanpa menunggu jendela penggabungan
+        group_key = group_key or f"{SINGLE_NOTIFICATION_PREFIX}{uuid.uuid4().hex}"
+        queued = db.enqueue_notifications(numbers, group_key, message_text, group_title, summary)
+        log_system(f"WA: Notifikasi ({check_setting_key}) diantrekan untuk {queued} nomor.", level="INFO")
         
     except Exception as e:
-        log_system(f"WA: Gagal memulai thread notifikasi. Error: {e}", level="ERROR")
+        log_system(f"WA: Gagal mengantrekan notifikasi. Error: {e}", level="ERROR")
+
+# --- NOTIFIER WHATSAPP (satu thread, antrean persisten di DB) ---
+SINGLE_NOTIFICATION_PREFIX = "single:"
+NOTIFIER_POLL_SECONDS = 2
+NOTIFIER_MAX_ATTEMPTS = 5 # Percobaan kirim per notifikasi sebelum ditandai 'failed'
+NOTIFIER_MAX_LINES = 20 # Baris daftar maksimum dalam satu pesan gabungan
+RECIPIENT_SENT_TIMES = {} # nomor -> deque waktu kirim (rate limit per penerima)
+
+def recipient_allowed(recipient, rate_per_minute):
+    """Rate limit per penerima: maks. `rate_per_minute` pesan terkirim dalam 60 detik terakhir."""
+    sent_times = RECIPIENT_SENT_TIMES.setdefault(recipient, collections.deque())
+    now = time.time()
+    while sent_times and now - sent_times[0] > 60:
+        sent_times.popleft()
+    return len(sent_times) < rate_per_minute
+
+def record_recipient_send(recipient):
+    """Dicatat hanya setelah kirim berhasil, agar percobaan gagal tidak menghabiskan jatah rate penerima."""
+    RECIPIENT_SENT_TIMES.setdefault(recipient, collections.deque()).append(time.time())
+
+def build_notification_message(items):
+    """Satu item = pesan aslinya; beberapa item satu grup = judul dengan jumlah + daftar ringkasan."""
+    if len(items) == 1 or not items[0].get('groupTitle'):
+        return "\n\n---\n\n".join(item['message'] for item in items)
+
+    lines = [f"- {item['summary'] or item['message'].splitlines()[0]}" for item in items[:NOTIFIER_MAX_LINES]]
+    if len(items) > NOTIFIER_MAX_LINES:
+        lines.append(f"... dan {len(items) - NOTIFIER_MAX_LINES} lainnya")
+    now = datetime.datetime.now()
+    first = items[0]['created_at']
+    period = f"{first.strftime('%H:%M:%S')} - {now.strftime('%H:%M:%S')} WIB" if first else now.strftime("%H:%M:%S WIB")
+    return (
+        f"{items[0]['groupTitle'].replace('{count}', str(len(items)))}\n\n"
+        + "\n".join(lines)
+        + f"\n\n{now.day} {get_indonesian_month_name(now)} {now.year}, {period}"
+    )
+
+def process_notification_queue():
+    """Mengirim notifikasi yang jatuh tempo: digabung per (penerima, grup), dibatasi rate per penerima."""
+    try:
+        coalesce_seconds = int(db.get_setting('wa_coalesce_seconds', '30'))
+        rate_per_minute = max(1, int(db.get_setting('wa_rate_per_minute', '6')))
+    except ValueError:
+        coalesce_seconds, rate_per_minute = 30, 6
+    wa_api_url = db.get_setting('whatsapp_api_url')
+
+    groups = {}
+    for row in db.get_due_notifications(coalesce_seconds, SINGLE_NOTIFICATION_PREFIX):
+        groups.setdefault((row['recipient'], row['groupKey']), []).append(row)
+
+    for (recipient, _), items in groups.items():
+        if not recipient_allowed(recipient, rate_per_minute):
+            continue # Tetap di antrean; item baru grup ini ikut tergabung di pengiriman berikutnya
+        ids = [item['id'] for item in items]
+        if _send_wa_request(recipient, build_notification_message(items), wa_api_url):
+            record_recipient_send(recipient)
+            db.finish_notifications(ids, True)
+        else:
+            attempts = max(item['attempts'] for item in items)
+            retry_delay = min(900, 30 * (2 ** attempts))
+            db.finish_notifications(ids, False, retry_delay, NOTIFIER_MAX_ATTEMPTS)
+
+def notifier_loop():
+    log_system("Notifier WhatsApp dimulai.", "INFO")
+    while True:
+        try:
+            process_notification_queue()
+        except Exception as e:
+            log_system(f"WA: Error di loop notifier: {e}", level="ERROR")
+        time.sleep(NOTIFIER_POLL_SECONDS)
 
 # --- FUNGSI PING (Tugas Jaringan) ---
-def ping_device_os(ip):
-    param = "-n 1 -w 1000" if platform.system().lower() == "windows" else "-c 1 -W 1"
-    cmd = f"ping {param} {ip}"
-    return os.system(cmd + " > NUL 2>&1" if platform.system().lower()=="windows" else cmd + " > /dev/null 2>&1") == 0
+def is_ping_suspended(ip):
+    with DEVICE_DATA_LOCK:
+        return ip in SUSPEND_UNTIL and time.time() < SUSPEND_UNTIL[ip]
 
-def check_device_status(device, ping_max_fail, suspend_seconds):
+def ping_sweep(devices, ping_max_fail, suspend_seconds):
+    """
+    Ping semua perangkat sekaligus lewat engine ISAPI async (satu thread, konkurensi dibatasi),
+    bukan satu thread per perangkat. Cara cek mengikuti DEVICE_PING_METHOD (sama dengan /api/ping di dashboard);
+    probe tidak antre di belakang request ISAPI lain ke perangkat yang sama.
     """
-    Satu fungsi yang dijalankan di thread untuk mengecek satu perangkat.
+    due = [d for d in devices if not is_ping_suspended(d.get("ip"))]
+    if not due:
+        return
+    results = isapi_async.run_batch('ping', due)
+    for device in due:
+        entry = results.get(device.get("ip")) or {}
+        reachable = bool(entry.get('ok') and entry['result'].get('reachable'))
+        apply_ping_result(device, reachable, ping_max_fail, suspend_seconds)
+
+def apply_ping_result(device, reachable, ping_max_fail, suspend_seconds):
+    """
+    Memperbarui status online/offline satu perangkat dari hasil ping.
     Ini adalah logika yang dipindah dari sync_service.py
     """
     ip = device.get("ip")
-    
-    with DEVICE_DATA_LOCK:
-        if ip in SUSPEND_UNTIL and time.time() < SUSPEND_UNTIL[ip]:
-            return # Masih dalam masa suspend
+    # Notifikasi dikumpulkan di dalam lock dan baru diantrekan (query DB) setelah lock dilepas
+    notification = None
             
-    if not ping_device_os(ip):
+    if not reachable:
         with DEVICE_DATA_LOCK:
             fail_count = FAIL_COUNT.get(ip, 0) + 1
             FAIL_COUNT[ip] = fail_count
@@ -204,7 +302,10 @@ def check_device_status(device, ping_max_fail, suspend_seconds):
                         f"{date_line}\n{time_line}\n\n"
                         f"Layanan sinkronisasi ditangguhkan."
                     )
-                    send_whatsapp_notification(message, 'whatsapp_enabled')
+                    # Banyak perangkat satu lokasi offline bersamaan -> satu pesan gabungan
+                    notification = dict(message_text=message, group_key=f"offline|{location}",
+                                        group_title=f"🚨 PERINGATAN OFFLINE 🚨\n\n{{count}} perangkat OFFLINE di *{location}*.\nLayanan sinkronisasi ditangguhkan.",
+                                        summary=f"*{device.get('name')}* (IP: {ip})")
                     
                 SUSPEND_UNTIL[ip] = time.time() + suspend_seconds
     else:
@@ -226,7 +327,9 @@ def check_device_status(device, ping_max_fail, suspend_seconds):
                         f"{date_line}\n{time_line}\n\n"
                         f"Layanan sinkronisasi dilanjutkan."
                     )
-                    send_whatsapp_notification(message, 'whatsapp_enabled')
+                    notification = dict(message_text=message, group_key=f"online|{location}",
+                                        group_title=f"✅ PEMULIHAN KONEKSI ✅\n\n{{count}} perangkat ONLINE kembali di *{location}*.\nLayanan sinkronisasi dilanjutkan.",
+                                        summary=f"*{device.get('name')}* (IP: {ip})")
                 
                 db.update_device_ping_status(ip, "online")
                 LAST_KNOWN_STATUS[ip] = 'online'
@@ -234,11 +337,14 @@ def check_device_status(device, ping_max_fail, suspend_seconds):
             FAIL_COUNT[ip] = 0
             SUSPEND_UNTIL.pop(ip, None)
 
+    if notification:
+        send_whatsapp_notification(check_setting_key='whatsapp_enabled', **notification)
+
 # --- FUNGSI PENGIRIM API (Tugas Antrean) ---
 
 def download_image_from_event(event):
     """
-    Mencoba mengunduh gambar event jika ada.
+    Mencoba mengunduh gambar event jika ada, lewat klien ISAPI bersama (session keep-alive per perangkat).
     Menggunakan pengaturan dari DB.
     """
     pictureURL = event.get('pictureURL')
@@ -246,7 +352,7 @@ def download_image_from_event(event):
         log_system(f"Event {event['id']} tidak punya pictureURL.", "WARN")
         return None
         
-    auth = HTTPDigestAuth(event['deviceUsername'], event['devicePassword'])
+    device = {'ip': event['deviceIp'], 'username': event['deviceUsername'], 'password': event['devicePassword']}
     
     # --- PENGATURAN BARU DARI DB ---
     try:
@@ -257,140 +363,506 @@ def download_image_from_event(event):
         timeout = 30
     # -------------------------------
 
-    for attempt in range(1, max_retries + 1): # <-- Menggunakan var
-        try:
-            r_img = requests.get(pictureURL, auth=auth, timeout=timeout) # <-- Menggunakan var
-            if r_img.status_code == 200:
-                return r_img.content
-            log_system(f"Gagal unduh gambar (event {event['id']}) (HTTP {r_img.status_code}).", "WARN")
-        except requests.exceptions.RequestException as e:
-            log_system(f"Error koneksi saat unduh gambar (event {event['id']}): {e}", "WARN")
-        time.sleep(1) # Jeda 1 detik antar retry
+    try:
+        # Retry (error koneksi/timeout & 404 gambar belum siap, 408, 429, 5xx) ditangani isapi_client
+        r_img = isapi_client.get_client(device).get(pictureURL, timeout=timeout, retries=max_retries - 1,
+                                                    retry_statuses=isapi_client.DOWNLOAD_RETRY_STATUSES)
+        if r_img.status_code == 200:
+            return r_img.content
+        log_system(f"Gagal unduh gambar (event {event['id']}) (HTTP {r_img.status_code}).", "WARN")
+    except requests.exceptions.RequestException as e:
+        log_system(f"Error koneksi saat unduh gambar (event {event['id']}): {e}", "WARN")
     return None
 
+def get_retry_delay(retry_count):
+    """
+    Jeda (detik) sebelum percobaan ke-(retry_count + 1): backoff eksponensial dari api_retry_base_seconds,
+    dibatasi api_retry_max_seconds, dengan jitter 50-100% agar event yang gagal bersamaan tidak menyerbu serentak.
+    """
+    try:
+        base = int(db.get_setting('api_retry_base_seconds', '10'))
+        cap = int(db.get_setting('api_retry_max_seconds', '600'))
+    except ValueError:
+        base, cap = 10, 600
+    delay = min(cap, base * (2 ** max(retry_count - 1, 0)))
+    return max(1, int(math.ceil(random.uniform(delay / 2.0, delay))))
+
+def finish_api_event(event_id, status, retry_count):
+    """Menyimpan hasil pengiriman jika lease event masih milik worker ini. Status 'failed' dijadwalkan ulang (backoff)."""
+    retry_delay = get_retry_delay(retry_count) if status == 'failed' else None
+    if status != 'failed':
+        with PAYLOAD_CACHE_LOCK:
+            PAYLOAD_CACHE.pop(event_id, None)
+    if db.update_event_api_status(event_id, status, retry_count, WORKER_ID, retry_delay):
+        return True
+    log_system(f"Lease event {event_id} sudah kedaluwarsa/diambil worker lain, hasil '{status}' tidak disimpan.", "WARN")
+    return False
+
+def record_target_result(target, healthy):
+    """Melaporkan hasil request ke circuit breaker target dan mencatat perubahan statusnya."""
+    if healthy:
+        if target.breaker.record_success():
+            log_system(f"Target API {target.url} pulih, pengiriman dilanjutkan (breaker CLOSED).", "INFO")
+    elif target.breaker.record_failure():
+        log_system(f"Target API {target.url} bermasalah, event ditunda {target.breaker.reset_seconds} detik (breaker OPEN).", "WARN")
+
+# Cache base64 gambar per event (dipakai ulang saat retry mode JSON), dibatasi total ukuran string
+PAYLOAD_CACHE = cachetools.LRUCache(maxsize=API_PAYLOAD_CACHE_BYTES, getsizeof=len)
+PAYLOAD_CACHE_LOCK = threading.Lock()
+
+def get_event_image_source(event):
+    """
+    Sumber gambar event: (path file lokal, None) jika ada di disk, (None, bytes) jika harus diunduh
+    ulang dari perangkat, atau (None, None) jika gambar tidak bisa didapat.
+    """
+    event_id = event['id']
+    if event['localImagePath']:
+        local_path = os.path.join("static", event['localImagePath'])
+        if os.path.isfile(local_path):
+            return local_path, None
+
+    # Jika tidak ada di disk, unduh dari perangkat
+    log_system(f"File lokal tidak ada untuk event {event_id}, mencoba unduh ulang...", "INFO")
+    image_content = download_image_from_event(event)
+    if not image_content:
+        # Ini adalah LOGIKA BARU: jangan berhenti, tapi catat.
+        log_system(f"Gagal mendapatkan gambar untuk event {event_id} (mungkin 404). Mengirim data tanpa gambar.", "WARN")
+    return None, image_content
+
+def get_event_image_base64(event):
+    """Gambar event dalam base64 (None jika tidak ada); hasil disimpan di PAYLOAD_CACHE untuk retry."""
+    with PAYLOAD_CACHE_LOCK:
+        cached = PAYLOAD_CACHE.get(event['id'])
+    if cached is not None:
+        return cached
+
+    local_path, image_content = get_event_image_source(event)
+    if local_path:
+        try:
+            with open(local_path, "rb") as f:
+                image_content = f.read()
+        except Exception as e:
+            log_system(f"Gagal baca file lokal {event['localImagePath']}: {e}", "WARN")
+    if not image_content:
+        return None
+
+    image_base64 = base64.b64encode(image_content).decode('utf-8')
+    try:
+        with PAYLOAD_CACHE_LOCK:
+            PAYLOAD_CACHE[event['id']] = image_base64
+    except ValueError:
+        pass # Lebih besar dari seluruh cache: tidak disimpan
+    return image_base64
+
+def build_api_payload(event, include_picture=True):
+    """
+    Payload JSON satu event untuk target API (gambar base64 jika ada).
+    Akan tetap menghasilkan payload meskipun gambar gagal diunduh ("picture": null).
+    """
+    event_time_obj = datetime.datetime.strptime(f"{event['date']} {event['time']}", "%Y-%m-%d %H:%M:%S")
+    payload = {
+        "device": event["deviceName"],
+        "authId": event["employeeId"],
+        "date": event_time_obj.isoformat(),
+        "picture": None # Default adalah None (null)
+    }
+    if include_picture:
+        payload["picture"] = get_event_image_base64(event)
+    return payload
+
+def build_picture_part(event, name):
+    """Bagian file multipart untuk gambar event (di-stream dari disk), atau None jika tidak ada gambar."""
+    local_path, image_content = get_event_image_source(event)
+    source = local_path or image_content
+    if not source:
+        return None
+    return (name, f"event_{event['id']}.jpg", "image/jpeg", source)
+
+def build_multipart_parts(event):
+    """
+    Mode multipart satu event: field teks device/authId/date + file "picture" (jika ada),
+    tanpa base64 dan tanpa memuat file ke memori.
+    """
+    payload = build_api_payload(event, include_picture=False)
+    parts = [(key, payload[key]) for key in ("device", "authId", "date") if payload[key] is not None]
+    picture = build_picture_part(event, "picture")
+    if picture:
+        parts.append(picture)
+    return parts
+
+def get_request_timeout():
+    try:
+        return int(db.get_setting('request_timeout', '30'))
+    except ValueError:
+        return 30
+
+def fail_api_event(event, api_fail_max_retry, reason):
+    """
+    Mencatat kegagalan kirim (retry dijadwalkan). Jika batas retry tercapai, event dipindah ke
+    dead-letter (apiStatus 'dead' + alasan) dan notifikasi gagal permanen dikirim.
+    """
+    event_id = event['id']
+    retry_count = event['apiRetryCount']
+    log_system(f"API event {event_id} (ke {event['targetApi']}) GAGAL ({reason}). Retry {retry_count + 1}/{api_fail_max_retry}", "WARN")
+    if (retry_count + 1) < api_fail_max_retry:
+        finish_api_event(event_id, 'failed', retry_count + 1)
+        return
+
+    with PAYLOAD_CACHE_LOCK:
+        PAYLOAD_CACHE.pop(event_id, None)
+    if not db.dead_letter_api_event(event_id, WORKER_ID, retry_count + 1, reason):
+        log_system(f"Lease event {event_id} sudah kedaluwarsa/diambil worker lain, event tidak dipindah ke dead-letter.", "WARN")
+        return
+    
+    # --- NOTIFIKASI GAGAL (FORMAT BARU) ---
+    log_system(f"Event {event_id} GAGAL PERMANEN, dipindah ke dead-letter. Mengirim notifikasi.", "ERROR")
+    
+    # Ambil data tambahan
+    location = event.get('location') or '-'
+    waktu_str = event.get('time', 'N/A') + " WIB"
+    
+    message = (
+        f"⚠️ API GAGAL TERKIRIM ⚠️\n\n"
+        f"Id Event: *{event_id}*\n"
+        f"Nama: *{event.get('name') or 'N/A'}*\n"
+        f"Device: *{event.get('deviceName')}*\n"
+        f"Lokasi: *{location}*\n"
+        f"Waktu: {waktu_str}\n\n"
+        f"Event ini gagal terkirim setelah {api_fail_max_retry} kali percobaan."
+    )
+    send_whatsapp_notification(message, 'api_fail_enabled', group_key=f"api_fail|{event.get('targetApi')}",
+                               group_title=f"⚠️ API GAGAL TERKIRIM ⚠️\n\n{{count}} event gagal terkirim setelah {api_fail_max_retry} kali percobaan.",
+                               summary=f"Id {event_id} - *{event.get('name') or 'N/A'}* ({event.get('deviceName')}, {waktu_str})")
+    # --- AKHIR NOTIFIKASI ---
+
+def park_events(events, delay_seconds, batch_waiting=False):
+    for event in events:
+        db.park_api_event(event['id'], WORKER_ID, max(1, int(math.ceil(delay_seconds))), batch_waiting)
+
 # --- FUNGSI process_api_event DIMODIFIKASI ---
-def process_api_event(event, api_fail_max_retry):
+def process_api_event(event, api_fail_max_retry, delivery_format='json'):
     """
     Satu fungsi yang dijalankan di thread untuk memproses satu event API.
     Akan tetap mengirim API meskipun gambar gagal diunduh.
+    delivery_format 'multipart' mengirim gambar sebagai file (stream dari disk) alih-alih base64 di JSON.
     """
     event_id = event['id']
     target_api = event['targetApi']
     retry_count = event['apiRetryCount']
+    target = target_client.get_target(target_api)
+
+    # Target sedang down (breaker OPEN): tunda event tanpa dicoba dan tanpa menambah retry
+    if not target.breaker.allow_request():
+        park_events([event], target.breaker.retry_in())
+        return
     
     try:
-        # 1. Buat payload dasar (data teks)
-        event_time_obj = datetime.datetime.strptime(f"{event['date']} {event['time']}", "%Y-%m-%d %H:%M:%S")
-        payload = {
-            "device": event["deviceName"],
-            "authId": event["employeeId"],
-            "date": event_time_obj.isoformat(),
-            "picture": None # Default adalah None (null)
-        }
-
-        # 2. Coba dapatkan gambar.
-        image_content = None
-        if event['localImagePath'] and os.path.exists(os.path.join("static", event['localImagePath'])):
-            try:
-                with open(os.path.join("static", event['localImagePath']), "rb") as f:
-                    image_content = f.read()
-            except Exception as e:
-                log_system(f"Gagal baca file lokal {event['localImagePath']}: {e}", "WARN")
-
-        # 3. Jika gagal baca lokal (atau tidak ada), unduh dari perangkat
-        if not image_content:
-            log_system(f"File lokal tidak ada untuk event {event_id}, mencoba unduh ulang...", "INFO")
-            image_content = download_image_from_event(event)
-        
-        # 4. Tambahkan gambar ke payload HANYA JIKA ADA
-        if image_content:
-            image_base64 = base64.b64encode(image_content).decode('utf-8')
-            payload["picture"] = image_base64
-        else:
-            # Ini adalah LOGIKA BARU: jangan berhenti, tapi catat.
-            log_system(f"Gagal mendapatkan gambar untuk event {event_id} (mungkin 404). Mengirim data tanpa gambar.", "WARN")
-            # Payload "picture" sudah None
-
-        # 5. Kirim API (dengan atau tanpa gambar)
+        # Kirim API (dengan atau tanpa gambar)
         try:
-            timeout = int(db.get_setting('request_timeout', '30'))
-        except ValueError:
-            timeout = 30
-        
-        r_api = requests.post(target_api, json=payload, timeout=timeout)
+            if delivery_format == 'multipart':
+                r_api = target.post_multipart(build_multipart_parts(event), timeout=get_request_timeout(), slot_held=True)
+            else:
+                r_api = target.post(json=build_api_payload(event), timeout=get_request_timeout(), slot_held=True)
+        except requests.exceptions.RequestException:
+            record_target_result(target, False)
+            raise
+        record_target_result(target, not target_client.is_target_failure(r_api.status_code))
         
         if r_api.status_code in [200, 201]:
             # BERHASIL
             log_system(f"API event {event_id} (ke {target_api}) BERHASIL.", "INFO")
-            db.update_event_api_status(event_id, 'success', retry_count)
+            finish_api_event(event_id, 'success', retry_count)
         else:
             # GAGAL
-            log_system(f"API event {event_id} (ke {target_api}) GAGAL (Status: {r_api.status_code}). Retry {retry_count + 1}/{api_fail_max_retry}", "WARN")
-            db.update_event_api_status(event_id, 'failed', retry_count + 1)
-            
-            # --- NOTIFIKASI GAGAL (FORMAT BARU) ---
-            if (retry_count + 1) >= api_fail_max_retry:
-                log_system(f"Event {event_id} GAGAL PERMANEN. Mengirim notifikasi.", "ERROR")
-                
-                # Ambil data tambahan
-                location = event.get('location') or '-'
-                waktu_str = event.get('time', 'N/A') + " WIB"
-                
-                message = (
-                    f"⚠️ API GAGAL TERKIRIM ⚠️\n\n"
-                    f"Id Event: *{event_id}*\n"
-                    f"Nama: *{event.get('name') or 'N/A'}*\n"
-                    f"Device: *{event.get('deviceName')}*\n"
-                    f"Lokasi: *{location}*\n"
-                    f"Waktu: {waktu_str}\n\n"
-                    f"Event ini gagal terkirim setelah {api_fail_max_retry} kali percobaan."
-                )
-                send_whatsapp_notification(message, 'api_fail_enabled')
-                # --- AKHIR NOTIFIKASI ---
+            fail_api_event(event, api_fail_max_retry, f"Status: {r_api.status_code}")
 
     except requests.exceptions.RequestException as e:
         # Gagal koneksi
-        log_system(f"API event {event_id} GAGAL (Koneksi: {e}). Retry {retry_count + 1}/{api_fail_max_retry}", "WARN")
-        db.update_event_api_status(event_id, 'failed', retry_count + 1)
-        
-        if (retry_count + 1) >= api_fail_max_retry:
-            log_system(f"Event {event_id} GAGAL PERMANEN. Mengirim notifikasi.", "ERROR")
-            
-            # Ambil data tambahan
-            location = event.get('location') or '-'
-            waktu_str = event.get('time', 'N/A') + " WIB"
-
-            message = (
-                f"⚠️ API GAGAL TERKIRIM ⚠️\n\n"
-                f"Id Event: *{event_id}*\n"
-                f"Nama: *{event.get('name') or 'N/A'}*\n"
-                f"Device: *{event.get('deviceName')}*\n"
-                f"Lokasi: *{location}*\n"
-                f"Waktu: {waktu_str}\n\n"
-                f"Event ini gagal terkirim setelah {api_fail_max_retry} kali percobaan."
-            )
-            send_whatsapp_notification(message, 'api_fail_enabled')
+        fail_api_event(event, api_fail_max_retry, f"Koneksi: {e}")
             
     except Exception as e:
-        log_system(f"API event {event_id} GAGAL (Error: {e}). Retry {retry_count + 1}/{api_fail_max_retry}", "ERROR")
-        db.update_event_api_status(event_id, 'failed', retry_count + 1)
+        fail_api_event(event, api_fail_max_retry, f"Error: {e}")
 # --- AKHIR MODIFIKASI FUNGSI ---
 
+# --- MODE BATCH (target di tabel api_targets dengan batchSize > 1) ---
+# Request : POST {"events": [{"eventId": <id>, "device", "authId", "date", "picture"}, ...]}
+#   Format multipart: field "events" (JSON yang sama, "picture" null) + file "picture_<eventId>" per gambar.
+# Respons : {"results": [{"eventId": <id>, "ok": true|false, "error": "..."}]}
+#   Event yang tidak ada di "results" mengikuti status HTTP (2xx = berhasil). Tanpa "results",
+#   status 2xx berarti seluruh batch berhasil.
+def process_api_batch(target_conf, events, api_fail_max_retry, lease_seconds):
+    """Mengirim event untuk satu target batch sebagai satu request dan memetakan hasil per event."""
+    # Lengkapi batch dengan event lain untuk target yang sama (termasuk yang sedang ditahan menunggu batch).
+    # Event tambahan ikut dihitung di pool pengiriman selama batch diproses.
+    topped_up = []
+    if len(events) < target_conf['batchSize']:
+        topped_up = db.claim_api_events(WORKER_ID, target_conf['batchSize'] - len(events), api_fail_max_retry,
+                                        lease_seconds, target_api=target_conf['url'], include_waiting=True)
+        add_in_flight_events(target_conf['url'], len(topped_up))
+    try:
+        send_api_batch(target_conf, events + topped_up, api_fail_max_retry)
+    finally:
+        add_in_flight_events(target_conf['url'], -len(topped_up))
+
+def send_api_batch(target_conf, events, api_fail_max_retry):
+    """Bagian process_api_batch setelah top-up: menahan batch yang belum penuh atau mengirimnya."""
+    target_api = target_conf['url']
+    batch_size = target_conf['batchSize']
+    target = target_client.get_target(target_api)
+
+    # Batch belum penuh: tahan sampai event tertua sudah menunggu batchMaxWaitSeconds
+    oldest = min((e['created_at'] for e in events if e.get('created_at')), default=None)
+    waited = (datetime.datetime.now() - oldest).total_seconds() if oldest else 0
+    if len(events) < batch_size and waited < target_conf['batchMaxWaitSeconds']:
+        park_events(events, target_conf['batchMaxWaitSeconds'] - waited, batch_waiting=True)
+        return
+
+    if not target.breaker.allow_request():
+        park_events(events, target.breaker.retry_in())
+        return
+
+    multipart = target_conf.get('format') == 'multipart'
+    items = []
+    pictures = []
+    ready = []
+    for event in events:
+        try:
+            items.append(dict(build_api_payload(event, include_picture=not multipart), eventId=event['id']))
+            if multipart:
+                picture = build_picture_part(event, f"picture_{event['id']}")
+                if picture:
+                    pictures.append(picture)
+            ready.append(event)
+        except Exception as e:
+            fail_api_event(event, api_fail_max_retry, f"Error: {e}")
+    events = ready
+    if not events:
+        return
+
+    try:
+        if multipart:
+            r_api = target.post_multipart([("events", json.dumps(items))] + pictures, timeout=get_request_timeout(),
+                                          slot_held=True)
+        else:
+            r_api = target.post(json={"events": items}, timeout=get_request_timeout(), slot_held=True)
+    except requests.exceptions.RequestException as e:
+        record_target_result(target, False)
+        for event in events:
+            fail_api_event(event, api_fail_max_retry, f"Koneksi batch: {e}")
+        return
+    record_target_result(target, not target_client.is_target_failure(r_api.status_code))
+
+    batch_ok = r_api.status_code in [200, 201]
+    results = {}
+    if batch_ok:
+        try:
+            body = r_api.json()
+            for item in (body.get('results') or []) if isinstance(body, dict) else []:
+                results[str(item.get('eventId'))] = item
+        except ValueError:
+            pass
+
+    sent = 0
+    for event in events:
+        item = results.get(str(event['id']))
+        ok = batch_ok and (item is None or bool(item.get('ok')))
+        if ok:
+            finish_api_event(event['id'], 'success', event['apiRetryCount'])
+            sent += 1
+        elif item is not None:
+            fail_api_event(event, api_fail_max_retry, f"Ditolak target: {item.get('error') or '-'}")
+        else:
+            fail_api_event(event, api_fail_max_retry, f"Status batch: {r_api.status_code}")
+    log_system(f"Batch {len(events)} event ke {target_api}: {sent} BERHASIL, {len(events) - sent} GAGAL.", "INFO")
+
+# --- JALUR PRIORITAS (realtime didahulukan, catch-up tetap mendapat porsi) ---
+def get_lane_quotas(limit):
+    """Membagi kuota klaim per siklus sesuai lane_weight_*; setiap jalur berbobot > 0 mendapat minimal 1."""
+    try:
+        weight_realtime = max(0, int(db.get_setting('lane_weight_realtime', '4')))
+        weight_catchup = max(0, int(db.get_setting('lane_weight_catchup', '1')))
+    except ValueError:
+        weight_realtime, weight_catchup = 4, 1
+    if weight_realtime + weight_catchup == 0:
+        weight_realtime = 1
+    catchup_quota = limit * weight_catchup // (weight_realtime + weight_catchup)
+    if weight_catchup and limit > 1:
+        catchup_quota = max(catchup_quota, 1)
+    return [('realtime', limit - catchup_quota), ('catch-up', catchup_quota)]
+
+def claim_api_events_by_lane(limit, api_fail_max_retry, lease_seconds):
+    """
+    Klaim berbobot per jalur: realtime diklaim lebih dulu sesuai porsinya, lalu catch-up. Sisa kuota
+    jalur yang kosong diisi jalur lain (backfill), jadi antrean susulan tetap terkuras saat tidak ada event live.
+    """
+    claimed = []
+    quotas = get_lane_quotas(limit)
+    for lane, quota in quotas:
+        if quota > 0:
+            claimed += db.claim_api_events(WORKER_ID, quota, api_fail_max_retry, lease_seconds, sync_type=lane)
+    for lane, _ in quotas:
+        remaining = limit - len(claimed)
+        if remaining <= 0:
+            break
+        claimed += db.claim_api_events(WORKER_ID, remaining, api_fail_max_retry, lease_seconds, sync_type=lane)
+    return claimed
+
+# --- KONKURENSI ADAPTIF (AIMD per target, lihat target_client.ConcurrencyLimiter) ---
+PERSISTED_CONCURRENCY = {} # url -> konkurensi terakhir yang disimpan ke api_targets
+
+def configure_delivery_concurrency():
+    """Menerapkan pengaturan api_concurrency_* ke semua limiter target; mengembalikan (min, max, latency_ms)."""
+    try:
+        minimum = int(db.get_setting('api_concurrency_min', '1'))
+        maximum = int(db.get_setting('api_concurrency_max', '20'))
+        latency_target_ms = int(db.get_setting('api_latency_target_ms', '1000'))
+    except ValueError:
+        minimum, maximum, latency_target_ms = 1, 20, 1000
+    target_client.configure_limiters(minimum, maximum, latency_target_ms)
+    return minimum, maximum, latency_target_ms
+
+def get_claim_limit(api_queue_limit):
+    """Jumlah event per klaim: minimal api_queue_limit, atau total konkurensi semua target jika lebih besar."""
+    with target_client.TARGETS_LOCK:
+        total_concurrency = sum(t.limiter.current for t in target_client.TARGETS.values())
+    return max(api_queue_limit, total_concurrency)
+
+def persist_delivery_concurrency():
+    """Menyimpan konkurensi target yang berubah ke api_targets (terlihat di /api/targets, dipakai saat restart)."""
+    with target_client.TARGETS_LOCK:
+        targets = list(target_client.TARGETS.values())
+    for target in targets:
+        current = target.limiter.current
+        previous = PERSISTED_CONCURRENCY.get(target.url)
+        if current != previous and db.save_api_target_concurrency(target.url, current):
+            PERSISTED_CONCURRENCY[target.url] = current
+            if previous is not None:
+                log_system(f"Konkurensi target {target.url}: {previous} -> {current}.", "INFO")
+
+# --- POOL PENGIRIMAN (satu executor untuk seluruh umur worker) ---
+# Loop utama hanya mengklaim & menyerahkan pekerjaan lalu langsung lanjut; tidak menunggu target paling lambat.
+# Slot limiter konkurensi target diambil SEBELUM task diserahkan ke pool (tanpa menunggu); task yang tidak
+# mendapat slot ditunda sebentar di DB (park). Thread pool tidak pernah menunggu slot target, sehingga
+# target lambat tidak memenuhi pool dan menahan event target lain.
+DELIVERY_EXECUTOR = ThreadPoolExecutor(max_workers=API_DELIVERY_MAX_THREADS, thread_name_prefix="api-delivery")
+DELIVERY_PARK_SECONDS = 1
+DELIVERY_IN_FLIGHT = {} # url -> jumlah event yang sedang diproses pool (termasuk tambahan batch)
+DELIVERY_LOCK = threading.Lock()
+
+def get_in_flight_events():
+    """Jumlah event yang sudah diklaim dan sedang dikirim/menunggu di pool pengiriman."""
+    with DELIVERY_LOCK:
+        return sum(DELIVERY_IN_FLIGHT.values())
+
+def add_in_flight_events(target_api, count):
+    with DELIVERY_LOCK:
+        DELIVERY_IN_FLIGHT[target_api] = DELIVERY_IN_FLIGHT.get(target_api, 0) + count
+
+def submit_delivery(target, event_count, fn, *args):
+    """Menjalankan fn di pool; slot limiter `target` sudah dipegang pemanggil dan dilepas saat task selesai."""
+    add_in_flight_events(target.url, event_count)
+
+    def _done(future):
+        target.limiter.release()
+        add_in_flight_events(target.url, -event_count)
+        error = future.exception()
+        if error:
+            log_system(f"Error pengiriman ke {target.url}: {error}", level="ERROR")
+
+    DELIVERY_EXECUTOR.submit(fn, *args).add_done_callback(_done)
+
+def deliver_api_events(events, api_fail_max_retry, lease_seconds):
+    """
+    Menyerahkan event yang diklaim ke pool pengiriman (tanpa menunggu hasilnya): dikelompokkan per targetApi;
+    target dengan batchSize > 1 dikirim sebagai batch, target lain satu event per request (perilaku lama).
+    Format (json/multipart) per target. Jumlah request bersamaan per target dibatasi limiter adaptif target
+    tersebut; request yang tidak mendapat slot ditunda DELIVERY_PARK_SECONDS detik.
+    """
+    target_confs = db.get_all_api_targets()
+    concurrency_settings = configure_delivery_concurrency()
+    groups = {}
+    for event in events:
+        groups.setdefault(event['targetApi'], []).append(event)
+
+    for target_api, group in groups.items():
+        conf = target_confs.get(target_api)
+        target = target_client.get_target(target_api, (conf or {}).get('concurrency'))
+        target.limiter.configure(*concurrency_settings)
+
+        # Satu task = satu request ke target: (event di dalamnya, fungsi, argumen)
+        if conf and conf['batchSize'] > 1:
+            batches = [group[i:i + conf['batchSize']] for i in range(0, len(group), conf['batchSize'])]
+            tasks = [(batch, process_api_batch, (conf, batch, api_fail_max_retry, lease_seconds)) for batch in batches]
+        else:
+            delivery_format = conf['format'] if conf else 'json'
+            tasks = [([event], process_api_event, (event, api_fail_max_retry, delivery_format)) for event in group]
+
+        for task_events, fn, args in tasks:
+            if target.limiter.try_acquire():
+                submit_delivery(target, len(task_events), fn, *args)
+            else:
+                park_events(task_events, DELIVERY_PARK_SECONDS)
+    persist_delivery_concurrency()
+
+# --- WAKEUP (Sinyal UDP dari sync_service/push_service) ---
+def open_wakeup_socket():
+    """Socket UDP non-blocking untuk sinyal event baru. None jika port tidak bisa dipakai (fallback polling)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # Beberapa worker di host yang sama: kernel membagi sinyal ke salah satu worker
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        sock.bind(WORKER_WAKEUP_LISTEN)
+    except OSError as e:
+        log_system(f"Gagal membuka socket wakeup {WORKER_WAKEUP_LISTEN}: {e}. Hanya mengandalkan polling.", level="WARN")
+        sock.close()
+        return None
+    sock.setblocking(False)
+    return sock
+
+def wait_for_wakeup(sock, timeout):
+    """Menunggu sinyal wakeup maks. `timeout` detik. True jika ada sinyal (semua sinyal tertunda dibuang)."""
+    if sock is None:
+        time.sleep(timeout)
+        return False
+    ready, _, _ = select.select([sock], [], [], timeout)
+    if not ready:
+        return False
+    while True:
+        try:
+            sock.recv(64)
+        except OSError: # BlockingIOError: antrean sinyal sudah kosong
+            return True
+
 # --- MAIN LOOP (WORKER BARU) ---
-def main_worker():
+def main_worker(delivery_only=False):
     db.init_db()
-    log_system("Memulai [Worker Service] - (Ping, Notifikasi, Antrean API, Cleanup)...")
+    if delivery_only:
+        # Instance tambahan: hanya mengirim antrean API (ping, notifikasi status & cleanup tetap di instance utama)
+        log_system(f"Memulai [Worker Service] - mode delivery-only (ID: {WORKER_ID})...")
+    else:
+        log_system(f"Memulai [Worker Service] - (Ping, Notifikasi, Antrean API, Cleanup) (ID: {WORKER_ID})...")
     
     last_ping_time = 0
     last_api_time = 0
     last_cleanup_time = time.time() - 86400 # Set ke kemarin agar langsung jalan
+    wakeup_socket = open_wakeup_socket()
+    if not delivery_only:
+        # Satu thread pengirim WA untuk seluruh antrean notifikasi (instance delivery-only hanya mengantrekan)
+        threading.Thread(target=notifier_loop, name="wa-notifier", daemon=True).start()
+        # Event lama yang sudah habis retry (sebelum ada dead-letter) dipindah agar bisa dikirim ulang dari UI
+        moved = db.dead_letter_exhausted_events(int(db.get_setting('api_fail_max_retry', '5')), 'Melebihi batas retry')
+        if moved:
+            log_system(f"{moved} event gagal permanen lama dipindah ke dead-letter.", "INFO")
+    api_due_now = True # Sinyal wakeup diterima / batch sebelumnya penuh: proses antrean tanpa menunggu interval
+    next_retry_time = None # Waktu retry terjadwal (nextAttemptAt) terdekat
 
     try:
         while True:
             now = time.time()
 
             # --- TUGAS 1: CLEANUP (Setiap 24 jam) ---
-            if (now - last_cleanup_time) > 86400:
+            if not delivery_only and (now - last_cleanup_time) > 86400:
                 try:
                     days_str = db.get_setting('cleanup_days', default='60')
                     days_to_keep = int(days_str)
@@ -402,24 +874,23 @@ def main_worker():
                     deleted_rows, deleted_files = db.cleanup_old_events_and_images(days_to_keep)
                     log_system(f"Cleanup DB & gambar selesai. {deleted_rows} baris event dan {deleted_files} file gambar dihapus.")
                     
+                    deleted_notifications = db.cleanup_notification_queue(days_to_keep)
+                    log_system(f"Cleanup antrean notifikasi selesai. {deleted_notifications} riwayat notifikasi dihapus.")
+                    
                     last_cleanup_time = now
                 except Exception as e:
                     log_system(f"Error saat menjalankan cleanup harian: {e}", level="ERROR")
 
             # --- TUGAS 2: PING PERANGKAT (Sesuai interval) ---
             ping_interval = int(db.get_setting('worker_ping_interval', '10'))
-            if (now - last_ping_time) > ping_interval:
+            if not delivery_only and (now - last_ping_time) > ping_interval:
                 try:
                     ping_max_fail = int(db.get_setting('ping_max_fail', '5'))
                     suspend_seconds = int(db.get_setting('suspend_seconds', '300'))
                     all_devices = db.get_all_devices()
                     
                     if all_devices:
-                        with ThreadPoolExecutor(max_workers=len(all_devices)) as executor:
-                            # Kirim pengaturan sebagai argumen
-                            futures = [executor.submit(check_device_status, device, ping_max_fail, suspend_seconds) for device in all_devices]
-                            for future in futures:
-                                future.result() # Menunggu semua selesai (meskipun tidak mengembalikan apa-apa)
+                        ping_sweep(all_devices, ping_max_fail, suspend_seconds)
                     
                     last_ping_time = now
                 except Exception as e:
@@ -427,28 +898,43 @@ def main_worker():
 
             # --- TUGAS 3: PROSES ANTREAN API (Sesuai interval) ---
             api_interval = int(db.get_setting('worker_api_interval', '15'))
-            if (now - last_api_time) > api_interval:
+            retry_due = next_retry_time is not None and now >= next_retry_time
+            if api_due_now or retry_due or (now - last_api_time) > api_interval:
+                api_due_now = False
                 try:
                     api_fail_max_retry = int(db.get_setting('api_fail_max_retry', '5'))
                     # --- PENGATURAN BARU DARI DB ---
                     api_queue_limit = int(db.get_setting('api_queue_limit', '5'))
+                    lease_seconds = int(db.get_setting('api_lease_seconds', '120'))
                     # -------------------------------
                     
-                    events_to_send = db.get_pending_api_events(limit=api_queue_limit, max_retries=api_fail_max_retry) # <-- Menggunakan var
+                    # Klaim dengan lease: worker lain (proses/node) tidak akan mengambil event yang sama.
+                    # Event yang masih di pool pengiriman mengurangi jatah klaim siklus ini.
+                    claim_limit = get_claim_limit(api_queue_limit) - get_in_flight_events()
+                    events_to_send = []
+                    if claim_limit > 0:
+                        events_to_send = claim_api_events_by_lane(claim_limit, api_fail_max_retry, lease_seconds)
+                    pool_full = claim_limit <= 0
                     
                     if events_to_send:
                         log_system(f"Mengambil {len(events_to_send)} event dari antrean API untuk diproses...", "INFO")
-                        with ThreadPoolExecutor(max_workers=5) as executor: # max_workers 5 tetap (aman)
-                            futures = [executor.submit(process_api_event, event, api_fail_max_retry) for event in events_to_send]
-                            for future in futures:
-                                future.result()
+                        deliver_api_events(events_to_send, api_fail_max_retry, lease_seconds)
+                        # Batch penuh: kemungkinan masih ada antrean, lanjutkan tanpa jeda
+                        api_due_now = len(events_to_send) >= claim_limit
                     
+                    # Bangun lagi tepat saat retry terjadwal terdekat jatuh tempo (bukan menunggu interval)
+                    retry_delay = None if api_due_now else db.get_next_api_attempt_delay(api_fail_max_retry)
+                    if pool_full:
+                        # Pool pengiriman penuh: cek lagi begitu kemungkinan ada slot kosong
+                        retry_delay = DELIVERY_PARK_SECONDS
+                    next_retry_time = None if retry_delay is None else time.time() + max(retry_delay, 1)
                     last_api_time = now
                 except Exception as e:
                     log_system(f"Error di loop API: {e}", level="ERROR")
             
-            # Jeda 1 detik sebelum loop berikutnya
-            time.sleep(1) 
+            # Jeda maks. 1 detik sebelum loop berikutnya, atau langsung lanjut saat ada sinyal event baru
+            if not api_due_now:
+                api_due_now = wait_for_wakeup(wakeup_socket, 1)
             
     except KeyboardInterrupt:
         log_system("Worker Service dihentikan oleh pengguna.")
@@ -458,4 +944,7 @@ def main_worker():
 
 # --- ENTRY POINT ---
 if __name__ == "__main__":
-    main_worker()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Worker Service (ping, notifikasi, antrean API, cleanup).")
+    parser.add_argument('--delivery-only', action='store_true',
+                        help="Hanya mengirim antrean API; jalankan beberapa instance untuk menambah throughput")
+    main_worker(delivery_only=parser.parse_args().delivery_only)
\ No newline at end of file